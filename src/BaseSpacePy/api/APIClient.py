@@ -7,38 +7,175 @@ import urllib.request, urllib.error, urllib.parse
 import io
 import io
 import json
-from subprocess import *
-import subprocess
+import http.client
+import datetime
+import importlib
+import hashlib
 import dateutil.parser
 from warnings import warn
 from BaseSpacePy.model import *
-from BaseSpacePy.api.BaseSpaceException import RestMethodException, ServerResponseException
+from BaseSpacePy.api.BaseSpaceException import RestMethodException, ServerResponseException, CacheMissException
+from BaseSpacePy.api.ConnectionPool import ConnectionPool
+
+# native python types that swaggerTypes may name, in any letter case (eg. 'list<Str>')
+NATIVE_TYPES = {'str': str, 'int': int, 'float': float, 'bool': bool}
+
+# marks a value that is left out of a deserialized object (unrecognized dynamic types)
+SKIP = object()
+
+
+def resolveType(name):
+    '''
+    Returns the native python type or model class for a type name from swaggerTypes
+
+    :param name: a type name, eg. 'int', 'Str' or 'Project'
+    :raises NameError: if name is neither a native type nor a model class
+    :returns: a native python type or a model class
+    '''
+    if name.lower() in NATIVE_TYPES:
+        return NATIVE_TYPES[name.lower()]
+    try:
+        return getattr(importlib.import_module('BaseSpacePy.model.' + name), name)
+    except (ImportError, AttributeError):
+        raise NameError("Unrecognized type name '%s'" % name)
+
+
+def parseDatetime(value):
+    '''
+    Parses an ISO 8601 date from the server, falling back on dateutil for other formats
+    '''
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        return dateutil.parser.parse(value)
+
+
+class DeserializationPlan(object):
+    '''
+    The compiled form of a model class's swaggerTypes: one converter per attribute,
+    built once per class, so that deserializing an object needs no type-name parsing.
+
+    For every swaggerType in the class that is also in the passed-in obj,
+    set the instance value for native python types,
+    or recursively deserialize class instances.
+    For dynamic types, substitute real class after looking up 'Type' value.
+    For lists, deserialize all members of a list, including lists of lists (though not list of list of list...).
+    For datetimes, convert to a datetime object.
+    '''
+    _plans = {}
+
+    @classmethod
+    def forClass(cls, objClass):
+        '''
+        Returns the (cached) plan for a model class
+        '''
+        try:
+            return cls._plans[objClass]
+        except KeyError:
+            return cls._plans.setdefault(objClass, cls(objClass))
+
+    def __init__(self, objClass):
+        self.objClass = objClass
+        # all instances share the class's swaggerTypes, instead of building a new dict per object
+        self.swaggerTypes = objClass().swaggerTypes
+        self.converters = [(attr, self._converter(attrType)) for attr, attrType in self.swaggerTypes.items()]
+
+    def deserialize(self, obj):
+        instance = self.objClass.__new__(self.objClass)
+        instance.swaggerTypes = self.swaggerTypes
+        for attr, convert in self.converters:
+            if attr in obj:
+                value = obj[attr]
+                if convert is not None:
+                    value = convert(value)
+                    if value is SKIP:
+                        continue
+                setattr(instance, attr, value)
+        return instance
+
+    def _converter(self, attrType):
+        '''
+        Returns a function converting a json value to the given type, or None for values used as they are
+        '''
+        if attrType == 'dict':
+            return None
+        if attrType == 'datetime':
+            return parseDatetime
+        if attrType == 'DynamicType':
+            return self._dynamicConverter()
+        if attrType.startswith('list<'):
+            if attrType[5:-1] == 'DynamicType':
+                convert = self._dynamicConverter()
+                return lambda value: [v for v in map(convert, value) if v is not SKIP]
+            convert = self._converter(attrType[5:-1])
+            if convert is None:
+                # eg. list<dict>, the parsed json is kept as it is
+                return None
+            return lambda value: [convert(v) for v in value]
+        # list of lists (e.g. map[] property type)
+        if attrType.startswith('listoflists<'):
+            convert = self._converter(attrType[12:-1])
+            return lambda value: [[convert(v) for v in inner] for inner in value]
+        subClass = resolveType(attrType)
+        if subClass in NATIVE_TYPES.values():
+            return subClass
+        # look up the plan on first use, since models may refer to each other
+        return lambda value: DeserializationPlan.forClass(subClass).deserialize(value)
+
+    def _dynamicConverter(self):
+        '''
+        Returns a function that deserializes a value into the model named by the
+        class's _dynamicType for the value's 'Type', or returns SKIP for unrecognized types
+        '''
+        dynamicType = self.objClass._dynamicType
+        def convert(value):
+            try:
+                subClass = dynamicType[value['Type']]
+            except KeyError:
+                # suppress this warning, which is caused by a bug in BaseSpace
+                #warn("Warning - unrecognized dynamic type: " + value['Type'])
+                return SKIP
+            return DeserializationPlan.forClass(resolveType(subClass)).deserialize(value)
+        return convert
 
 
 class APIClient:
-    def __init__(self, AccessToken, apiServerAndVersion, userAgent=None, timeout=10):
+    def __init__(self, AccessToken, apiServerAndVersion, userAgent=None, timeout=10, poolSize=10, cache=None):
         '''
         Initialize the API instance
         
         :param AccessToken: an access token
         :param apiServerAndVersion: the URL of the BaseSpace api server with api version
         :param timeout: (optional) the timeout in seconds for each request made, default 10
+        :param poolSize: (optional) the number of idle keep-alive connections kept per host, default 10
+        :param cache: (optional) a ResponseCache for responses to GET calls, default None (no caching)
         '''
         self.apiKey = AccessToken
         self.apiServerAndVersion = apiServerAndVersion
         self.userAgent = userAgent
         self.timeout = timeout
+        self.pool = ConnectionPool(maxSize=poolSize, timeout=timeout)
+        self.cache = cache
 
-    def __forcePostCall__(self, resourcePath, postData, headers):
+    def cacheScope(self):
+        '''
+        Returns the part of cache keys that separates the responses of different api servers and users:
+        the server and version, and a digest of the access token
         '''
-        For forcing a REST POST request using pycurl (seems to be used when POSTing with no post data)
+        return self.apiServerAndVersion + ' ' + hashlib.sha256(self.apiKey.encode('utf-8')).hexdigest()[:16]
+
+    def __forcePostCall__(self, resourcePath, postData, headers, timeout=None):
+        '''
+        For forcing a REST POST request with the query parameters also sent as post data (seems to be used when POSTing with no post data)
                 
         :param resourcePath: the url to call, including server address and api version
         :param postData: a dictionary of data to post
         :param headers: a dictionary of header key/values to include in call
+        :param timeout: (optional) the timeout in seconds for the call, default is the timeout of the APIClient
         :returns: server response (a string containing json)
         '''
-        import requests
+        if timeout is None:
+            timeout = self.timeout
         # pycurl is hard to get working, so best to cauterise it into only the functions where it is needed
         # import pycurl
         # postData = [(p,postData[p]) for p in postData]
@@ -55,24 +192,56 @@ class APIClient:
         # return response.getvalue()
         encodedPost =  urllib.parse.urlencode(postData)
         resourcePath = "%s?%s" % (resourcePath, encodedPost)
-        response = requests.post(resourcePath, data=json.dumps(postData), headers=headers)
-        return response.text
+        with self.pool.urlopen('POST', resourcePath, body=json.dumps(postData), headers=headers, timeout=timeout) as response:
+            return response.read().decode('utf-8')
 
-    def __putCall__(self, resourcePath, headers, transFile):
+    def __putCall__(self, resourcePath, headers, transFile, timeout=None):
         '''
-        Performs a REST PUT call to the API server.
+        Performs a REST PUT call to the API server, streaming the request body on a pooled connection.
         
         :param resourcePath: the url to call, including server address and api version        
         :param headers: a dictionary of header key/values to include in call        
-        :param transFile: the name of the file containing only data to be PUT
-        :returns: server response (a string containing upload status message (from curl?) followed by json response)
+        :param transFile: the data to be PUT: the name of a file, bytes, or a binary file-like object (read from its current position to the end, or to the Content-Length in headers)
+        :param timeout: (optional) the timeout in seconds for the call, default is the timeout of the APIClient
+        :raises ServerResponseException: for errors in parsing json response from server, and for connection errors
+        :returns: server response deserialized to a python object (dict)
         '''
-        headerPrep  = [k + ':' + headers[k] for k in list(headers.keys())]        
-        cmd = 'curl -H "x-access-token:' + self.apiKey + '" -H "Content-MD5:' + headers['Content-MD5'].strip() +'" -T "'+ transFile +'" -X PUT ' + resourcePath
-        p = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=STDOUT, close_fds=True)
-        return p.stdout.read()
+        if timeout is None:
+            timeout = self.timeout
+        headers = dict(headers)
+        fp = None
+        try:
+            if isinstance(transFile, str):
+                fp = body = open(transFile, 'rb')
+                length = os.fstat(fp.fileno()).st_size
+            elif isinstance(transFile, (bytes, bytearray, memoryview)):
+                body = transFile
+                length = len(transFile)
+            else:
+                body = transFile
+                if 'Content-Length' in headers:
+                    length = int(headers['Content-Length'])
+                else:
+                    start = body.tell()
+                    length = body.seek(0, os.SEEK_END) - start
+                    body.seek(start)
+            headers['Content-Length'] = str(length)
+            with self.pool.urlopen('PUT', resourcePath, body=body, headers=headers, timeout=timeout) as resp:
+                response = resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise ServerResponseException('URLError: ' + str(e))
+        finally:
+            if fp is not None:
+                fp.close()
+        # throttling and server errors often have no json body; raise them with the status for retry decisions
+        if resp.status == 429 or resp.status >= 500:
+            raise ServerResponseException('HTTP status %d: %s' % (resp.status, resp.reason), resp.status, resp.headers.get('Retry-After'))
+        try:
+            return json.loads(response)
+        except ValueError as e:
+            raise ServerResponseException('Error decoding json in server response')
 
-    def callAPI(self, resourcePath, method, queryParams, postData, headerParams=None, forcePost=False):
+    def callAPI(self, resourcePath, method, queryParams, postData, headerParams=None, forcePost=False, timeout=None):
         '''
         Call a REST API and return the server response.
         
@@ -80,18 +249,32 @@ class APIClient:
         If a Content-Type header isn't included, one will be added with 'application/json' (except for PUT and forcePost calls).
         Query parameters with values of None aren't sent to the server.
         Server errors are to be handled by the caller (returned response contains error codes/msgs).
+        If the APIClient has a cache, successful GET responses are cached, and POST and PUT calls
+        invalidate the cached responses for the resource they change.
         
         :param resourcePath: the url to call, not including server address and api version
         :param method: REST method, including GET, POST (and forcePost, see below), and PUT (DELETE not yet supported)
         :param queryParams: dictionary of query parameters to be added to url, except for forcePost where they are added as 'postData'; not used for PUT calls
-        :param postData: for POST calls, a dictionary to post; not used for forcePost calls; for PUT calls, name of file to put
+        :param postData: for POST calls, a dictionary to post; not used for forcePost calls; for PUT calls, name of file to put (or bytes, or a binary file-like object)
         :param headerParams: (optional) a dictionary of header data, default None
-        :param forcePost: (optional) 'force' a POST call using curl (instead of urllib), default False
+        :param forcePost: (optional) 'force' a POST call, sending the query parameters as post data, default False
+        :param timeout: (optional) the timeout in seconds for this call, default is the timeout of the APIClient
 
         :raises RestMethodException: for unrecognized REST method
         :raises ServerResponseException: for errors in parsing json response from server, and for urlerrors from the opening url
+        :raises CacheMissException: in the offline mode of the cache, for responses that aren't cached
         :returns: Server response deserialized to a python object (dict)
         '''
+        if timeout is None:
+            timeout = self.timeout
+        cacheKey = None
+        if self.cache is not None and method == 'GET':
+            cacheKey = self.cache.key(resourcePath, queryParams, self.cacheScope())
+            cached = self.cache.get(cacheKey)
+            if cached is not None:
+                return json.loads(cached)
+            if self.cache.offline:
+                raise CacheMissException(resourcePath)
         url = self.apiServerAndVersion + resourcePath
         headers = {}
         if self.userAgent:
@@ -114,8 +297,11 @@ class APIClient:
                     if value != None:
                         sentQueryParams[param] = value
                 url = url + '?' + urllib.parse.urlencode(sentQueryParams)
-            request = urllib.request.Request(url=url, headers=headers)
         elif method in ['POST', 'PUT', 'DELETE']:
+            if self.cache is not None:
+                if self.cache.offline:
+                    raise CacheMissException(method + ' ' + resourcePath)
+                self.cache.invalidate(resourcePath)
             if queryParams:
                 # Need to remove None values, these should not be sent
                 sentQueryParams = {}
@@ -125,127 +311,55 @@ class APIClient:
                 forcePostUrl = url 
                 url = url + '?' + urllib.parse.urlencode(sentQueryParams)
             data = postData
-            if data:
-                if type(postData) not in [str, int, float, bool]:
-                    data = json.dumps(postData)
+            if data is not None and type(postData) not in [str, bytes] and method != 'PUT':
+                data = json.dumps(postData)
             if not forcePost:
-                if data and not len(data): 
+                if data is not None and method != 'PUT' and not len(data): 
                     data='\n' # temp fix, in case is no data in the file, to prevent post request from failing
-                request = urllib.request.Request(url=url, headers=headers, data=data)#,timeout=self.timeout)
-            else:                                    # use pycurl to force a post call, even w/o data
-                response = self.__forcePostCall__(forcePostUrl, sentQueryParams, headers)
-            if method in ['PUT', 'DELETE']: #urllib doesnt do put and delete, default to pycurl here
+            else:                                    # force a post call, even w/o data
+                try:
+                    response = self.__forcePostCall__(forcePostUrl, sentQueryParams, headers, timeout=timeout)
+                except (OSError, http.client.HTTPException) as e:
+                    raise ServerResponseException('URLError: ' + str(e))
+            if method in ['PUT', 'DELETE']:
                 if method == 'DELETE':
                     raise NotImplementedError("DELETE REST API calls aren't currently supported")
-                response = self.__putCall__(url, headers, data)
-                response =  response.split()[-1] # discard upload status msg (from curl put?)                
+                return self.__putCall__(url, headers, data, timeout=timeout)
         else:
             raise RestMethodException('Method ' + method + ' is not recognized.')
 
-        # Make the request
+        # Make the request on a pooled keep-alive connection
         if not forcePost and not method in ['PUT', 'DELETE']: # the normal case
             try:
-             response = urllib.request.urlopen(request, timeout=self.timeout).read()
-            except urllib.error.HTTPError as e:                
-                response = e.read() # treat http error as a response (handle in caller)                
-            except urllib.error.URLError as e:
-                raise ServerResponseException('URLError: ' + str(e))            
+                with self.pool.urlopen(method, url, body=data, headers=headers, timeout=timeout) as resp:
+                    response = resp.read() # http errors are treated as a response (handle in caller)
+                    status = resp.status
+            except (OSError, http.client.HTTPException) as e:
+                raise ServerResponseException('URLError: ' + str(e))
         try:
             data = json.loads(response)
         except ValueError as e:
             raise ServerResponseException('Error decoding json in server response')
+        if cacheKey is not None and status < 300 and isinstance(data, dict) and not data.get('ResponseStatus', {}).get('ErrorCode'):
+            self.cache.put(cacheKey, response)
         return data            
 
     def deserialize(self, obj, objClass):
         """
         Deserialize a JSON string into a BaseSpacePy object.
 
+        Each model class is compiled once into a deserialization plan (see DeserializationPlan),
+        which is cached and reused for every later object of that class.
+
         :param obj: A dictionary (or object?) to be deserialized into a class (objClass); or a value to be passed into a new native python type (objClass)
         :param objClass: A class object or native python type for the deserialized object, or a string of a class name or native python type. (eg, Project.Project, int, 'Project', 'int') 
         :returns: A deserialized object
         """        
         # Create an object class from objClass, if a string was passed in
-        # Avoid native python types 'file'
-        if type(objClass) == str:            
-            try:
-                if (not str(objClass)=='File'): 
-                    objClass = eval(objClass.lower())
-                else:
-                    objClass = eval(objClass + '.' + objClass)
-            except NameError: # not a native type, must be model class
-                objClass = eval(objClass + '.' + objClass)
+        if type(objClass) == str:
+            objClass = resolveType(objClass)
         
-        # Create an instance of the object class
-        # If the instance is a native python type, return it        
-        if objClass in [str, int, float, bool]:
+        # If the class is a native python type, return a new instance
+        if objClass in NATIVE_TYPES.values():
             return objClass(obj)
-        instance = objClass()
-        
-        # For every swaggerType in the instance that is also in the passed-in obj,
-        # set the instance value for native python types,
-        # or recursively deserialize class instances.
-        # For dynamic types, substitute real class after looking up 'Type' value.
-        # For lists, deserialize all members of a list, including lists of lists (though not list of list of list...).
-        # For datetimes, convert to a readable output string 
-        for attr, attrType in instance.swaggerTypes.items():
-            if attr in obj:
-                value = obj[attr]
-                if attrType in ['str', 'int', 'float', 'bool']:
-                    attrType = eval(attrType)
-                    try:
-                        value = attrType(value)
-                    except UnicodeEncodeError:
-                        value = str(value)
-                    setattr(instance, attr, value)                            
-                elif attrType == 'DynamicType':                                                
-                    try:
-                        model_name = instance._dynamicType[value['Type']]                
-                    except KeyError:
-                        pass
-                        # suppress this warning, which is caused by a bug in BaseSpace
-                        #warn("Warning - unrecognized dynamic type: " + value['Type'])                                                                                    
-                    else:
-                        setattr(instance, attr, self.deserialize(value, model_name))
-                elif 'list<' in attrType:
-                    match = re.match('list<(.*)>', attrType)
-                    subClass = match.group(1)                    
-                    subValues = []                       
-
-                    # lists of dynamic type
-                    if subClass == 'DynamicType':                             
-                        for subValue in value:                            
-                            try:
-                                new_type = instance._dynamicType[subValue['Type']]                                
-                            except KeyError:
-                                pass 
-                                # suppress this warning, which is caused by a bug in BaseSpace
-                                #warn("Warning - unrecognized (list of) dynamic types: " + subValue['Type'])                                
-                            else:
-                                subValues.append(self.deserialize(subValue, new_type)) 
-                        setattr(instance, attr, subValues)
-                    # typical lists
-                    else:                                                                             
-                        for subValue in value:
-                            subValues.append(self.deserialize(subValue, subClass))
-                        setattr(instance, attr, subValues)
-                # list of lists (e.g. map[] property type)
-                elif 'listoflists<' in attrType:
-                    match = re.match('listoflists<(.*)>', attrType)
-                    subClass = match.group(1)                    
-                    outvals = []                
-                    for outval in value:
-                        invals = []
-                        for inval in outval:
-                            invals.append(self.deserialize(inval, subClass))
-                        outvals.append(invals)
-                    setattr(instance, attr, outvals)
-                                            
-                elif attrType=='dict':                                          
-                    setattr(instance, attr, value)
-                elif attrType=='datetime':
-                    dt = dateutil.parser.parse(value)
-                    setattr(instance, attr, dt)
-                else:
-                    # recursive call with attribute type
-                    setattr(instance, attr, self.deserialize(value, attrType))
-        return instance
+        return DeserializationPlan.forClass(objClass).deserialize(obj)
@@ -7,25 +7,38 @@ import io
 import json
 import os
 import inspect
+import time
+import collections
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 from BaseSpacePy.api.APIClient import APIClient
 from BaseSpacePy.api.BaseSpaceException import *
 from BaseSpacePy.model import *
 
+# the page size used when iterating over lists, if no Limit is given (the largest Limit BaseSpace accepts)
+LIST_PAGE_SIZE = 1024
+
+# retries of a list page request that failed with a connection error, and the wait before the first retry (doubled for each retry)
+LIST_PAGE_RETRIES = 3
+LIST_RETRY_WAIT   = 0.5
+
 
 class BaseAPI(object):
     '''
     Parent class for BaseSpaceAPI and BillingAPI classes
     '''
 
-    def __init__(self, AccessToken, apiServerAndVersion, userAgent, timeout=10, verbose=False):
+    def __init__(self, AccessToken, apiServerAndVersion, userAgent=None, timeout=10, verbose=False, poolSize=10, cache=None):
         '''
         :param AccessToken: the current access token
         :param apiServerAndVersion: the api server URL with api version
         :param timeout: (optional) the timeout in seconds for each request made, default 10 
         :param verbose: (optional) prints verbose output, default False
+        :param poolSize: (optional) the number of idle keep-alive connections kept per host, default 10
+        :param cache: (optional) a ResponseCache for responses to GET calls, default None (no caching)
         '''
-        self.apiClient = APIClient(AccessToken, apiServerAndVersion, userAgent=userAgent, timeout=timeout)
+        self.apiClient = APIClient(AccessToken, apiServerAndVersion, userAgent=userAgent, timeout=timeout, poolSize=poolSize, cache=cache)
         self.verbose   = verbose
 
     def __json_print__(self, label, var):
@@ -96,13 +109,39 @@ class BaseAPI(object):
         :raises ServerResponseException: if server returns an error or has no response        
         :returns: a list of instances of the provided model
         '''
+        return self.__listPageRequest__(myModel, resourcePath, method, queryParams, headerParams)[0]
+
+    def __listPageRequest__(self, myModel, resourcePath, method, queryParams, headerParams, retries=0):
+        '''
+        Call a REST API that returns a list, and return one page of the list: the items,
+        deserialized into the provided model, and the page's ResourceList (without its Items).
+        Handles errors from server.
+
+        :param myModel: a Model type to return a list of
+        :param resourcePath: the api url path to call (without server and version)
+        :param method: the REST method type, eg. GET
+        :param queryParams: a dictionary of query parameters
+        :param headerParams: a dictionary of header parameters
+        :param retries: (optional) the number of times to retry after a connection error or an undecodable response, default 0
+
+        :raises ServerResponseException: if server returns an error or has no response        
+        :returns: a tuple of a list of instances of the provided model, and a ResourceList instance
+        '''
         if self.verbose: 
             print ("")
-            print(("* " + inspect.stack()[1][3] + "  (" + str(method) + ")"))  # caller
+            print(("* " + inspect.stack()[2][3] + "  (" + str(method) + ")"))  # caller
             print(('    # Path:      ' + str(resourcePath)))
             print(('    # QPars:     ' + str(queryParams)))
             print(('    # Hdrs:      ' + str(headerParams)))
-        response = self.apiClient.callAPI(resourcePath, method, queryParams, None, headerParams)
+        for attempt in range(retries + 1):
+            try:
+                response = self.apiClient.callAPI(resourcePath, method, queryParams, None, headerParams)
+                break
+            except ServerResponseException:
+                # unlike errors reported by the server, these may succeed on a second try
+                if attempt == retries:
+                    raise
+                time.sleep(LIST_RETRY_WAIT * 2 ** attempt)
         if self.verbose:
             self.__json_print__('    # Response:  ',response)
         if not response: 
@@ -112,8 +151,89 @@ class BaseAPI(object):
         elif 'Message' in response['ResponseStatus']:
             raise ServerResponseException(str(response['ResponseStatus']['Message']))
         
-        respObj = self.apiClient.deserialize(response, ListResponse.ListResponse)
-        return [self.apiClient.deserialize(c, myModel) for c in respObj._convertToObjectList()]
+        # decode the items straight from the parsed json, without building a ListResponse first
+        page = response['Response']
+        items = [self.apiClient.deserialize(c, myModel) for c in page.pop('Items', [])]
+        return items, self.apiClient.deserialize(page, ResourceList.ResourceList)
+
+    def __listIterator__(self, myModel, resourcePath, method, queryParams, headerParams, prefetch=True, workers=1):
+        '''
+        Call a REST API that returns a list, and lazily yield all items of the list, one page at a time.
+        The Limit query parameter, if any, sets the page size (default LIST_PAGE_SIZE) and Offset the first item.
+        Pages are requested until TotalCount items have been returned.
+
+        With prefetch, the next page is requested in a background thread while the current page is consumed,
+        so at most two pages are held in memory, however large the list.
+
+        With more than one worker, the TotalCount of the first page is used to request the remaining pages
+        concurrently, at most workers pages ahead of the page being consumed; items are still returned in the
+        server's sort order. Pages that fail with a connection error are retried on their own (LIST_PAGE_RETRIES times).
+
+        :param myModel: a Model type to return a list of
+        :param resourcePath: the api url path to call (without server and version)
+        :param method: the REST method type, eg. GET
+        :param queryParams: a dictionary of query parameters
+        :param headerParams: a dictionary of header parameters
+        :param prefetch: (optional) request the next page while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, default 1
+
+        :raises ServerResponseException: if server returns an error or has no response        
+        :returns: a generator of instances of the provided model
+        '''
+        offset = int(queryParams.get('Offset', 0))
+        limit = int(queryParams.get('Limit', LIST_PAGE_SIZE))
+
+        def fetch(offset):
+            pageParams = dict(queryParams, Offset=offset, Limit=limit)
+            return self.__listPageRequest__(myModel, resourcePath, method, pageParams, headerParams, retries=LIST_PAGE_RETRIES)
+
+        executor = ThreadPoolExecutor(max_workers=workers) if prefetch or workers > 1 else None
+        try:
+            items, page = fetch(offset)
+            totalCount = getattr(page, 'TotalCount', None)
+            if workers > 1 and totalCount is not None:
+                # the offsets of all remaining pages are known now, fetch them concurrently;
+                # step by the size of the first page, since servers may cap Limit below what was asked for
+                step = len(items)
+                offsets = iter(range(offset + step, totalCount, step) if items else [])
+                pending = collections.deque((o, executor.submit(fetch, o)) for o in itertools.islice(offsets, workers))
+                while True:
+                    for item in items:
+                        yield item
+                    items = page = None
+                    if not pending:
+                        return
+                    offset, future = pending.popleft()
+                    items, page = future.result()
+                    if len(items) < min(step, totalCount - offset):
+                        # a short page would leave a gap before the next offset, carry on one page at a time
+                        for o, future in pending:
+                            future.cancel()
+                        totalCount = getattr(page, 'TotalCount', None)
+                        break
+                    for o in itertools.islice(offsets, 1):
+                        pending.append((o, executor.submit(fetch, o)))
+
+            nextPage = None
+            while True:
+                offset += len(items)
+                # servers that don't report TotalCount are done after the first short page
+                if totalCount is not None:
+                    more = len(items) > 0 and offset < totalCount
+                else:
+                    more = len(items) >= limit
+                if more and executor is not None:
+                    nextPage = executor.submit(fetch, offset)
+                for item in items:
+                    yield item
+                items = page = None
+                if not more:
+                    return
+                items, page = nextPage.result() if executor is not None else fetch(offset)
+                totalCount = getattr(page, 'TotalCount', None)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
 
     def __makeCurlRequest__(self, data, url):
         '''
@@ -157,6 +277,7 @@ class BaseAPI(object):
         :param time: timeout in seconds
         '''        
         self.apiClient.timeout = time
+        self.apiClient.pool.timeout = time
         
     def getAccessToken(self):
         '''
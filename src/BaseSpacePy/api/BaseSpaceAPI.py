@@ -8,7 +8,6 @@ import io
 import json
 import os
 import re
-from tempfile import mkdtemp
 import socket
 import configparser
 import urllib.parse
@@ -17,8 +16,13 @@ import logging
 from BaseSpacePy.api.APIClient import APIClient
 from BaseSpacePy.api.BaseAPI import BaseAPI
 from BaseSpacePy.api.BaseSpaceException import *
+from BaseSpacePy.api.ContentUrlCache import ContentUrlCache, EXPIRED_URL_CODES
+from BaseSpacePy.api.RemoteFile import RemoteFile, RemoteFileStream, DEFAULT_BLOCK_SIZE, RANDOM_ACCESS_BLOCK_SIZE
+from BaseSpacePy.api.ProjectSync import ProjectSync
 from BaseSpacePy.model.MultipartFileTransfer import MultipartUpload as mpu
 from BaseSpacePy.model.MultipartFileTransfer import MultipartDownload as mpd
+from BaseSpacePy.model.MultipartFileTransfer import MultipartStreamUpload as mpsu
+from BaseSpacePy.model.MultipartFileTransfer import UploadSession, Utils, HASH_THREADS, AUTO_UPLOAD_PART_SIZES
 from BaseSpacePy.model.QueryParameters import QueryParameters as qp
 from BaseSpacePy.model import *
 
@@ -32,12 +36,15 @@ webAuthorize               = '/oauth/authorize'
 # https://developer.basespace.illumina.com/docs/content/documentation/rest-api/api-reference#Properties
 PROPERTY_RESOURCE_TYPES = set([ "samples", "appresults", "runs", "appsessions", "projects" ])
 
+# size of the buffer that downloads to a file descriptor are read into
+PWRITE_BLOCK_SIZE = 1024*1024
+
 
 class BaseSpaceAPI(BaseAPI):
     '''
     The main API class used for all communication with the REST server
     '''
-    def __init__(self, clientKey=None, clientSecret=None, apiServer=None, version=None, appSessionId='', AccessToken='', userAgent=None, timeout=10, verbose=0, profile='DEFAULT'):
+    def __init__(self, clientKey=None, clientSecret=None, apiServer=None, version=None, appSessionId='', AccessToken='', userAgent=None, timeout=10, verbose=0, profile='DEFAULT', poolSize=10, cache=None):
         '''
         The following arguments are required in either the constructor or a config file (~/.basespacepy.cfg):        
         
@@ -49,6 +56,8 @@ class BaseSpaceAPI(BaseAPI):
         :param AccessToken: optional, though will be needed for most methods (except to obtain a new access token)
         :param timeout: optional, timeout period in seconds for api calls, default 10 
         :param profile: optional, name of profile in config file, default 'DEFAULT'
+        :param poolSize: optional, the number of idle keep-alive connections kept per host, default 10
+        :param cache: optional, a ResponseCache for responses to GET calls (eg. repeated getFileById calls), default None (no caching)
         '''
         
         cred = self._setCredentials(clientKey, clientSecret, apiServer, version, appSessionId, AccessToken, profile)
@@ -64,7 +73,9 @@ class BaseSpaceAPI(BaseAPI):
         self.weburl         = cred['apiServer'].replace('api.','')
         
         apiServerAndVersion = urllib.parse.urljoin(cred['apiServer'], cred['apiVersion'])
-        super(BaseSpaceAPI, self).__init__(cred['accessToken'], apiServerAndVersion, userAgent, timeout, verbose)
+        super(BaseSpaceAPI, self).__init__(cred['accessToken'], apiServerAndVersion, userAgent, timeout, verbose, poolSize, cache)
+        # signed content urls of files, shared by the ranged requests of downloads
+        self.contentUrls    = ContentUrlCache()
 
     def _setCredentials(self, clientKey, clientSecret, apiServer, apiVersion, appSessionId, accessToken, profile):
         '''
@@ -525,6 +536,24 @@ class BaseSpaceAPI(BaseAPI):
         resourcePath = resourcePath.replace('{Id}',Id)
         return self.__listRequest__(File.File,resourcePath, method, queryParams, headerParams)
 
+    def iterAppResultFilesById(self, Id, queryPars=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of the File objects for an AppResult, requesting one page at a time
+        
+        :param Id: The id of the AppResult
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of File instances
+        '''
+        queryParams = self._validateQueryParameters(queryPars)                
+        resourcePath = '/appresults/{Id}/files'
+        resourcePath = resourcePath.replace('{format}', 'json')
+        method = 'GET'        
+        headerParams = {}
+        resourcePath = resourcePath.replace('{Id}',Id)
+        return self.__listIterator__(File.File,resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getAppResultFiles(self, Id, queryPars=None):
         '''
         * Deprecated in favor of getAppResultFileById() *
@@ -606,6 +635,22 @@ class BaseSpaceAPI(BaseAPI):
         headerParams = {}
         return self.__listRequest__(Project.Project,resourcePath, method, queryParams, headerParams)
        
+    def iterProjectByUser(self, queryPars=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of the available projects for the current User, requesting one page at a time
+        
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of Project instances
+        '''
+        queryParams = self._validateQueryParameters(queryPars)               
+        resourcePath = '/users/current/projects'
+        resourcePath = resourcePath.replace('{format}', 'json')
+        method = 'GET'        
+        headerParams = {}
+        return self.__listIterator__(Project.Project,resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getAccessibleRunsByUser(self, queryPars=None):
         '''
         Returns a list of accessible runs for the current User
@@ -620,6 +665,22 @@ class BaseSpaceAPI(BaseAPI):
         headerParams = {}
         return self.__listRequest__(Run.Run, resourcePath, method, queryParams, headerParams)
     
+    def iterAccessibleRunsByUser(self, queryPars=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of the accessible runs for the current User, requesting one page at a time
+        
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of Run instances
+        '''        
+        queryParams = self._validateQueryParameters(queryPars)               
+        resourcePath = '/users/current/runs'
+        resourcePath = resourcePath.replace('{format}', 'json')
+        method = 'GET'        
+        headerParams = {}
+        return self.__listIterator__(Run.Run, resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getRunById(self, Id, queryPars=None):
         '''        
         Request a run object by Id
@@ -665,6 +726,23 @@ class BaseSpaceAPI(BaseAPI):
         headerParams = {}         
         return self.__listRequest__(File.File,resourcePath, method, queryParams, headerParams)
 
+    def iterRunFilesById(self, Id, queryPars=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of the files associated with a Run, using the Run's Id, requesting one page at a time
+        
+        :param Id: The Id of the run
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of File instances
+        '''        
+        queryParams = self._validateQueryParameters(queryPars)                
+        resourcePath = '/runs/{Id}/files'        
+        method = 'GET'
+        resourcePath = resourcePath.replace('{Id}', Id)            
+        headerParams = {}         
+        return self.__listIterator__(File.File,resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getRunSamplesById(self, Id, queryPars=None):
         '''        
         Request the Samples associated with a Run, using the Run's Id
@@ -680,6 +758,23 @@ class BaseSpaceAPI(BaseAPI):
         headerParams = {}         
         return self.__listRequest__(Sample.Sample,resourcePath, method, queryParams, headerParams)
   
+    def iterRunSamplesById(self, Id, queryPars=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of the Samples associated with a Run, using the Run's Id, requesting one page at a time
+        
+        :param Id: The Id of the run
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of Sample instances
+        '''        
+        queryParams = self._validateQueryParameters(queryPars)                
+        resourcePath = '/runs/{Id}/samples'        
+        method = 'GET'
+        resourcePath = resourcePath.replace('{Id}', Id)            
+        headerParams = {}         
+        return self.__listIterator__(Sample.Sample,resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getAppResultsByProject(self, Id, queryPars=None, statuses=None):
         '''
         Returns a list of AppResult object associated with the project with Id
@@ -700,6 +795,28 @@ class BaseSpaceAPI(BaseAPI):
         resourcePath = resourcePath.replace('{Id}',Id)
         return self.__listRequest__(AppResult.AppResult,resourcePath, method, queryParams, headerParams)
 
+    def iterAppResultsByProject(self, Id, queryPars=None, statuses=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of the AppResult objects associated with the project with Id, requesting one page at a time
+        
+        :param Id: The project id
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param statuses: An (optional) list of AppResult statuses to filter by, eg., 'complete'
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of AppResult instances
+        '''
+        queryParams = self._validateQueryParameters(queryPars) 
+        if statuses is None:
+            statuses = []               
+        resourcePath = '/projects/{Id}/appresults'        
+        method = 'GET'        
+        if len(statuses): 
+            queryParams['Statuses'] = ",".join(statuses)
+        headerParams = {}
+        resourcePath = resourcePath.replace('{Id}',Id)
+        return self.__listIterator__(AppResult.AppResult,resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getSamplesByProject(self, Id, queryPars=None):
         '''
         Returns a list of samples associated with a project with Id
@@ -716,6 +833,24 @@ class BaseSpaceAPI(BaseAPI):
         resourcePath = resourcePath.replace('{Id}',Id)
         return self.__listRequest__(Sample.Sample,resourcePath, method, queryParams, headerParams)
 
+    def iterSamplesByProject(self, Id, queryPars=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of the samples associated with a project with Id, requesting one page at a time
+        
+        :param Id: The id of the project
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of Sample instances
+        '''
+        queryParams = self._validateQueryParameters(queryPars)                
+        resourcePath = '/projects/{Id}/samples'
+        resourcePath = resourcePath.replace('{format}', 'json')
+        method = 'GET'        
+        headerParams = {}
+        resourcePath = resourcePath.replace('{Id}',Id)
+        return self.__listIterator__(Sample.Sample,resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getSampleById(self, Id, queryPars=None):
         '''
         Returns a Sample object
@@ -763,6 +898,24 @@ class BaseSpaceAPI(BaseAPI):
         return self.__listRequest__(File.File,
                                     resourcePath, method, queryParams, headerParams)
 
+    def iterSampleFilesById(self, Id, queryPars=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of the File objects associated with a Sample, requesting one page at a time
+        
+        :param Id: A Sample id
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of File instances
+        '''
+        queryParams = self._validateQueryParameters(queryPars)
+        resourcePath = '/samples/{Id}/files'        
+        method = 'GET'        
+        headerParams = {}
+        resourcePath = resourcePath.replace('{Id}',Id)
+        return self.__listIterator__(File.File,
+                                     resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getFilesBySample(self, Id, queryPars=None):
         '''
         * Deprecated in favor of getSampleFilesById() *
@@ -838,6 +991,22 @@ class BaseSpaceAPI(BaseAPI):
         return self.__listRequest__(GenomeV1.GenomeV1,
                                     resourcePath, method, queryParams, headerParams)
 
+    def iterAvailableGenomes(self, queryPars=None, prefetch=True, workers=1):
+        '''
+        Returns a generator of all available genomes, requesting one page at a time
+        
+        :param queryPars: An (optional) object of type QueryParameters for custom sorting and filtering; Limit sets the page size
+        :param prefetch: (optional) request the next page in the background while the current page is consumed, default True
+        :param workers: (optional) the number of pages to request concurrently, once the first page gives the TotalCount, default 1
+        :returns: a generator of GenomeV1 instances
+        '''        
+        queryParams = self._validateQueryParameters(queryPars)
+        resourcePath = '/genomes'
+        method = 'GET'
+        headerParams = {}
+        return self.__listIterator__(GenomeV1.GenomeV1,
+                                     resourcePath, method, queryParams, headerParams, prefetch=prefetch, workers=workers)
+
     def getIntervalCoverage(self, Id, Chrom, StartPos, EndPos):
         '''
         Returns metadata about an alignment, including max coverage and cov granularity.
@@ -971,22 +1140,29 @@ class BaseSpaceAPI(BaseAPI):
         return self.__singleRequest__(AppResultResponse.AppResultResponse,
                                       resourcePath, method, queryParams, headerParams, postData=postData)
             
-    def appResultFileUpload(self, Id, localPath, fileName, directory, contentType):
+    def appResultFileUpload(self, Id, localPath, fileName, directory, contentType, pool=None):
         '''
         Uploads a file associated with an AppResult to BaseSpace and returns the corresponding file object.
         Small files are uploaded with a single-part upload method, while larger files (> 25 MB) are uploaded
         with multipart upload.
         
         :param Id: AppResult id.
-        :param localPath: The local path to the file to be uploaded, including file name.
+        :param localPath: The local path to the file to be uploaded, including file name, or a binary file-like object or iterator of bytes to upload with multipartStreamUpload()
         :param fileName: The desired filename in the AppResult folder on the BaseSpace server.
         :param directory: The directory the file should be placed in on the BaseSpace server.
         :param contentType: The content-type of the file, eg. 'text/plain' for text files, 'application/octet-stream' for binary files
+        :param pool: (optional) a TransferPool to upload the parts of a large file with (not a stream)
+        :raises IllegalParameterException: if pool is given with a stream
         :returns: a newly created File instance    
         '''
+        if not isinstance(localPath, str):
+            if pool is not None:
+                # pool workers read parts from offsets of a local file, a stream is uploaded by threads of its own
+                raise IllegalParameterException('pool', "None when uploading a stream")
+            return self.multipartStreamUpload('appresults', Id, localPath, fileName, directory, contentType)
         multipart_min_file_size = 25000000 # bytes
         if os.path.getsize(localPath) > multipart_min_file_size:
-            return self.multipartFileUpload('appresults',Id, localPath, fileName, directory, contentType)
+            return self.multipartFileUpload('appresults',Id, localPath, fileName, directory, contentType, pool=pool)
         else:
             return self.__singlepartFileUpload__('appresults',Id, localPath, fileName, directory, contentType)
 
@@ -1041,22 +1217,29 @@ class BaseSpaceAPI(BaseAPI):
         return self.__singleRequest__(SampleResponse.SampleResponse,
                                       resourcePath, method, queryParams, headerParams, postData=postData)
 
-    def sampleFileUpload(self, Id, localPath, fileName, directory, contentType):
+    def sampleFileUpload(self, Id, localPath, fileName, directory, contentType, pool=None):
         '''
         Uploads a file associated with a Sample to BaseSpace and returns the corresponding file object.
         Small files are uploaded with a single-part upload method, while larger files (> 25 MB) are uploaded
         with multipart upload.
 
         :param Id: Sample id.
-        :param localPath: The local path to the file to be uploaded, including file name.
+        :param localPath: The local path to the file to be uploaded, including file name, or a binary file-like object or iterator of bytes to upload with multipartStreamUpload()
         :param fileName: The desired filename in the Sample folder on the BaseSpace server.
         :param directory: The directory the file should be placed in on the BaseSpace server.
         :param contentType: The content-type of the file, eg. 'text/plain' for text files, 'application/octet-stream' for binary files
+        :param pool: (optional) a TransferPool to upload the parts of a large file with (not a stream)
+        :raises IllegalParameterException: if pool is given with a stream
         :returns: a newly created File instance
         '''
+        if not isinstance(localPath, str):
+            if pool is not None:
+                # pool workers read parts from offsets of a local file, a stream is uploaded by threads of its own
+                raise IllegalParameterException('pool', "None when uploading a stream")
+            return self.multipartStreamUpload('samples', Id, localPath, fileName, directory, contentType)
         multipart_min_file_size = 25000000 # bytes
         if os.path.getsize(localPath) > multipart_min_file_size:
-            return self.multipartFileUpload('samples',Id, localPath, fileName, directory, contentType)
+            return self.multipartFileUpload('samples',Id, localPath, fileName, directory, contentType, pool=pool)
         else:
             return self.__singlepartFileUpload__('samples',Id, localPath, fileName, directory, contentType)
 
@@ -1084,7 +1267,8 @@ class BaseSpaceAPI(BaseAPI):
         queryParams['directory']     = directory 
         headerParams                 = {}
         headerParams['Content-Type'] = contentType
-        postData                     = open(localPath).read()
+        with open(localPath, 'rb') as fp:
+            postData                 = fp.read()
         return self.__singleRequest__(FileResponse.FileResponse,
                                       resourcePath, method, queryParams, headerParams, postData=postData)
 
@@ -1117,14 +1301,15 @@ class BaseSpaceAPI(BaseAPI):
         return self.__singleRequest__(FileResponse.FileResponse,
                                       resourcePath, method, queryParams, headerParams, postData=postData, forcePost=1)
 
-    def __uploadMultipartUnit__(self, Id, partNumber, md5, data):
+    def __uploadMultipartUnit__(self, Id, partNumber, md5, data, timeout=None):
         '''
         Uploads file part for multipart upload
         
         :param Id: file id 
         :param partNumber: the file part to be uploaded
         :param md5: md5 sum of datastream
-        :param data: the name of the file containing only data to be uploaded
+        :param data: the name of the file containing only data to be uploaded, or the data itself as bytes or a binary file-like object
+        :param timeout: (optional) the timeout in seconds for uploading this part, default is the timeout of the api
         :returns: A dictionary of the server response, with a 'Response' key that contains a dict, which contains an 'ETag' key and value on success. On failure, this method returns None 
         '''
         method                       = 'PUT'
@@ -1133,7 +1318,7 @@ class BaseSpaceAPI(BaseAPI):
         resourcePath                 = resourcePath.replace('{partNumber}', str(partNumber))
         queryParams                  = {}
         headerParams                 = {'Content-MD5':md5.strip()}
-        return self.apiClient.callAPI(resourcePath, method, queryParams, data, headerParams=headerParams, forcePost=0)        
+        return self.apiClient.callAPI(resourcePath, method, queryParams, data, headerParams=headerParams, forcePost=0, timeout=timeout)
 
     def __finalizeMultipartFileUpload__(self, Id):
         '''
@@ -1152,9 +1337,14 @@ class BaseSpaceAPI(BaseAPI):
         return self.__singleRequest__(FileResponse.FileResponse,
                                       resourcePath, method, queryParams, headerParams, postData=postData, forcePost=1)
 
-    def multipartFileUpload(self, resourceType, resourceId, localPath, fileName, directory, contentType, tempDir=None, processCount=10, partSize=25):
+    def multipartFileUpload(self, resourceType, resourceId, localPath, fileName, directory, contentType, tempDir=None, processCount=10, partSize=25, resume=False, maxProcessCount=16, retryPolicy=None, pool=None):
         '''
         Method for multi-threaded file-upload for parallel transfer of very large files (currently only runs on unix systems)
+
+        With resume, the upload is recorded in a session file beside the local file (with an '.upload' extension), which
+        is removed once the upload is complete, and an interrupted upload of the same local file to the same destination,
+        with the same part size, continues into the same BaseSpace File, sending only the parts that the server hasn't
+        accepted or that no longer match the local file. Without resume, nothing is written beside the local file.
         
         :param resourceType: resource type for the property
         :param resourceId: identifier for the resource
@@ -1162,21 +1352,79 @@ class BaseSpaceAPI(BaseAPI):
         :param fileName: The desired filename on the server
         :param directory: The desired directory name on the server (empty string will place it in the root directory)
         :param contentType: The content type of the file
-        :param tempdir: (optional) Temp directory to use for temporary file chunks to upload
-        :param processCount: (optional) The number of processes to be used, default 10
-        :param partSize: (optional) The size in MB of individual upload parts (must be >5 Mb and <=25 Mb), default 25
+        :param tempDir: (optional) no longer used, parts are read directly from the local file
+        :param processCount: (optional) The number of processes to be used, or 'auto' to adapt the number of parts uploaded at once to the measured throughput (up to maxProcessCount), default 10
+        :param partSize: (optional) The size in MB of individual upload parts (must be >5 Mb and <=25 Mb), or 'auto' to choose it from the file size, default 25
+        :param resume: (optional) continue an interrupted upload of the same file, default False
+        :param maxProcessCount: (optional) The most processes to use when processCount is 'auto', default 16
+        :param retryPolicy: (optional) a RetryPolicy deciding whether and when failed parts are retried, whose stats() afterwards count the retries, default RetryPolicy()
+        :param pool: (optional) a TransferPool whose long-lived workers transfer the parts, instead of starting new ones (processCount, maxProcessCount and retryPolicy are then the pool's)
         :returns: a File instance, which has been updated after the upload has completed.
         '''
         if resourceType not in PROPERTY_RESOURCE_TYPES:
             raise IllegalParameterException(resourceType, PROPERTY_RESOURCE_TYPES)
         # First create file object in BaseSpace, then create multipart upload object and start upload
+        if partSize != 'auto' and (partSize <= 5 or partSize > 25):
+            raise UploadPartSizeException("Multipart upload partSize must be >5 MB and <=25 MB")
+        size = os.path.getsize(localPath)
+        if partSize == 'auto':
+            # resolved here, so that a resumed upload is only continued with the same part boundaries
+            partSize = Utils.auto_part_size(size, pool.process_count if pool is not None else maxProcessCount, *AUTO_UPLOAD_PART_SIZES)
+        session = bsFile = None
+        if resume:
+            session = UploadSession(localPath + '.upload',
+                                    {'ResourceType': resourceType, 'ResourceId': resourceId, 'Name': fileName, 'Directory': directory,
+                                     'Size': size, 'PartSize': partSize})
+            bsFile = self.__resumableUploadFile__(session)
+        if bsFile is None:
+            bsFile = self.__initiateMultipartFileUpload__(resourceType, resourceId, fileName, directory, contentType)
+        myMpu = mpu(self, localPath, bsFile, processCount, partSize, temp_dir=tempDir, session=session, max_workers=maxProcessCount, retry_policy=retryPolicy, pool=pool)
+        return myMpu.upload()                
+
+    def __resumableUploadFile__(self, session):
+        '''
+        Returns the BaseSpace File of an interrupted multipart upload recorded in an upload session,
+        or None if there is no session or its File can no longer receive parts
+
+        :param session: an UploadSession
+        '''
+        previous = session.load()
+        if previous is None:
+            return None
+        try:
+            bsFile = self.getFileById(previous[0])
+        except ServerResponseException as e:
+            logging.info("Starting a new upload, the File of the interrupted upload is unavailable: %s" % str(e))
+            return None
+        if getattr(bsFile, 'UploadStatus', None) != 'pending':
+            return None
+        return bsFile
+
+    def multipartStreamUpload(self, resourceType, resourceId, stream, fileName, directory, contentType, threadCount=4, partSize=25, retryPolicy=None):
+        '''
+        Uploads data of unknown length, such as the output of another program, from a binary file-like object or
+        an iterator of bytes. Parts are uploaded by threadCount threads while the stream is still being read,
+        holding at most threadCount + 1 parts in memory.
+
+        :param resourceType: resource type for the property
+        :param resourceId: identifier for the resource
+        :param stream: a binary file-like object (read until its end) or an iterable of bytes
+        :param fileName: The desired filename on the server
+        :param directory: The desired directory name on the server (empty string will place it in the root directory)
+        :param contentType: The content type of the file
+        :param threadCount: (optional) The number of threads uploading parts, default 4
+        :param partSize: (optional) The size in MB of individual upload parts (must be >5 Mb and <=25 Mb), default 25
+        :param retryPolicy: (optional) a RetryPolicy deciding whether and when failed parts are retried, default RetryPolicy(retries=5)
+        :raises MultiProcessingTaskFailedException: if a part could not be uploaded
+        :returns: a File instance, which has been updated after the upload has completed.
+        '''
+        if resourceType not in PROPERTY_RESOURCE_TYPES:
+            raise IllegalParameterException(resourceType, PROPERTY_RESOURCE_TYPES)
         if partSize <= 5 or partSize > 25:
             raise UploadPartSizeException("Multipart upload partSize must be >5 MB and <=25 MB")
-        if tempDir is None:
-            tempDir = mkdtemp()
         bsFile = self.__initiateMultipartFileUpload__(resourceType, resourceId, fileName, directory, contentType)
-        myMpu = mpu(self, localPath, bsFile, processCount, partSize, temp_dir=tempDir)                
-        return myMpu.upload()                
+        myMpsu = mpsu(self, stream, bsFile, threadCount, partSize, retryPolicy)
+        return myMpsu.upload()
 
     def multipartFileUploadSample(self, Id, localPath, fileName, directory, contentType, tempDir=None, processCount=10, partSize=25):
         '''
@@ -1187,7 +1435,7 @@ class BaseSpaceAPI(BaseAPI):
         :param fileName: The desired filename on the server
         :param directory: The desired directory name on the server (empty string will place it in the root directory)
         :param contentType: The content type of the file
-        :param tempdir: (optional) Temp directory to use for temporary file chunks to upload
+        :param tempDir: (optional) no longer used, parts are read directly from the local file
         :param processCount: (optional) The number of processes to be used, default 10
         :param partSize: (optional) The size in MB of individual upload parts (must be >5 Mb and <=25 Mb), default 25
         :returns: a File instance, which has been updated after the upload has completed.
@@ -1195,13 +1443,11 @@ class BaseSpaceAPI(BaseAPI):
         # First create file object in BaseSpace, then create multipart upload object and start upload
         if partSize <= 5 or partSize > 25:
             raise UploadPartSizeException("Multipart upload partSize must be >5 MB and <=25 MB")
-        if tempDir is None:
-            tempDir = mkdtemp()
         bsFile = self.__initiateMultipartFileUploadSample__(Id, fileName, directory, contentType)
         myMpu = mpu(self, localPath, bsFile, processCount, partSize, temp_dir=tempDir)
         return myMpu.upload()
 
-    def fileDownload(self, Id, localDir, byteRange=None, createBsDir=False):
+    def fileDownload(self, Id, localDir, byteRange=None, createBsDir=False, pool=None):
         '''
         Downloads a BaseSpace file to a local directory, and names the file with the BaseSpace file name.
         If the File has a directory in BaseSpace, it will be re-created locally in the provided localDir 
@@ -1217,6 +1463,7 @@ class BaseSpaceAPI(BaseAPI):
         :param localDir: The local directory to place the file in    
         :param byteRange: (optional) The byte range of the file to retrieve, provide a 2-element list with start and end byte values
         :param createBsDir: (optional) create BaseSpace File's directory inside localDir (default: False)
+        :param pool: (optional) a TransferPool to download the whole file with, whatever its size
         :raises ByteRangeException: if the provided byte range is invalid
         :returns: a File instance                
         '''
@@ -1231,6 +1478,8 @@ class BaseSpaceAPI(BaseAPI):
                 raise ByteRangeException("Byte range must have smaller byte number first")
             if rangeSize > multipart_min_file_size:
                 raise ByteRangeException("Byte range %d larger than maximum allowed size %d" % (rangeSize, multipart_min_file_size))
+        elif pool is not None:
+            return self.multipartFileDownload(Id, localDir, createBsDir=createBsDir, pool=pool)
                 
         bsFile = self.getFileById(Id)
         if (bsFile.Size < multipart_min_file_size) or (byteRange and (rangeSize < multipart_min_file_size)):
@@ -1254,7 +1503,7 @@ class BaseSpaceAPI(BaseAPI):
         else:                        
             return self.multipartFileDownload(Id, localDir, createBsDir=createBsDir)
 
-    def __downloadFile__(self, Id, localDir, name, byteRange=None, standaloneRangeFile=False, lock=None): #@ReservedAssignment
+    def __downloadFile__(self, Id, localDir, name, byteRange=None, standaloneRangeFile=False, lock=None, fd=None, cancel=None, md5=None): #@ReservedAssignment
         '''
         Downloads a BaseSpace file to a local directory. 
         Supports byte-range requests; by default will seek() into local file for multipart downloads, 
@@ -1269,12 +1518,48 @@ class BaseSpaceAPI(BaseAPI):
         :param byteRange: (Optional) The byte range of the file to retrieve, provide a 2-element list with start and end byte values
         :param standaloneRangeFile: (Optional) if True store only byte-range data in standalone file
         :param lock: (Optional) Multiprocessing lock to prevent multiple processes from writing to same output file concurrently - only needed when using multipart download
+        :param fd: (Optional) an open file descriptor to write to with positional writes (at the start byte of the range) instead of opening localDir/name; no lock is needed for writes of disjoint ranges
+        :param cancel: (Optional) a CancelToken with which another thread can stop the download (only checked between writes when fd is set)
+        :param md5: (Optional) an object with an update() method, eg. hashlib.md5(), that is given the downloaded bytes as they are written
         :raises Exception: if REST API call to BaseSpace server fails
         :raises DownloadFailedException: if downloaded file size doesn't match the size in BaseSpace
         :returns: None
         '''
         if byteRange is None:
             byteRange = []
+        # get the Amazon URL, then do the download; for range requests include
+        # size to ensure reading until end of data stream
+        headers = {}
+        if len(byteRange):
+            headers['Range'] = 'bytes=%s-%s' % (byteRange[0], byteRange[1])
+        flo, size = self.__openContent__(Id, headers, cancel)
+        if fd is not None:
+            totRead = self.__pwriteDownload__(flo, fd, byteRange[0] if len(byteRange) else 0, cancel, md5)
+        else:
+            totRead = self.__writeDownload__(flo, os.path.join(localDir, name), byteRange, standaloneRangeFile, lock, md5)
+        # check that actual downloaded byte size is correct
+        if len(byteRange):
+            expSize = byteRange[1] - byteRange[0] + 1
+            if totRead != expSize:
+                raise DownloadFailedException("Ranged download size is not as expected: %d vs %d" % (totRead, expSize))
+        else:
+            if totRead != size:
+                raise DownloadFailedException("Downloaded file size doesn't match file size in BaseSpace: %d vs %d" % (totRead, size))
+
+    def __contentUrl__(self, Id, refresh=False):
+        '''
+        Returns the signed (S3) content url and the size of a file. Both are resolved once per file and
+        cached in contentUrls until shortly before the url expires.
+
+        :param Id: The file id
+        :param refresh: (Optional) resolve a new url even if one is cached, eg. after S3 refused the cached url
+        :raises Exception: if REST API call to BaseSpace server fails
+        :returns: a tuple of the url and the file size in bytes
+        '''
+        if not refresh:
+            cached = self.contentUrls.get(Id)
+            if cached is not None:
+                return cached
         resourcePath = '/files/{Id}/content'
         resourcePath = resourcePath.replace('{format}', 'json')
         method = 'GET'
@@ -1286,21 +1571,46 @@ class BaseSpaceAPI(BaseAPI):
         response = self.apiClient.callAPI(resourcePath, method, queryParams, None, headerParams)
         if 'ErrorCode' in response['ResponseStatus']:
             raise Exception('BaseSpace error: ' + str(response['ResponseStatus']['ErrorCode']) + ": " + response['ResponseStatus']['Message'])
-        
-        # get the Amazon URL, then do the download; for range requests include
-        # size to ensure reading until end of data stream. Create local file if
-        # it doesn't exist (don't truncate in case other processes from 
-        # multipart download also do this)
-        req = urllib.request.Request(response['Response']['HrefContent'])
-        filename = os.path.join(localDir, name)
+        url = response['Response']['HrefContent']
+        size = self.getFileById(Id).Size
+        self.contentUrls.put(Id, url, size)
+        return url, size
+
+    def __openContent__(self, Id, headers, cancel=None):
+        '''
+        Requests the content of a file from its signed url, resolving a new url once if S3 refuses the cached one as expired
+
+        :param Id: The file id
+        :param headers: a dictionary of request headers, eg. a Range header
+        :param cancel: (Optional) a CancelToken with which another thread can cancel the request
+        :returns: a tuple of the response (a PooledResponse, which must be closed) and the file size in bytes
+        '''
+        url, size = self.__contentUrl__(Id)
+        # timeout prevents blocking
+        flo = self.apiClient.pool.urlopen('GET', url, headers=headers, timeout=self.getTimeout(), cancel=cancel)
+        if flo.status in EXPIRED_URL_CODES:
+            flo.read()
+            flo.close()
+            url, size = self.__contentUrl__(Id, refresh=True)
+            flo = self.apiClient.pool.urlopen('GET', url, headers=headers, timeout=self.getTimeout(), cancel=cancel)
+        return flo, size
+
+    def __writeDownload__(self, flo, filename, byteRange, standaloneRangeFile, lock, md5=None):
+        '''
+        Writes a content response to a local file, at the start byte of the range unless standaloneRangeFile.
+        Creates the file if it doesn't exist (without truncating it, in case other processes
+        from multipart download also do this). Passes the bytes to md5.update(), if md5 is set
+
+        :returns: the number of bytes written
+        '''
         if not os.path.exists(filename):
             open(filename, 'a').close()
         iter_size = 16*1024 # python default
-        if len(byteRange):
-            req.add_header('Range', 'bytes=%s-%s' % (byteRange[0], byteRange[1]))
-        flo = urllib.request.urlopen(req, timeout=self.getTimeout()) # timeout prevents blocking                
         totRead = 0
-        with open(filename, 'r+b', 0) as fp:
+        with flo, open(filename, 'r+b', 0) as fp:
+            if flo.status >= 300:
+                raise DownloadFailedException("Content request returned HTTP status %d: %s" % (flo.status, flo.reason),
+                                              flo.status, flo.headers.get('Retry-After'))
             if len(byteRange) and standaloneRangeFile == False:
                 fp.seek(byteRange[0])
             cur = flo.read(iter_size)
@@ -1310,33 +1620,159 @@ class BaseSpaceAPI(BaseAPI):
                         fp.write(cur)
                 else:
                     fp.write(cur)
+                if md5 is not None:
+                    md5.update(cur)
                 totRead += len(cur)
                 cur = flo.read(iter_size)
-        # check that actual downloaded byte size is correct
-        if len(byteRange):
-            expSize = byteRange[1] - byteRange[0] + 1
-            if totRead != expSize:
-                raise DownloadFailedException("Ranged download size is not as expected: %d vs %d" % (totRead, expSize))
-        else:
-            bsFile = self.getFileById(Id)
-            if totRead != bsFile.Size:
-                raise DownloadFailedException("Downloaded file size doesn't match file size in BaseSpace: %d vs %d" % (totRead, bsFile.Size))
+        return totRead
 
-    def multipartFileDownload(self, Id, localDir, processCount=10, partSize=25, createBsDir=False, tempDir=""):
+    def __pwriteDownload__(self, flo, fd, offset, cancel=None, md5=None):
+        '''
+        Writes a content response to a file descriptor with positional writes, starting at offset.
+        Downloads of disjoint ranges may write to the same file concurrently, without a lock.
+        Stops before the next write once cancel (a CancelToken) is cancelled.
+        Passes the bytes to md5.update(), if md5 is set.
+
+        :returns: the number of bytes written
+        '''
+        buf = memoryview(bytearray(PWRITE_BLOCK_SIZE))
+        totRead = 0
+        with flo:
+            if flo.status >= 300:
+                raise DownloadFailedException("Content request returned HTTP status %d: %s" % (flo.status, flo.reason),
+                                              flo.status, flo.headers.get('Retry-After'))
+            n = flo.readinto(buf)
+            while n:
+                if cancel is not None and cancel.is_set():
+                    raise TransferCancelledException('download of file range at %d' % offset)
+                written = 0
+                while written < n:
+                    written += os.pwrite(fd, buf[written:n], offset + totRead + written)
+                if md5 is not None:
+                    md5.update(buf[:n])
+                totRead += n
+                n = flo.readinto(buf)
+        return totRead
+
+    def multipartFileDownload(self, Id, localDir, processCount=10, partSize=25, createBsDir=False, tempDir="", engine='process', resume=False, maxProcessCount=16, hedge=False, retryPolicy=None, pool=None, verify=False):
         '''
         Method for multi-threaded file-download for parallel transfer of very large files (currently only runs on unix systems)
+
+        The local file is preallocated at its full size, and each part is written to its own range of it with
+        positional writes, without locking. The 'process' engine downloads parts in worker processes; the 'thread'
+        engine downloads parts in worker threads, without pickling the api object. With tempDir (debug mode), parts
+        are kept in separate files, which are then copied into place in the local file.
+
+        Completed parts are recorded in a manifest file beside the partial download ('<name>.partial.parts').
+        With resume, an interrupted download of the same file (with the same partSize) fetches only the missing parts.
+
+        With partSize='auto' the part size is chosen from the file size. With processCount='auto' no more workers
+        are started than there are parts, and the number of parts downloaded at once is adjusted to the measured
+        throughput and failures.
+
+        With hedge and the 'thread' engine, a part that is still downloading long after most parts have finished
+        is requested again, and whichever copy finishes first is kept, so one slow connection doesn't hold up the download.
+
+        With verify, the download is checked against the file's S3 ETag (see verifyFile()) before it is completed, from MD5s
+        computed while the parts are written. Parts are then sized to cover whole parts of the upload the ETag was computed
+        from, and a file uploaded in a single part is downloaded in one part. For a file that wasn't uploaded with
+        multipartFileUpload(), pass the part size in MB it was uploaded in as verify.
         
         :param Id: The ID of the File to download 
         :param localDir: The local path in which to store the downloaded file
-        :param processCount: (optional) The number of processes to be used, default 10
-        :param partSize: (optional) The size in MB of individual file parts to download, default 25
+        :param processCount: (optional) The number of processes to be used, or 'auto' to adapt the number of parts downloaded at once to the measured throughput (up to maxProcessCount), default 10
+        :param partSize: (optional) The size in MB of individual file parts to download, or 'auto' to choose it from the file size, default 25
         :param createBsDir: (optional) create BaseSpace File's directory in local_dir, default False
         :param tempDir: (optional) Set temp directory to use debug mode, which stores downloaded file chunks in individual files, then completes by 'cat'ing chunks into large file
+        :param engine: (optional) 'process' or 'thread', default 'process'
+        :param resume: (optional) continue an interrupted download, default False
+        :param maxProcessCount: (optional) The most processes to use when processCount is 'auto', default 16
+        :param hedge: (optional) duplicate the requests for straggling parts, with the 'thread' engine, default False
+        :param retryPolicy: (optional) a RetryPolicy deciding whether and when failed parts are retried, whose stats() afterwards count the retries, default RetryPolicy()
+        :param pool: (optional) a TransferPool whose long-lived workers transfer the parts, instead of starting new ones (processCount, engine, maxProcessCount and retryPolicy are then the pool's)
+        :param verify: (optional) check the download against the file's ETag: True, or the part size in MB the file was uploaded in, default False
+        :raises DownloadFailedException: with verify, if the downloaded file doesn't match the ETag
+        :raises IntegrityCheckException: with verify, if the downloaded file doesn't match the ETag in any of several part sizes it may have
         :returns: a File instance 
         '''
-        myMpd = mpd(self, Id, localDir, processCount, partSize, createBsDir, tempDir)
+        myMpd = mpd(self, Id, localDir, processCount, partSize, createBsDir, tempDir, engine, resume, maxProcessCount, hedge, retryPolicy, pool, verify)
         return myMpd.download()
 
+    def sync(self, projectId, localDir, dryRun=False, confirm=None, workers=8, pool=None, partSize=25, verify=False, statuses=None):
+        '''
+        Mirrors the files of a Project's Samples and AppResults to a local directory, downloading only the files
+        that are new, or changed in size or ETag, since the last sync to the directory (see ProjectSync).
+
+        The Samples, AppResults and their files are listed concurrently, and the sync's plan (the files to download
+        and why) is logged before any file is downloaded. Files are downloaded in parallel through a TransferPool.
+
+        :param projectId: The Id of the Project
+        :param localDir: The local directory to mirror the Project in, which holds the state of its last sync
+        :param dryRun: (optional) only plan the sync, default False
+        :param confirm: (optional) a function called with the SyncPlan before it's executed, which returns False to not execute it
+        :param workers: (optional) the number of list and ETag requests made at once, and of transfer threads if no pool is given, default 8
+        :param pool: (optional) a TransferPool to download files with
+        :param partSize: (optional) The size in MB of the parts of downloads, or 'auto', default 25
+        :param verify: (optional) check each download against its ETag, default False
+        :param statuses: (optional) a list of AppResult statuses to sync, eg. ['complete'], default all
+        :raises DownloadFailedException: if any file failed to download, once the others are done
+        :returns: a SyncPlan
+        '''
+        syncer = ProjectSync(self, projectId, localDir, workers, pool, partSize, verify, statuses)
+        try:
+            return syncer.sync(dryRun, confirm)
+        finally:
+            syncer.close()
+
+    def openFile(self, Id, blockSize=DEFAULT_BLOCK_SIZE, readAhead=2):
+        '''
+        Opens the content of a BaseSpace file as a readable binary stream, without downloading it to local disk.
+        Content is fetched in blocks with ranged requests, with the next readAhead blocks fetched in the background.
+        The stream can be passed to eg. gzip.GzipFile(fileobj=...) to decompress the file on the fly.
+
+        :param Id: The file id
+        :param blockSize: (optional) The size in bytes of each ranged request, default 8MB
+        :param readAhead: (optional) The number of blocks to fetch ahead of reading, default 2
+        :raises DownloadFailedException: if a block can't be fetched
+        :returns: an io.BufferedReader, which should be closed when done
+        '''
+        return io.BufferedReader(RemoteFileStream(self, Id, blockSize, readAhead))
+
+    def openRemoteFile(self, Id, blockSize=RANDOM_ACCESS_BLOCK_SIZE, cacheSize=32*1024*1024, readAhead=4):
+        '''
+        Opens the content of a BaseSpace file as a seekable, read-only file object, for reading regions of
+        the file (eg. a BAM index or header) without downloading it. Blocks of the file are fetched with ranged
+        requests and kept in an LRU cache; sequential reads fetch the following blocks in the background.
+
+        :param Id: The file id
+        :param blockSize: (optional) The size in bytes of each ranged request and cached block, default 1MB
+        :param cacheSize: (optional) The maximum size in bytes of cached blocks, default 32MB
+        :param readAhead: (optional) The number of blocks to fetch ahead during sequential reads, default 4
+        :raises DownloadFailedException: if a block can't be fetched
+        :returns: a RemoteFile (an io.RawIOBase), which should be closed when done
+        '''
+        return RemoteFile(self, Id, blockSize, cacheSize, readAhead)
+
+    def streamFile(self, Id, blockSize=DEFAULT_BLOCK_SIZE, readAhead=2):
+        '''
+        Returns an iterator of the content of a BaseSpace file, as bytes-like blocks of blockSize bytes
+        (except the last), fetched with read-ahead as for openFile()
+
+        :param Id: The file id
+        :param blockSize: (optional) The size in bytes of each block, default 8MB
+        :param readAhead: (optional) The number of blocks to fetch ahead of iteration, default 2
+        :raises DownloadFailedException: if a block can't be fetched
+        :returns: an iterator of blocks
+        '''
+        stream = RemoteFileStream(self, Id, blockSize, readAhead)
+        def blocks():
+            try:
+                for block in stream.blocks():
+                    yield block
+            finally:
+                stream.close()
+        return blocks()
+
     def fileUrl(self, Id):
         '''
         ** Deprecated in favor of fileS3metadata() **
@@ -1369,35 +1805,53 @@ class BaseSpaceAPI(BaseAPI):
         :returns: Dict with s3 url ('url' key) and etag ('etag' key)
         '''
         ret = {}
-        resourcePath = '/files/{Id}/content'
-        resourcePath = resourcePath.replace('{format}', 'json')
-        method = 'GET'
-        queryParams = {}
-        headerParams = {}
-        resourcePath = resourcePath.replace('{Id}', Id)
-        queryParams['redirect'] = 'meta' # we need to add this parameter to get the Amazon link directly 
-        
-        response = self.apiClient.callAPI(resourcePath, method, queryParams,None, headerParams)
-        if 'ErrorCode' in response['ResponseStatus']:
-            raise Exception('BaseSpace error: ' + str(response['ResponseStatus']['ErrorCode']) + ": " + response['ResponseStatus']['Message'])
+        # TODO should use HEAD call here, instead do small GET range request
+        # GET S3 url (cached, see __contentUrl__) and record etag         
+        headers = {'Range': 'bytes=%s-%s' % (0, 1)}
+        flo, size = self.__openContent__(Id, headers)
+        with flo:
+            flo.read()
+            etag = flo.headers.get('etag') or ''
         
         # record S3 URL
-        ret['url'] = response['Response']['HrefContent']
-        
-        # TODO should use HEAD call here, instead do small GET range request
-        # GET S3 url and record etag         
-        req = urllib.request.Request(response['Response']['HrefContent'])
-        req.add_header('Range', 'bytes=%s-%s' % (0, 1))
-        flo = urllib.request.urlopen(req, timeout=self.getTimeout()) # timeout prevents blocking  
-        try:
-            etag = flo.headers['etag']
-        except KeyError:
-            etag = ''
+        ret['url'] = self.__contentUrl__(Id)[0]
         # strip quotes from etag
         if etag.startswith('"') and etag.endswith('"'):
             etag = etag[1:-1]
         ret['etag'] = etag
         return ret
+
+    def verifyFile(self, Id, localPath, partSize=None, threads=HASH_THREADS):
+        '''
+        Checks a local copy of a BaseSpace file against the file's S3 ETag. The ETag is the MD5 of the file, or for
+        a file uploaded in parts, the MD5 of the MD5s of its parts, with the number of parts; the parts are hashed
+        in parallel. The upload part size is partSize, or else each size that gives the file its number of parts is
+        tried: that of the parts multipartFileUpload() splits a file into, and common fixed sizes (see Utils.etag_part_sizes).
+
+        :param Id: The file id
+        :param localPath: The path of the local file
+        :param partSize: (optional) The part size in MB that the file was uploaded in, for files not uploaded with multipartFileUpload()
+        :param threads: (optional) The number of threads hashing parts at once, default the number of CPUs up to 8
+        :raises IntegrityCheckException: if the ETag isn't computed from MD5s (eg. for an encrypted file), or from parts of a known size,
+            or if the local file doesn't match it in any of several part sizes, so it can't be told whether the file is corrupt
+        :returns: True if the local file matches the ETag, False otherwise
+        '''
+        etag = self.fileS3metadata(Id)['etag'].lower()
+        size = self.__contentUrl__(Id)[1]
+        parts = Utils.etag_parts(etag)
+        sizes = Utils.etag_part_sizes(parts, size, partSize) if parts is not None else []
+        if not sizes:
+            raise IntegrityCheckException("ETag '%s' of file %s isn't computed from MD5s of a known part size" % (etag, Id))
+        if os.path.getsize(localPath) != size:
+            return False
+        for partBytes in sizes:
+            md5s = Utils.file_md5s(localPath, partBytes, threads=threads)
+            if Utils.etag([md5.hexdigest() for md5 in md5s], parts) == etag:
+                return True
+        if len(sizes) > 1:
+            raise IntegrityCheckException("cannot verify, ETag '%s' of file %s matches none of the part sizes %s; pass partSize" %
+                                          (etag, Id, ', '.join(Utils.readable_bytes(partBytes) for partBytes in sizes)))
+        return False
     
     def _validateQueryParameters(self, queryPars):
         '''
@@ -24,8 +24,10 @@ class WrongFiletypeException(Exception):
         return repr(self.parameter)
     
 class ServerResponseException(Exception):
-    def __init__(self, value):
+    def __init__(self, value, status=None, retryAfter=None):
         self.parameter = 'Error with API server response: ' + value
+        self.status = status          # the HTTP status of the response, if known
+        self.retryAfter = retryAfter  # the Retry-After header of the response, if any
     def __str__(self):
         return repr(self.parameter)
     
@@ -90,9 +92,29 @@ class RestMethodException(Exception):
         return repr(self.parameter)
 
 class DownloadFailedException(Exception):
-    def __init__(self, value):
+    def __init__(self, value, status=None, retryAfter=None):
         self.parameter = 'Error with downloading the file: ' + value
+        self.status = status          # the HTTP status of the response, if known
+        self.retryAfter = retryAfter  # the Retry-After header of the response, if any
     def __str__(self):
         return repr(self.parameter)
 
     
+
+class CacheMissException(Exception):
+    def __init__(self, value):
+        self.parameter = 'Response not in cache, and offline mode prevents calling the server: ' + value
+    def __str__(self):
+        return repr(self.parameter)
+
+class TransferCancelledException(Exception):
+    def __init__(self, value):
+        self.parameter = 'Transfer was cancelled: ' + value
+    def __str__(self):
+        return repr(self.parameter)
+
+class IntegrityCheckException(Exception):
+    def __init__(self, value):
+        self.parameter = 'File integrity cannot be checked: ' + value
+    def __str__(self):
+        return repr(self.parameter)
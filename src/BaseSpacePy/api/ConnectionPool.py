@@ -0,0 +1,285 @@
+
+import http.client
+import socket
+import ssl
+import threading
+import urllib.parse
+import urllib.request
+
+from BaseSpacePy.api.BaseSpaceException import TransferCancelledException
+
+# status codes that are followed to a new location for GET requests
+REDIRECT_CODES = set([301, 302, 303, 307, 308])
+
+# size of the blocks read from file-like request bodies while streaming them to the server
+BLOCK_SIZE = 256*1024
+
+
+class CancelToken(object):
+    '''
+    Cancels requests made with it from another thread, including requests that are waiting for
+    a response or reading one, by shutting down the sockets of their connections.
+    '''
+    def __init__(self):
+        self.cancelled = False
+        self._conns    = set()
+        self._lock     = threading.Lock()
+
+    def is_set(self):
+        return self.cancelled
+
+    def register(self, conn):
+        '''
+        Track a connection in use by a request
+
+        :returns: False if the token is already cancelled
+        '''
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._conns.add(conn)
+            return True
+
+    def unregister(self, conn):
+        with self._lock:
+            self._conns.discard(conn)
+
+    def cancel(self):
+        '''
+        Cancel the requests made with this token, and any later ones
+        '''
+        with self._lock:
+            self.cancelled = True
+            conns, self._conns = self._conns, set()
+        for conn in conns:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except (OSError, AttributeError):
+                pass # already closed
+
+
+class PooledResponse(object):
+    '''
+    A response read from a pooled connection. The connection is handed back to the pool
+    once the response body has been read to the end; closing the response early discards
+    the connection instead, since the unread body would corrupt the next request.
+    '''
+    def __init__(self, pool, key, conn, response, cancel=None):
+        self.pool     = pool
+        self.key      = key
+        self.conn     = conn
+        self.response = response
+        self.cancel   = cancel
+        self.status   = response.status
+        self.reason   = response.reason
+        self.headers  = response.headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, amt=None):
+        '''
+        Read up to amt bytes of the response body, or the whole body if amt is None
+        '''
+        if self.conn is None:
+            return b''
+        data = self.response.read(amt)
+        if self.response.isclosed():
+            self.release()
+        return data
+
+    def readinto(self, b):
+        '''
+        Read response body bytes into a writable buffer, returning the number of bytes read (0 at the end of the body)
+        '''
+        if self.conn is None:
+            return 0
+        n = self.response.readinto(b)
+        if self.response.isclosed():
+            self.release()
+        return n
+
+    def release(self):
+        '''
+        Return the connection to the pool (the response body must have been read completely)
+        '''
+        if self.conn is not None:
+            if self.cancel is not None:
+                self.cancel.unregister(self.conn)
+            self.pool._checkin(self.key, self.conn)
+            self.conn = None
+
+    def close(self):
+        '''
+        Release the connection if the body was fully read, otherwise close and discard it
+        '''
+        if self.conn is not None:
+            if self.response.isclosed() and not (self.cancel is not None and self.cancel.is_set()):
+                self.release()
+            else:
+                if self.cancel is not None:
+                    self.cancel.unregister(self.conn)
+                self.response.close()
+                self.conn.close()
+                self.conn = None
+
+
+class ConnectionPool(object):
+    '''
+    Thread-safe pool of persistent (keep-alive) HTTP connections, with one set of idle
+    connections per scheme, host and port. Used by APIClient for calls to the BaseSpace
+    api server and for S3 content downloads.
+
+    Idle connections are not pickled, so a pool may be passed to worker processes;
+    each process then opens its own connections.
+    '''
+    def __init__(self, maxSize=10, timeout=10):
+        '''
+        :param maxSize: (optional) the maximum number of idle connections kept per host, default 10
+        :param timeout: (optional) the default timeout in seconds for connections, default 10
+        '''
+        self.maxSize = maxSize
+        self.timeout = timeout
+        self._idle   = {}
+        self._lock   = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_idle'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _newConnection(self, scheme, host, port, timeout):
+        '''
+        Open a new connection, tunnelling through a proxy if one is configured in the environment
+        '''
+        proxy = None
+        if not urllib.request.proxy_bypass(host):
+            proxy = urllib.request.getproxies().get(scheme)
+        if proxy:
+            parsed = urllib.parse.urlsplit(proxy)
+            proxyHost, proxyPort = parsed.hostname, parsed.port
+        else:
+            proxyHost, proxyPort = host, port
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(proxyHost, proxyPort, timeout=timeout, blocksize=BLOCK_SIZE, context=ssl.create_default_context())
+            if proxy:
+                conn.set_tunnel(host, port)
+        else:
+            conn = http.client.HTTPConnection(proxyHost, proxyPort, timeout=timeout, blocksize=BLOCK_SIZE)
+        conn._bsProxied = bool(proxy) and scheme != 'https'
+        # connect now so that small requests aren't held back by Nagle's algorithm
+        conn.connect()
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def _checkout(self, key, timeout):
+        '''
+        Take an idle connection for the host from the pool, or open a new one
+
+        :returns: tuple of the connection and whether it was reused
+        '''
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            return self._newConnection(key[0], key[1], key[2], timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _checkin(self, key, conn):
+        '''
+        Return a connection to the pool, closing it if the pool for the host is full
+        '''
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxSize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        '''
+        Close all idle connections
+        '''
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def urlopen(self, method, url, body=None, headers=None, timeout=None, redirects=5, cancel=None):
+        '''
+        Make an HTTP request on a pooled connection.
+
+        A request on a reused keep-alive connection that the server has meanwhile closed
+        is retried once on a new connection. GET requests follow redirects.
+
+        :param method: the HTTP method, eg. GET
+        :param url: the full url to request
+        :param body: (optional) request body, as bytes, str, or a file-like object
+        :param headers: (optional) a dictionary of request headers
+        :param timeout: (optional) timeout in seconds, defaults to the pool's timeout
+        :param redirects: (optional) the maximum number of redirects to follow, default 5
+        :param cancel: (optional) a CancelToken with which another thread can cancel the request
+        :raises OSError, http.client.HTTPException: on connection errors
+        :raises TransferCancelledException: if the request was cancelled before it was sent
+        :returns: a PooledResponse
+        '''
+        if headers is None:
+            headers = {}
+        if timeout is None:
+            timeout = self.timeout
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        parsed = urllib.parse.urlsplit(url)
+        scheme = parsed.scheme.lower()
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parsed.hostname, port)
+        path = urllib.parse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+        bodyStart = body.tell() if hasattr(body, 'tell') else None
+
+        while True:
+            conn, reused = self._checkout(key, timeout)
+            if cancel is not None and not cancel.register(conn):
+                self._checkin(key, conn)
+                raise TransferCancelledException(method + ' ' + url)
+            target = url if conn._bsProxied else path
+            try:
+                conn.request(method, target, body=body, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if cancel is not None:
+                    cancel.unregister(conn)
+                # the server dropped an idle keep-alive connection - retry once on a fresh connection
+                if reused and (bodyStart is not None or not hasattr(body, 'read')):
+                    if bodyStart is not None:
+                        body.seek(bodyStart)
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                if cancel is not None:
+                    cancel.unregister(conn)
+                raise
+            break
+
+        pooled = PooledResponse(self, key, conn, response, cancel)
+        if method == 'GET' and pooled.status in REDIRECT_CODES and redirects > 0 and pooled.headers.get('Location'):
+            location = urllib.parse.urljoin(url, pooled.headers['Location'])
+            pooled.read()
+            # don't send credentials on to another host
+            if urllib.parse.urlsplit(location).hostname != parsed.hostname:
+                headers = dict((k, v) for k, v in headers.items() if k.lower() != 'authorization')
+            return self.urlopen(method, location, headers=headers, timeout=timeout, redirects=redirects-1, cancel=cancel)
+        return pooled
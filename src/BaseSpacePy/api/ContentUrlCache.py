@@ -0,0 +1,94 @@
+
+import calendar
+import threading
+import time
+import urllib.parse
+
+# status codes with which S3 refuses a signed url that has expired
+EXPIRED_URL_CODES = set([400, 403])
+
+
+class ContentUrlCache(object):
+    '''
+    Thread-safe cache of the signed content urls (HrefContent) and sizes of BaseSpace files, so that
+    the parts of a multipart download and the blocks of a RemoteFile share one url per file instead of
+    asking the api server for it on every ranged request.
+
+    An entry is kept until shortly before its url expires, as read from the url's signature
+    (the Expires parameter, or X-Amz-Date and X-Amz-Expires), or for defaultTtl seconds if
+    the url doesn't say.
+
+    Entries are pickled, so worker processes start with the urls resolved by their parent.
+    '''
+    def __init__(self, margin=60, defaultTtl=600):
+        '''
+        :param margin: (optional) the seconds before a url expires that it's no longer used, default 60
+        :param defaultTtl: (optional) the seconds to keep urls without an expiry time for, default 600
+        '''
+        self.margin     = margin
+        self.defaultTtl = defaultTtl
+        self._entries   = {}
+        self._lock      = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        with self._lock:
+            state['_entries'] = dict(self._entries)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def expires(self, url):
+        '''
+        Returns the time (seconds since the epoch) that a signed url expires, or None if it can't be told from the url
+        '''
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        try:
+            if 'Expires' in query:
+                return float(query['Expires'])
+            if 'X-Amz-Date' in query and 'X-Amz-Expires' in query:
+                signed = calendar.timegm(time.strptime(query['X-Amz-Date'], '%Y%m%dT%H%M%SZ'))
+                return signed + float(query['X-Amz-Expires'])
+        except ValueError:
+            pass
+        return None
+
+    def get(self, Id):
+        '''
+        Returns a tuple of the content url and size of a file, or None if there is no current entry
+        '''
+        with self._lock:
+            entry = self._entries.get(Id)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._entries[Id]
+                return None
+            return entry[0], entry[1]
+
+    def put(self, Id, url, size):
+        '''
+        Cache the content url and size of a file
+        '''
+        expires = self.expires(url)
+        if expires is None:
+            expires = time.time() + self.defaultTtl
+        with self._lock:
+            self._entries[Id] = (url, size, expires - self.margin)
+
+    def invalidate(self, Id):
+        '''
+        Remove the entry of a file, eg. when S3 refuses its url
+        '''
+        with self._lock:
+            self._entries.pop(Id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,321 @@
+
+import concurrent.futures
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from BaseSpacePy.api.BaseSpaceException import DownloadFailedException
+from BaseSpacePy.model.MultipartFileTransfer import TransferPool, Utils
+
+LOGGER = logging.getLogger(__name__)
+
+# name of the state database kept in the local directory of a sync
+STATE_DB = '.basespace-sync.sqlite'
+
+# the actions of a sync plan
+NEW       = 'new'
+CHANGED   = 'changed'
+UNCHANGED = 'unchanged'
+
+
+class SyncState(object):
+    '''
+    The files last synced to a local directory, kept in a SQLite database in the directory: for each local path
+    (relative to the directory), the Id, size and ETag of the BaseSpace file it was downloaded from.
+    '''
+    def __init__(self, localDir):
+        '''
+        :param localDir: the local directory of the sync
+        '''
+        if not os.path.isdir(localDir):
+            os.makedirs(localDir, exist_ok=True)
+        self.path = os.path.join(localDir, STATE_DB)
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, id TEXT, size INTEGER, '
+                        'etag TEXT, synced REAL)')
+
+    def get(self, path):
+        '''
+        Returns a tuple of the file Id, size and ETag last synced to a path, or None if nothing was
+        '''
+        return self.db.execute('SELECT id, size, etag FROM files WHERE path=?', (path,)).fetchone()
+
+    def put(self, path, Id, size, etag):
+        '''
+        Record the file synced to a path
+        '''
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', (path, Id, size, etag, time.time()))
+
+    def paths(self):
+        return set(row[0] for row in self.db.execute('SELECT path FROM files'))
+
+    def close(self):
+        self.db.close()
+
+
+class SyncAction(object):
+    '''
+    A remote file in a sync plan: where it goes locally, whether it's new, changed or unchanged, and why
+    '''
+    def __init__(self, action, bsFile, path, localPath, etag, reason='', pending=False):
+        self.action    = action
+        self.bsFile    = bsFile
+        self.path      = path       # relative to the local directory, with '/' separators
+        self.localPath = localPath
+        self.etag      = etag
+        self.reason    = reason
+        self.pending   = pending    # an unchanged file whose state entry is only updated when the plan is executed
+        self.error     = None       # why the download failed, once executed
+
+    def __str__(self):
+        line = '%-9s %s (%s)' % (self.action, self.path, Utils.readable_bytes(self.bsFile.Size))
+        if self.reason:
+            line += ': ' + self.reason
+        return line
+
+    def __repr__(self):
+        return str(self)
+
+
+class SyncPlan(object):
+    '''
+    What a sync of a Project to a local directory will do: the new and changed files it will download,
+    the unchanged files it will skip, and the synced paths no longer in the Project (which are kept).
+    '''
+    def __init__(self, projectId, localDir, actions, removed):
+        self.projectId = projectId
+        self.localDir  = localDir
+        self.actions   = actions
+        self.removed   = sorted(removed)
+        self.executed  = False
+
+    def _select(self, action):
+        return [a for a in self.actions if a.action == action]
+
+    def new(self):
+        return self._select(NEW)
+
+    def changed(self):
+        return self._select(CHANGED)
+
+    def unchanged(self):
+        return self._select(UNCHANGED)
+
+    def transfers(self):
+        '''
+        Returns the actions of the files to download, ie. the new and changed files
+        '''
+        return [a for a in self.actions if a.action != UNCHANGED]
+
+    def failed(self):
+        return [a for a in self.actions if a.error is not None]
+
+    def transferBytes(self):
+        return sum(a.bsFile.Size for a in self.transfers())
+
+    def summary(self):
+        '''
+        Returns a one-line summary of the plan
+        '''
+        counts = []
+        for action in (NEW, CHANGED, UNCHANGED):
+            selected = self._select(action)
+            counts.append('%d %s (%s)' % (len(selected), action, Utils.readable_bytes(sum(a.bsFile.Size for a in selected))))
+        line = 'Sync of project %s to %s: %s' % (self.projectId, self.localDir, ', '.join(counts))
+        if self.removed:
+            line += ', %d no longer in the project' % len(self.removed)
+        return line
+
+    def report(self):
+        '''
+        Returns the summary of the plan followed by a line for each file to download and each removed path
+        '''
+        lines = [self.summary()]
+        lines += ['  ' + str(a) for a in self.transfers()]
+        lines += ['  %-9s %s' % ('removed', path) for path in self.removed]
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
+
+
+class ProjectSync(object):
+    '''
+    Mirrors the files of a Project's Samples and AppResults to a local directory, downloading only
+    the files that are new or changed since the last sync.
+
+    Files are placed in <localDir>/samples/<Sample name>_<Id>/ and <localDir>/appresults/<AppResult name>_<Id>/,
+    under their BaseSpace directory. The Id, size and ETag of each synced file is recorded in a state
+    database in localDir (see SyncState).
+
+    Planning lists the Samples and AppResults, and then their files, with concurrent requests. A file is
+    unchanged if its state entry has the same Id and size and the local file is still that size; otherwise
+    its ETag is requested (also concurrently), and a file of the same size and ETag as its state entry is
+    unchanged too. Only files whose upload is complete are synced. Local files are never deleted.
+
+    The new and changed files are then downloaded through a TransferPool, so parts of many files are
+    transferred at once, and each file is recorded in the state as soon as it completes.
+    '''
+    def __init__(self, api, projectId, localDir, workers=8, pool=None, partSize=25, verify=False, statuses=None):
+        '''
+        :param api: the BaseSpaceAPI instance
+        :param projectId: the Id of the Project
+        :param localDir: the local directory to mirror the Project in
+        :param workers: (optional) the number of list and ETag requests made at once, and of transfer threads if no pool is given, default 8
+        :param pool: (optional) a TransferPool to download files with, default a pool of workers threads for the sync
+        :param partSize: (optional) the part size in MB of downloads, or 'auto', default 25
+        :param verify: (optional) check each download against its ETag (see BaseSpaceAPI.multipartFileDownload), default False
+        :param statuses: (optional) a list of AppResult statuses to sync, eg. ['complete'], default all
+        '''
+        self.api       = api
+        self.projectId = projectId
+        self.localDir  = localDir
+        self.workers   = workers
+        self.pool      = pool
+        self.partSize  = partSize
+        self.verify    = verify
+        self.statuses  = statuses
+        self.state     = SyncState(localDir)
+
+    @staticmethod
+    def _safeName(name):
+        '''
+        Returns a name made safe for use as one local file or directory name
+        '''
+        return re.sub(r'[^\w.-]+', '_', name or '').strip('_.') or '_'
+
+    def _relativePath(self, kind, container, bsFile):
+        '''
+        Returns the local path of a file of a Sample or AppResult, relative to localDir, with '/' separators.
+        Empty, '.' and '..' components of the BaseSpace path are dropped, and a file name that isn't a single
+        path component is made safe, so files can't be placed outside localDir.
+        '''
+        dirs = [d for d in re.split(r'[\\/]', bsFile.Path or '')[:-1] if d not in ('', '.', '..')]
+        name = bsFile.Name
+        if name in (None, '', '.', '..') or re.search(r'[\\/]', name):
+            name = self._safeName(name)
+        return '/'.join([kind, '%s_%s' % (self._safeName(container.Name), container.Id)] + dirs + [name])
+
+    def _walk(self, executor):
+        '''
+        Yields a tuple of the relative local path and File of each file of the Project's Samples and AppResults,
+        listing the files of all of them concurrently
+        '''
+        samples = executor.submit(list, self.api.iterSamplesByProject(self.projectId))
+        appResults = executor.submit(list, self.api.iterAppResultsByProject(self.projectId, statuses=self.statuses))
+        listings = [('samples', s, executor.submit(list, self.api.iterSampleFilesById(s.Id))) for s in samples.result()]
+        listings += [('appresults', a, executor.submit(list, self.api.iterAppResultFilesById(a.Id))) for a in appResults.result()]
+        for kind, container, files in listings:
+            for bsFile in files.result():
+                if getattr(bsFile, 'UploadStatus', 'complete') not in (None, 'complete'):
+                    LOGGER.debug("Skipping file %s with upload status %s" % (bsFile.Id, bsFile.UploadStatus))
+                    continue
+                yield self._relativePath(kind, container, bsFile), bsFile
+
+    def _etag(self, Id):
+        return self.api.fileS3metadata(Id)['etag']
+
+    def plan(self):
+        '''
+        Compares the Project's files with the state of the last sync, without downloading anything
+
+        :returns: a SyncPlan
+        '''
+        actions = []
+        lookups = []
+        seen = set()
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            for path, bsFile in self._walk(executor):
+                seen.add(path)
+                localPath = os.path.join(self.localDir, *path.split('/'))
+                localSize = os.path.getsize(localPath) if os.path.isfile(localPath) else None
+                entry = self.state.get(path)
+                if entry is not None and entry[0] == bsFile.Id and entry[1] == bsFile.Size == localSize:
+                    actions.append(SyncAction(UNCHANGED, bsFile, path, localPath, entry[2]))
+                else:
+                    lookups.append((executor.submit(self._etag, bsFile.Id), bsFile, path, localPath, localSize, entry))
+            for etag, bsFile, path, localPath, localSize, entry in lookups:
+                etag = etag.result()
+                pending = False
+                if localSize is None:
+                    action, reason = NEW, 'not synced yet' if entry is None else 'missing locally'
+                elif entry is None:
+                    action, reason = CHANGED, 'not synced from BaseSpace'
+                elif localSize != entry[1]:
+                    action, reason = CHANGED, 'modified locally'
+                elif bsFile.Size != entry[1]:
+                    action, reason = CHANGED, 'size changed'
+                elif etag != entry[2]:
+                    action, reason = CHANGED, 'ETag changed'
+                else:
+                    # the same content as another file Id, recorded under the new Id by execute()
+                    action, reason, pending = UNCHANGED, '', True
+                actions.append(SyncAction(action, bsFile, path, localPath, etag, reason, pending))
+        actions.sort(key=lambda a: a.path)
+        return SyncPlan(self.projectId, self.localDir, actions, self.state.paths() - seen)
+
+    def execute(self, plan):
+        '''
+        Downloads the new and changed files of a plan, recording each in the state as it completes,
+        along with the unchanged files now under another Id
+
+        :param plan: a SyncPlan from plan()
+        :raises DownloadFailedException: if any download failed, once the others are done (see plan.failed())
+        :returns: the plan
+        '''
+        transfers = plan.transfers()
+        for action in plan.unchanged():
+            if action.pending:
+                self.state.put(action.path, action.bsFile.Id, action.bsFile.Size, action.etag)
+                action.pending = False
+        pool = self.pool if self.pool is not None else TransferPool(self.workers, 'thread', api=self.api)
+        try:
+            futures = {}
+            for action in transfers:
+                localDir = os.path.dirname(action.localPath)
+                try:
+                    if not os.path.isdir(localDir):
+                        os.makedirs(localDir, exist_ok=True)
+                    # saved under its sanitized local name, never joined with the BaseSpace name
+                    futures[pool.download(self.api, action.bsFile.Id, localDir, self.partSize, verify=self.verify,
+                                          localName=os.path.basename(action.localPath))] = action
+                except Exception as e:
+                    LOGGER.warning("Failed to sync %s: %s" % (action.path, str(e)))
+                    action.error = e
+            for future in concurrent.futures.as_completed(futures):
+                action = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    LOGGER.warning("Failed to sync %s: %s" % (action.path, str(e)))
+                    action.error = e
+                else:
+                    self.state.put(action.path, action.bsFile.Id, action.bsFile.Size, action.etag)
+        finally:
+            if self.pool is None:
+                pool.shutdown()
+        plan.executed = True
+        failed = plan.failed()
+        if failed:
+            raise DownloadFailedException("%d of %d files of project %s failed to sync, first error: %s"
+                                          % (len(failed), len(transfers), plan.projectId, str(failed[0].error)))
+        return plan
+
+    def sync(self, dryRun=False, confirm=None):
+        '''
+        Plans the sync and logs its report, then executes it
+
+        :param dryRun: (optional) only plan, default False
+        :param confirm: (optional) a function called with the plan before it's executed, which returns False to not execute it
+        :returns: the SyncPlan
+        '''
+        plan = self.plan()
+        LOGGER.info(plan.report())
+        if dryRun or (confirm is not None and not confirm(plan)):
+            return plan
+        return self.execute(plan)
+
+    def close(self):
+        self.state.close()
@@ -0,0 +1,274 @@
+
+import collections
+import http.client
+import io
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from BaseSpacePy.api.BaseSpaceException import DownloadFailedException
+
+# size in bytes of the ranged requests made for streamed file content
+DEFAULT_BLOCK_SIZE = 8*1024*1024
+
+# size in bytes of the blocks fetched and cached by RemoteFile, for random access
+RANDOM_ACCESS_BLOCK_SIZE = 1024*1024
+
+
+def fetchRange(api, Id, start, end, retries=3):
+    '''
+    Returns the bytes from start to end (inclusive) of the content of a file, from its signed content url
+    (cached by the api, see BaseSpaceAPI.__contentUrl__), with retry
+
+    :param api: the BaseSpaceAPI instance, whose content url cache, connection pool and timeout are used
+    :param Id: the BaseSpace File Id
+    :param start: the first byte
+    :param end: the last byte
+    :param retries: (optional) the number of attempts, default 3
+    :raises DownloadFailedException: if the server returns an error or a short response on the last attempt
+    '''
+    for attempt in range(1, retries + 1):
+        try:
+            flo, size = api.__openContent__(Id, {'Range': 'bytes=%d-%d' % (start, end)})
+            with flo:
+                data = flo.read()
+                if flo.status >= 300:
+                    raise DownloadFailedException("Content request returned HTTP status %d: %s" % (flo.status, flo.reason),
+                                                  flo.status, flo.headers.get('Retry-After'))
+            if len(data) != end - start + 1:
+                raise DownloadFailedException("Ranged download size is not as expected: %d vs %d" % (len(data), end - start + 1))
+            return data
+        except (OSError, http.client.HTTPException, DownloadFailedException):
+            if attempt == retries:
+                raise
+
+
+class RemoteFileStream(io.RawIOBase):
+    '''
+    Readable, sequential binary stream of the content of a BaseSpace File, fetched from its signed content url
+    in blocks with ranged requests. While one block is read, the next readAhead blocks are already being
+    fetched by background threads, so the file can be decompressed or parsed on the fly without being
+    written to local disk, holding at most readAhead + 1 blocks in memory.
+
+    Wrap in io.BufferedReader (as BaseSpaceAPI.openFile() does) for readline() and small reads.
+    '''
+    def __init__(self, api, Id, blockSize=DEFAULT_BLOCK_SIZE, readAhead=2, retries=3):
+        '''
+        :param api: the BaseSpaceAPI instance
+        :param Id: the BaseSpace File Id
+        :param blockSize: (optional) the size in bytes of each ranged request, default 8MB
+        :param readAhead: (optional) the number of blocks to fetch ahead of the block being read, default 2
+        :param retries: (optional) the number of attempts to fetch each block, default 3
+        '''
+        super(RemoteFileStream, self).__init__()
+        self.api       = api
+        self.Id        = Id
+        self.blockSize = blockSize
+        self.readAhead = max(readAhead, 0)
+        self.retries   = retries
+        self.bsFile    = api.getFileById(Id)
+        self.size      = self.bsFile.Size
+        self._executor = ThreadPoolExecutor(max_workers=max(self.readAhead, 1))
+        self._pending  = collections.deque()
+        self._next     = 0                  # offset of the next block to request
+        self._block    = memoryview(b'')    # the unread remainder of the current block
+        self._pos      = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def _fetch(self, start, end):
+        return fetchRange(self.api, self.Id, start, end, self.retries)
+
+    def _schedule(self, count):
+        # keep count blocks requested ahead
+        while len(self._pending) < count and self._next < self.size:
+            end = min(self._next + self.blockSize, self.size) - 1
+            self._pending.append(self._executor.submit(self._fetch, self._next, end))
+            self._next = end + 1
+
+    def _nextBlock(self):
+        '''
+        Returns the next block of content, or None at the end of the file
+        '''
+        self._schedule(max(self.readAhead, 1))
+        if not self._pending:
+            return None
+        block = self._pending.popleft().result()
+        self._schedule(self.readAhead)
+        return block
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if not len(self._block):
+            block = self._nextBlock()
+            if block is None:
+                return 0
+            self._block = memoryview(block)
+        n = min(len(b), len(self._block))
+        b[:n] = self._block[:n]
+        self._block = self._block[n:]
+        self._pos += n
+        return n
+
+    def blocks(self):
+        '''
+        Yields the rest of the content as a sequence of bytes-like blocks, without copying them
+        '''
+        if len(self._block):
+            block, self._block = self._block, memoryview(b'')
+            self._pos += len(block)
+            yield block
+        while not self.closed:
+            block = self._nextBlock()
+            if block is None:
+                return
+            self._pos += len(block)
+            yield block
+
+    def close(self):
+        '''
+        Stop fetching blocks, discarding any that were fetched ahead
+        '''
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._block = memoryview(b'')
+        super(RemoteFileStream, self).close()
+
+
+class RemoteFile(io.RawIOBase):
+    '''
+    Seekable, read-only binary file object over the content of a BaseSpace File, for random access
+    (eg. reading a BAM index or a header region) without downloading the file. Content is fetched
+    in aligned blocks with ranged requests and kept in an LRU cache of cacheSize bytes, so repeated
+    and nearby reads are served from memory. When consecutive blocks are read, the next readAhead
+    blocks are fetched in the background.
+
+    A RemoteFile may be passed to libraries that read file objects, eg. gzip.GzipFile(fileobj=...).
+    It is not safe to read from one RemoteFile in several threads at once.
+    '''
+    def __init__(self, api, Id, blockSize=RANDOM_ACCESS_BLOCK_SIZE, cacheSize=32*1024*1024, readAhead=4, retries=3):
+        '''
+        :param api: the BaseSpaceAPI instance
+        :param Id: the BaseSpace File Id
+        :param blockSize: (optional) the size in bytes of each ranged request and cached block, default 1MB
+        :param cacheSize: (optional) the maximum size in bytes of cached blocks, default 32MB
+        :param readAhead: (optional) the number of blocks to fetch ahead once reads are sequential (0 to disable), default 4
+        :param retries: (optional) the number of attempts to fetch each block, default 3
+        '''
+        super(RemoteFile, self).__init__()
+        self.api        = api
+        self.Id         = Id
+        self.blockSize  = blockSize
+        self.maxBlocks  = max(cacheSize // blockSize, readAhead + 1, 1)
+        self.readAhead  = max(readAhead, 0)
+        self.retries    = retries
+        self.bsFile     = api.getFileById(Id)
+        self.name       = self.bsFile.Name
+        self.size       = self.bsFile.Size
+        self._executor  = ThreadPoolExecutor(max_workers=max(self.readAhead, 1))
+        self._blocks    = collections.OrderedDict() # block number: Future of its bytes, least recently used first
+        self._pos       = 0
+        self._lastBlock = None
+        self.hits = self.misses = self.prefetches = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence (%r)" % whence)
+        if pos < 0:
+            raise ValueError("Negative seek position %d" % pos)
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def _request(self, number):
+        start = number * self.blockSize
+        end = min(start + self.blockSize, self.size) - 1
+        return self._executor.submit(fetchRange, self.api, self.Id, start, end, self.retries)
+
+    def _cache(self, number, future):
+        self._blocks[number] = future
+        while len(self._blocks) > self.maxBlocks:
+            self._blocks.popitem(last=False)[1].cancel()
+
+    def _block(self, number):
+        '''
+        Returns the bytes of a block, from the cache or fetched now, and starts read-ahead if reads are sequential
+        '''
+        future = self._blocks.get(number)
+        if future is not None:
+            self._blocks.move_to_end(number)
+            self.hits += 1
+        else:
+            self.misses += 1
+            future = Future()
+            future.set_result(fetchRange(self.api, self.Id, number * self.blockSize,
+                                         min((number + 1) * self.blockSize, self.size) - 1, self.retries))
+            self._cache(number, future)
+        if self._lastBlock is not None and number == self._lastBlock + 1:
+            last = (self.size - 1) // self.blockSize
+            for ahead in range(number + 1, min(number + self.readAhead, last) + 1):
+                if ahead not in self._blocks:
+                    self._cache(ahead, self._request(ahead))
+                    self.prefetches += 1
+        self._lastBlock = number
+        try:
+            return future.result()
+        except Exception:
+            self._blocks.pop(number, None)
+            raise
+
+    def readinto(self, b):
+        '''
+        Read bytes from the current position into a writable buffer, filling it unless the end of the file is reached
+
+        :returns: the number of bytes read (0 at the end of the file)
+        '''
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(b).cast('B')
+        total = 0
+        while total < len(view) and self._pos < self.size:
+            number, offset = divmod(self._pos, self.blockSize)
+            block = self._block(number)
+            n = min(len(view) - total, len(block) - offset)
+            view[total:total + n] = block[offset:offset + n]
+            total += n
+            self._pos += n
+        return total
+
+    def stats(self):
+        '''
+        Returns a dictionary of block cache statistics: hits, misses, prefetches and cached blocks
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'prefetches': self.prefetches, 'blocks': len(self._blocks)}
+
+    def close(self):
+        '''
+        Stop fetching blocks and discard the cache
+        '''
+        if not self.closed:
+            for future in self._blocks.values():
+                future.cancel()
+            self._blocks.clear()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        super(RemoteFile, self).close()
@@ -0,0 +1,315 @@
+
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+# seconds that a response is cached for, by resource type (the first segment of the resource path)
+DEFAULT_TTLS = {
+    'users':       300,
+    'projects':    300,
+    'samples':     300,
+    'runs':        300,
+    'files':       300,
+    'appresults':  60,
+    'appsessions': 30,
+    'genomes':     3600,
+}
+
+# the default directory of DiskResponseCache
+DEFAULT_CACHE_DIR = os.path.join('~', '.basespacepy-cache')
+
+# DiskResponseCache records when an entry was last read to within this many seconds, to save writes
+ACCESS_RESOLUTION = 10
+
+
+class ResponseCache(object):
+    '''
+    Thread-safe in-memory cache of server responses to GET calls, for APIClient.
+
+    Entries are keyed by resource path, query parameters and the api server and user, and expire after a time-to-live
+    that depends on the resource type. The least recently used entries are evicted when either
+    the number of entries or their total size in bytes exceeds the limits.
+    A POST or PUT to a resource (eg. /appresults/123/files) removes the cached responses
+    for that resource (everything under /appresults/123).
+
+    Content urls (/files/{Id}/content) are signed and expire, so they aren't cached.
+
+    In offline mode, APIClient serves GET calls only from the cache, raising CacheMissException
+    for responses that aren't cached, and doesn't make POST or PUT calls.
+
+    Cached responses are not pickled, so a cache may be passed to worker processes,
+    each of which then starts with an empty cache.
+    '''
+    def __init__(self, maxEntries=1000, maxBytes=64*1024*1024, ttls=None, defaultTtl=60, offline=False):
+        '''
+        :param maxEntries: (optional) the maximum number of cached responses, default 1000
+        :param maxBytes: (optional) the maximum total size of cached responses in bytes, default 64MB
+        :param ttls: (optional) a dictionary of seconds to cache responses for, by resource type (eg. {'files': 600}), overriding DEFAULT_TTLS
+        :param defaultTtl: (optional) the seconds to cache responses for resource types not in ttls, default 60
+        :param offline: (optional) serve responses from the cache only, default False
+        '''
+        self.maxEntries = maxEntries
+        self.maxBytes   = maxBytes
+        self.ttls       = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.defaultTtl = defaultTtl
+        self.offline    = offline
+        self._entries   = collections.OrderedDict()
+        self._bytes     = 0
+        self._lock      = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_entries'] = collections.OrderedDict()
+        state['_bytes'] = 0
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(resourcePath, queryParams, scope=''):
+        '''
+        Returns the cache key for a GET call (query parameters with values of None are ignored, as they aren't sent)
+
+        :param resourcePath: the api url path (without server and version)
+        :param queryParams: a dictionary of query parameters
+        :param scope: (optional) a string distinguishing the responses of different servers and users, see APIClient.cacheScope()
+        '''
+        params = tuple(sorted((k, str(v)) for k, v in (queryParams or {}).items() if v is not None))
+        return (resourcePath, params, scope)
+
+    @staticmethod
+    def _resource(resourcePath):
+        '''
+        Returns the resource type and resource of a path, eg. ('files', ('files', '123')) for /files/123/properties
+        '''
+        segments = urllib.parse.urlsplit(resourcePath).path.strip('/').split('/')
+        return segments[0], tuple(segments[:2])
+
+    def ttl(self, resourcePath):
+        '''
+        Returns the seconds to cache a response from a resource path for, or 0 if it shouldn't be cached
+        '''
+        resourceType = self._resource(resourcePath)[0]
+        if resourceType == 'files' and resourcePath.rstrip('/').endswith('/content'):
+            return 0
+        return self.ttls.get(resourceType, self.defaultTtl)
+
+    def get(self, key):
+        '''
+        Returns the cached response body for a key, or None if there is no current entry
+        '''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, body):
+        '''
+        Cache a response body (bytes) for a key from ResponseCache.key()
+        '''
+        ttl = self.ttl(key[0])
+        if ttl <= 0 or len(body) > self.maxBytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.maxEntries or self._bytes > self.maxBytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, resourcePath):
+        '''
+        Remove the cached responses for the resource that a path belongs to, eg. for /files/123 and /files/123/properties after a POST to /files/123
+        '''
+        resource = self._resource(resourcePath)[1]
+        with self._lock:
+            for key in [k for k in self._entries if self._resource(k[0])[1] == resource]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        '''
+        Remove all cached responses
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        '''
+        Returns a dictionary of cache statistics: hits, misses, evictions, invalidations, entries and bytes
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'entries': len(self._entries), 'bytes': self._bytes}
+
+    def _remove(self, key):
+        # the lock must be held
+        expires, body = self._entries.pop(key)
+        self._bytes -= len(body)
+
+
+class DiskResponseCache(ResponseCache):
+    '''
+    Disk-backed cache of server responses to GET calls, for APIClient, kept in a SQLite database
+    that may be shared by any number of threads and processes (eg. the workers of a batch job,
+    or successive runs of it) that use the same directory.
+
+    Entries expire and are invalidated as for ResponseCache. When the total size of the cached
+    responses exceeds maxBytes, expired entries and then the least recently used are removed,
+    down to 90% of maxBytes. With offline=True, APIClient serves GET calls from the cache only,
+    so a job can be restarted without calling the server again for the same metadata.
+
+    Hit and miss counters are those of the current process.
+    '''
+    def __init__(self, path=DEFAULT_CACHE_DIR, maxBytes=1024*1024*1024, ttls=None, defaultTtl=60, offline=False, timeout=30):
+        '''
+        :param path: (optional) the directory of the cache database, default ~/.basespacepy-cache
+        :param maxBytes: (optional) the maximum total size of cached responses in bytes, default 1GB
+        :param ttls: (optional) a dictionary of seconds to cache responses for, by resource type (eg. {'files': 600}), overriding DEFAULT_TTLS
+        :param defaultTtl: (optional) the seconds to cache responses for resource types not in ttls, default 60
+        :param offline: (optional) serve responses from the cache only, default False
+        :param timeout: (optional) the seconds to wait for another process's write to the database to finish, default 30
+        '''
+        super(DiskResponseCache, self).__init__(maxEntries=None, maxBytes=maxBytes, ttls=ttls, defaultTtl=defaultTtl, offline=offline)
+        self.path    = os.path.expanduser(path)
+        self.timeout = timeout
+        self._local  = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock'], state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock  = threading.Lock()
+        self._local = threading.local()
+
+    def __len__(self):
+        return self._db().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def _db(self):
+        '''
+        Returns the database connection of the current thread, opening it if needed (also after a fork,
+        since connections can't be shared with a child process)
+        '''
+        pid, db = getattr(self._local, 'db', (None, None))
+        if pid != os.getpid():
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.path, 'responses.sqlite'), timeout=self.timeout, isolation_level=None)
+            # write-ahead logging lets readers carry on while another process writes
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, resource TEXT, '
+                       'expires REAL, accessed REAL, size INTEGER, body BLOB)')
+            db.execute('CREATE INDEX IF NOT EXISTS responses_resource ON responses (resource)')
+            db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._local.db = (os.getpid(), db)
+        return db
+
+    def _resourceName(self, resourcePath):
+        return '/'.join(self._resource(resourcePath)[1])
+
+    def get(self, key):
+        '''
+        Returns the cached response body for a key, or None if there is no current entry
+        '''
+        db = self._db()
+        dbKey = json.dumps(key)
+        now = time.time()
+        row = db.execute('SELECT expires, accessed, body FROM responses WHERE key=?', (dbKey,)).fetchone()
+        if row is not None and row[0] <= now:
+            db.execute('DELETE FROM responses WHERE key=? AND expires<=?', (dbKey, now))
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if now - row[1] > ACCESS_RESOLUTION:
+            db.execute('UPDATE responses SET accessed=? WHERE key=?', (now, dbKey))
+        return bytes(row[2])
+
+    def put(self, key, body):
+        '''
+        Cache a response body (bytes) for a key from ResponseCache.key()
+        '''
+        ttl = self.ttl(key[0])
+        if ttl <= 0 or len(body) > self.maxBytes:
+            return
+        db = self._db()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                       (json.dumps(key), self._resourceName(key[0]), now + ttl, now, len(body), body))
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > self.maxBytes:
+                self._evict(db, now, total)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _evict(self, db, now, total):
+        # in a transaction: remove expired entries, then the least recently used, down to 90% of maxBytes
+        target = self.maxBytes * 0.9
+        db.execute('DELETE FROM responses WHERE expires<=?', (now,))
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        evicted = []
+        for dbKey, size in db.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if total <= target:
+                break
+            evicted.append((dbKey,))
+            total -= size
+        db.executemany('DELETE FROM responses WHERE key=?', evicted)
+        with self._lock:
+            self.evictions += len(evicted)
+
+    def invalidate(self, resourcePath):
+        '''
+        Remove the cached responses for the resource that a path belongs to, eg. for /files/123 and /files/123/properties after a POST to /files/123
+        '''
+        count = self._db().execute('DELETE FROM responses WHERE resource=?', (self._resourceName(resourcePath),)).rowcount
+        with self._lock:
+            self.invalidations += count
+
+    def clear(self):
+        '''
+        Remove all cached responses
+        '''
+        self._db().execute('DELETE FROM responses')
+
+    def stats(self):
+        '''
+        Returns a dictionary of cache statistics: hits, misses, evictions, invalidations (of this process), and entries and bytes
+        '''
+        entries, size = self._db().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'entries': entries, 'bytes': size}
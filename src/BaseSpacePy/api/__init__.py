@@ -1,2 +1,2 @@
 
-__all__ = ['APIClient','BaseSpaceAPI','BillingAPI','BaseAPI','BaseSpaceException']
+__all__ = ['APIClient','BaseSpaceAPI','BillingAPI','BaseAPI','BaseSpaceException','ConnectionPool','ResponseCache','RemoteFile','ProjectSync']
@@ -102,6 +102,17 @@ class File(object):
         self.isInit()
         return api.fileS3metadata(self.Id)
 
+    def verifyFile(self, api, localPath):
+        '''
+        Checks a local copy of the file against the file's S3 ETag (see BaseSpaceAPI.verifyFile())
+                
+        :param api: A BaseSpaceAPI with read access on the scope including the file object.
+        :param localPath: The path of the local file
+        :returns: True if the local file matches the ETag, False otherwise
+        '''
+        self.isInit()
+        return api.verifyFile(self.Id, localPath)
+
     def getIntervalCoverage(self, api, Chrom, StartPos, EndPos):
         '''
         Returns mean coverage levels over a sequence interval.
@@ -1,7 +1,4 @@
 
-import json
-from io import StringIO
-
 class ListResponse(object):
 
     def __init__(self):
@@ -13,12 +10,6 @@ class ListResponse(object):
 
     def _convertToObjectList(self):
         '''
-        Converts items in server response from list of strings to list of python objects (though not BaseSpacePy models)                
+        Returns the items in the server response as a list of python objects (though not BaseSpacePy models)
         '''
-        l = []
-        for m in self.Response.Items:
-            io = eval(m)
-            s = json.dumps(io)
-            mj = json.loads(s)
-            l.append(mj)
-        return l
+        return list(self.Response.Items)
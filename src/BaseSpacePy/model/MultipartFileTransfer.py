@@ -3,87 +3,231 @@ import time
 import os
 import math
 import multiprocessing
+import threading
 import queue
-import shutil
 import signal
 import hashlib
-from subprocess import call
+import base64
+import json
+import io
+import concurrent.futures
+import collections
+import copy
+import pickle
+import errno
+import random
+import socket
+import statistics
+import email.utils
+import http.client
 import logging
-from BaseSpacePy.api.BaseSpaceException import MultiProcessingTaskFailedException
+import re
+import mmap
+from BaseSpacePy.api.BaseSpaceException import MultiProcessingTaskFailedException, IllegalParameterException
+from BaseSpacePy.api.BaseSpaceException import DownloadFailedException, ServerResponseException, TransferCancelledException
+from BaseSpacePy.api.BaseSpaceException import UploadPartSizeException, IntegrityCheckException
+from BaseSpacePy.api.ConnectionPool import CancelToken
 
 LOGGER = logging.getLogger(__name__)
 
+# process count and part size value that selects auto mode
+AUTO = 'auto'
+# the default upper bound on workers in auto mode
+AUTO_MAX_WORKERS = 16
+# the bounds in MB of part sizes chosen in auto mode (upload parts must be >5 and <=25 MB)
+AUTO_DOWNLOAD_PART_SIZES = (4, 100)
+AUTO_UPLOAD_PART_SIZES = (6, 25)
+# the fixed part sizes in MB, common among S3 upload clients, that an ETag's parts may have without a known part size
+ETAG_PART_SIZES = (5, 8, 16, 25, 32, 64, 100)
+# the number of threads hashing the parts of a local file at once
+HASH_THREADS = min(os.cpu_count() or 1, 8)
+
 class UploadTask(object):
     '''
-    Uploads a piece of a large local file.    
-    '''    
-    def __init__(self, api, bs_file_id, piece, total_pieces, local_path, total_size, temp_dir):
-        self.api        = api
+    Uploads a piece of a large local file, read directly from its offset in the file.
+    When md5 is set (the piece's base64 encoded MD5, see Utils.file_md5s), the piece isn't hashed again.
+    When session is set, records the piece in the UploadSession once the server has accepted it.
+
+    Tasks are small descriptors of their piece, without the api object: the worker that executes
+    a task passes its own api, which it received once when it started.
+    '''
+    def __init__(self, bs_file_id, piece, total_pieces, local_path, total_size, chunk_size, session=None, md5=None):
+        self.api        = None        # optional: an api object to use instead of the worker's (see TransferPool.submit)
         self.bs_file_id = bs_file_id  # the BaseSpace File Id
         self.piece      = piece       # piece number 
         self.total_pieces = total_pieces # out of total piece count
         self.local_path = local_path  # the path of the local file to be uploaded, including file name        
         self.total_size = total_size  # total file size of upload, for reporting
-        self.temp_dir   = temp_dir    # temp location to store file chunks for upload
-        
+        self.chunk_size = chunk_size  # the size in bytes of each piece (except the last piece)
+        self.size       = min(chunk_size, total_size - piece * chunk_size) # the size in bytes of this piece
+        self.session    = session     # optional: UploadSession of accepted pieces, for resuming uploads
+        self.md5        = md5         # optional: the base64 encoded MD5 of this piece, if already known
+
         # tasks must implement these attributes and execute()
         self.success  = False
         self.err_msg = "no error"      
+        self.error   = None # the exception of the last failure, if any, for the RetryPolicy
     
-    def execute(self, lock):
+    def execute(self, lock, api=None):
         '''
-        Upload a piece of the target file, first splitting the local file into a temp file.
+        Upload a piece of the target file, streamed from its byte range in the local file.
         Calculate md5 of file piece and pass to upload method.
         Lock is not used (but needed since worker sends it for multipart download)
         '''            
+        self.error = None
+        if self.api is not None:
+            api = self.api
         try:
-            fname = os.path.basename(self.local_path)
-            # this relies on the way the calling function has split the file
-            # but we still need to pass around the piece numbers because the BaseSpace API needs them
+            # piece numbers start from 0 here, but from 1 in the BaseSpace API, which needs them
             # to reassemble the file at the other end
-            # the zfill(4) is to make sure we have a zero padded suffix that split -a 4 -d will make
-            transFile = os.path.join(self.temp_dir, fname + str(self.piece).zfill(4))
-            #cmd = ['split', '-d', '-n', str(self.piece) + '/' + str(self.total_pieces), self.local_path]                        
-            #with open(transFile, "w") as fp:                                                    
-            #    rc = call(cmd, stdout=fp)
-            #    if rc != 0:
-            #        self.sucess = False
-            #        self.err_msg = "Splitting local file failed for piece %s" % str(self.piece)
-            #        return self            
-            with open(transFile, "r") as f:
-                out = f.read()
-                self.md5 = hashlib.md5(out).digest().encode('base64')            
-            try:
-                res = self.api.__uploadMultipartUnit__(self.bs_file_id,self.piece+1,self.md5,transFile)
-            except Exception as e:
-                self.success = False
-                self.err_msg = str(e)                
-            else:
-                # ETag contains hex encoded MD5 of part data on success
-                if res and 'ETag' in res['Response']:                
-                    self.success = True
-                else:
+            start = self.piece * self.chunk_size
+            length = self.size
+            with FilePart(self.local_path, start, length) as part:
+                if self.md5 is None:
+                    self.md5 = base64.b64encode(part.md5().digest()).decode('ascii')
+                try:
+                    res = api.__uploadMultipartUnit__(self.bs_file_id,self.piece+1,self.md5,part)
+                except Exception as e:
                     self.success = False
-                    self.err_msg = "Error - empty response from uploading file piece or missing ETag in response"
-            if self.success:
-                os.remove(transFile)
+                    self.err_msg = str(e)                
+                    self.error = e
+                else:
+                    # ETag contains hex encoded MD5 of part data on success
+                    if res and 'ETag' in res['Response']:                
+                        self.success = True
+                    else:
+                        self.success = False
+                        self.err_msg = "Error - empty response from uploading file piece or missing ETag in response"
+            if self.success and self.session is not None:
+                self.session.add(self.piece+1, length, self.md5, res['Response']['ETag'])
         # capture exception, since unpickleable exceptions may block
         except Exception as e:
             self.success = False
             self.err_msg = str(e)
+            self.error = e
         return self
         
     def __str__(self):
         return 'File piece %d of %d, total file size %s' % (self.piece, self.total_pieces, Utils.readable_bytes(self.total_size))
 
 
+class FilePart(io.RawIOBase):
+    '''
+    Read-only file-like view of a byte range of a local file, read with positional reads, so that
+    parts of a large file can be hashed and uploaded without copying them to temp files or into memory.
+    '''
+    def __init__(self, path, offset, length):
+        '''
+        :param path:   the path of the local file
+        :param offset: the offset in bytes of the first byte of the part
+        :param length: the length in bytes of the part
+        '''
+        super(FilePart, self).__init__()
+        self.fd = os.open(path, os.O_RDONLY)
+        self.offset = offset
+        self.length = length
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.length - self.pos)
+        if n <= 0:
+            return 0
+        n = os.preadv(self.fd, [memoryview(b)[:n]], self.offset + self.pos)
+        self.pos += n
+        return n
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self.pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self.pos = max(pos, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def md5(self, block_size=1024*1024):
+        '''
+        Returns the md5 (a hashlib object) of the whole part, read in blocks of block_size bytes,
+        without moving the read position
+        '''
+        md5 = hashlib.md5()
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        offset, end = self.offset, self.offset + self.length
+        while offset < end:
+            n = os.preadv(self.fd, [view[:min(block_size, end - offset)]], offset)
+            if n == 0:
+                raise IOError("Local file is shorter than expected, ending at %d of %d bytes" % (offset, end))
+            md5.update(view[:n])
+            offset += n
+        return md5
+
+    def close(self):
+        if not self.closed:
+            os.close(self.fd)
+        super(FilePart, self).close()
+
+
+class ETagHasher(object):
+    '''
+    Computes the MD5s of the ETag parts (the parts that a file was uploaded in, from which its S3 ETag
+    was computed) in a download part, from its bytes as they are written, so that the download can be
+    verified without reading it back. A download part must start at an ETag part boundary.
+    '''
+    def __init__(self, etag_part_size):
+        '''
+        :param etag_part_size: the size in bytes of the ETag parts
+        '''
+        self.etag_part_size = etag_part_size
+        self.md5s = []
+        self._md5 = hashlib.md5()
+        self._count = 0 # bytes of the current ETag part hashed so far
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            n = min(len(view), self.etag_part_size - self._count)
+            self._md5.update(view[:n])
+            self._count += n
+            view = view[n:]
+            if self._count == self.etag_part_size:
+                self.md5s.append(self._md5.hexdigest())
+                self._md5, self._count = hashlib.md5(), 0
+
+    def hexdigests(self):
+        '''
+        Returns the hex MD5s of the ETag parts, including a last, partial one at the end of the file
+        '''
+        if self._count:
+            return self.md5s + [self._md5.hexdigest()]
+        return list(self.md5s)
+
+
 class DownloadTask(object):
     '''
     Downloads a piece of a large remote file.
     When temp_dir is set (debug mode), downloads to filename with piece number appended (i.e. temp file).
+    Otherwise writes the piece to its offset in the preallocated local file with positional writes (no lock needed),
+    through fd if it is set, or else by opening the file.
+    When manifest is set, records the piece in the PartManifest once it is downloaded.
+    When etag_part_size is set, also records the MD5s of the ETag parts in the piece (see ETagHasher).
+    When hedge is set, reports to the HedgeMonitor, which may run a duplicate of a slow piece;
+    whichever copy finishes first is kept and the other is cancelled.
+
+    Tasks are small descriptors of their piece, without the api object: the worker that executes
+    a task passes its own api, which it received once when it started. When url is set (the file's
+    signed content url), the worker's api uses it rather than asking the api server again.
     '''    
-    def __init__(self, api, bs_file_id, file_name, local_dir, piece, total_pieces, part_size, total_size, temp_dir=None):
-        self.api = api                # BaseSpace api object
+    def __init__(self, bs_file_id, file_name, local_dir, piece, total_pieces, part_size, total_size, temp_dir=None, fd=None, manifest=None, hedge=None, url=None, etag_part_size=None):
+        self.api = None               # optional: an api object to use instead of the worker's (see TransferPool.submit)
         self.bs_file_id = bs_file_id  # the Id of the File in BaseSpace
         self.file_name = file_name    # the name of the file to download
         self.piece  = piece           # piece number
@@ -92,17 +236,30 @@ class DownloadTask(object):
         self.total_size  = total_size # the total size of the file in bytes
         self.local_dir = local_dir    # the path in which to store the downloaded file        
         self.temp_dir = temp_dir      # optional: set temp_dir for debug mode, which writes downloaded chunks to individual temp files         
+        self.fd = fd                  # optional: file descriptor of the (preallocated) local file, for positional writes
+        self.manifest = manifest      # optional: PartManifest of completed pieces, for resuming downloads
+        self.hedge = hedge            # optional: HedgeMonitor of the thread engine, for duplicating slow pieces
+        self.url = url                # optional: the signed content url of the file
+        self.etag_part_size = etag_part_size # optional: the size in bytes of the parts the file's ETag was computed from
+        startbyte, endbyte = Utils.part_range(piece, part_size, total_size)
+        self.size = endbyte - startbyte + 1 # the size in bytes of this piece
         
         # tasks must implement these attributes and execute()
         self.success  = False
         self.err_msg = "no error"         
+        self.error   = None # the exception of the last failure, if any, for the RetryPolicy
     
-    def execute(self, lock):
+    def execute(self, lock, api=None):
         '''
         Download a piece of the target file, first calculating start/end bytes for piece.
         Lock is to ensure that multiple processes don't write to same file concurrently.
         '''
+        self.error = None
+        if self.api is not None:
+            api = self.api
         try:
+            if self.url is not None and api.contentUrls.get(self.bs_file_id) is None:
+                api.contentUrls.put(self.bs_file_id, self.url, self.total_size)
             if self.temp_dir:
                 #transFile = os.path.join(self.temp_dir, self.file_name + "." + str(self.piece))
                 local_dir = self.temp_dir
@@ -113,45 +270,517 @@ class DownloadTask(object):
                 local_dir = self.local_dir
                 local_name = self.file_name
                 standaloneRangeFile = False
-            startbyte = (self.piece - 1) * self.part_size
-            endbyte = (self.piece * self.part_size) - 1
-            if endbyte > self.total_size:
-                endbyte = self.total_size - 1            
+            startbyte, endbyte = Utils.part_range(self.piece, self.part_size, self.total_size)
+            cancel = None
+            if self.hedge is not None:
+                if self.hedge.is_done(self.piece):
+                    self.success = True
+                    return self
+                cancel = self.hedge.start(self)
+            fd = None
+            hasher = ETagHasher(self.etag_part_size) if self.etag_part_size else None
             try:                
+                fd = self.fd
+                if fd is None and not self.temp_dir:
+                    # a worker process opens the preallocated file itself, since descriptors aren't passed to it
+                    fd = os.open(os.path.join(local_dir, local_name), os.O_WRONLY)
                 #self.api.__downloadFile__(self.bs_file_id, self.local_dir, transFile, [startbyte, endbyte], standaloneRangeFile, lock)
-                self.api.__downloadFile__(self.bs_file_id, local_dir, local_name, [startbyte, endbyte], standaloneRangeFile, lock)                                
+                api.__downloadFile__(self.bs_file_id, local_dir, local_name, [startbyte, endbyte], standaloneRangeFile, lock, fd, cancel, hasher)
             except Exception as e:
                 self.success = False
                 self.err_msg = str(e)                
+                self.error = e
             else:                
                 self.success = True
+            finally:
+                if fd is not None and fd != self.fd:
+                    os.close(fd)
+            first = True
+            if self.hedge is not None:
+                first = self.hedge.finish(self, cancel, self.success)
+                # a copy that lost to (or was cancelled by) the other copy of the piece succeeds with it
+                self.success = self.success or self.hedge.is_done(self.piece)
+            if self.success and first and self.manifest is not None:
+                self.manifest.add(self.piece, endbyte - startbyte + 1, hasher.hexdigests() if hasher else None)
         # capture exception, since unpickleable exceptions may block
         except Exception as e:
             self.success = False
             self.err_msg = str(e)
+            self.error = e
         return self
         
     def __str__(self):                
         return 'File piece %d of %d, piece size %s of total %s' % (self.piece, self.total_pieces, Utils.readable_bytes(self.part_size), Utils.readable_bytes(self.total_size))
     
-class Consumer(multiprocessing.Process):
+class PartManifest(object):
     '''
-    Multi-processing worker that executes tasks from task queue with retry
+    Append-only record of the completed parts of a multipart download, kept as a sidecar file (JSON lines)
+    beside the partial download. The first line describes the download (file Id, size and part size);
+    each following line records one completed part and its size, and when the download is verified,
+    the MD5s of the ETag parts in it. Workers in separate processes may add
+    parts concurrently, since each part is a single small append.
+    '''
+    def __init__(self, path, header):
+        '''
+        :param path:   the path of the manifest file
+        :param header: a dictionary describing the download, which must match for a manifest to be resumed
+        '''
+        self.path = path
+        self.header = header
+
+    def start(self, parts=None, md5s=None):
+        '''
+        Start a new manifest (replacing any existing one), with the parts already completed, if any
+
+        :param parts: (optional) a dictionary of part sizes by part number
+        :param md5s:  (optional) a dictionary of the ETag part MD5s of the parts by part number
+        '''
+        md5s = md5s or {}
+        with open(self.path, 'w') as fp:
+            fp.write(json.dumps(self.header) + '\n')
+            for part in sorted(parts or {}):
+                fp.write(self._entry(part, parts[part], md5s.get(part)) + '\n')
+
+    @staticmethod
+    def _entry(part, size, md5s):
+        entry = {'part': part, 'size': size}
+        if md5s is not None:
+            entry['md5s'] = md5s
+        return json.dumps(entry)
+
+    def _entries(self):
+        '''
+        Returns the part entries of an existing manifest, or None if there is no manifest or it is for a different download
+        '''
+        try:
+            with open(self.path) as fp:
+                lines = fp.read().splitlines()
+        except (IOError, OSError):
+            return None
+        entries = []
+        for i, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # the last line may be incomplete if a worker was killed
+            if i == 0:
+                if entry != self.header:
+                    return None
+            else:
+                entries.append(entry)
+        return entries if lines else None
+
+    def completed(self):
+        '''
+        Returns a dictionary of part sizes by part number, of the parts recorded in an existing manifest,
+        or None if there is no manifest or it is for a different download
+        '''
+        entries = self._entries()
+        if entries is None:
+            return None
+        return dict((entry['part'], entry['size']) for entry in entries)
+
+    def md5s(self):
+        '''
+        Returns a dictionary of the ETag part MD5s (a list of hex digests) by part number, of the parts recorded with them
+        '''
+        return dict((entry['part'], entry['md5s']) for entry in self._entries() or [] if 'md5s' in entry)
+
+    def add(self, part, size, md5s=None):
+        '''
+        Record a completed part
+
+        :param md5s: (optional) the hex MD5s of the ETag parts in the part
+        '''
+        with open(self.path, 'a') as fp:
+            fp.write(self._entry(part, size, md5s) + '\n')
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UploadSession(PartManifest):
+    '''
+    Append-only record of a multipart upload, kept as a sidecar file (JSON lines) beside the local file,
+    so that an interrupted upload can be resumed into the same BaseSpace File. The first line describes
+    the upload (destination, local file size and part size in MB) along with the Id of the BaseSpace File;
+    each following line records a part that the server accepted, with its size, MD5 and ETag.
+    '''
+    def start(self, file_id, parts=None):
+        '''
+        Start a new session (replacing any existing one), with the parts already uploaded, if any
+
+        :param file_id: the Id of the BaseSpace File that parts are uploaded to
+        :param parts:   (optional) a dictionary of part records (with 'size', 'md5' and 'etag') by part number
+        '''
+        with open(self.path, 'w') as fp:
+            fp.write(json.dumps(dict(self.header, Id=file_id)) + '\n')
+            for part in sorted(parts or {}):
+                fp.write(json.dumps(dict(parts[part], part=part)) + '\n')
+
+    def load(self):
+        '''
+        Returns a tuple of the BaseSpace File Id and a dictionary of part records by part number,
+        of an existing session, or None if there is no session or it is for a different upload
+        '''
+        try:
+            with open(self.path) as fp:
+                lines = fp.read().splitlines()
+        except (IOError, OSError):
+            return None
+        file_id, parts = None, {}
+        for i, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # the last line may be incomplete if a worker was killed
+            if i == 0:
+                file_id = entry.pop('Id', None)
+                if entry != self.header:
+                    return None
+            else:
+                parts[entry.pop('part')] = entry
+        return (file_id, parts) if file_id else None
+
+    def completed(self):
+        '''
+        Returns a dictionary of part records by part number, or None if there is no session for this upload
+        '''
+        session = self.load()
+        return session[1] if session else None
+
+    def add(self, part, size, md5, etag):
+        '''
+        Record a part that the server accepted
+
+        :param md5:  the base64 encoded MD5 of the part, as sent in the Content-MD5 header
+        :param etag: the ETag that the server returned for the part
+        '''
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps({'part': part, 'size': size, 'md5': md5, 'etag': etag}) + '\n')
+
+
+class HedgeMonitor(object):
+    '''
+    Tracks how long the pieces of a thread engine download take, to find stragglers: once a quantile
+    of the pieces are done, a piece that has been running longer than multiplier times the median piece
+    time (and at least min_seconds) is a straggler, and ThreadExecutor runs a duplicate (hedged) copy of it.
+    The first copy of a piece to finish cancels the other, through the CancelToken of its request.
+    '''
+    def __init__(self, total_pieces, quantile=0.75, multiplier=3.0, min_seconds=1.0, max_hedges=4):
+        '''
+        :param total_pieces: the number of pieces to download
+        :param quantile:     (optional) the fraction of pieces that must be done before hedging, default 0.75
+        :param multiplier:   (optional) how many times slower than the median a straggler is, default 3
+        :param min_seconds:  (optional) the least time a piece runs before it's hedged, default 1 second
+        :param max_hedges:   (optional) the most hedged copies to run at once, default 4
+        '''
+        self.total_pieces = total_pieces
+        self.quantile     = quantile
+        self.multiplier   = multiplier
+        self.min_seconds  = min_seconds
+        self.max_hedges   = max_hedges
+        self.interval     = 0.1 # seconds between checks for stragglers
+        self.hedges = self.hedge_wins = 0
+        self._running  = {} # piece: list of (start time, CancelToken, task) of running copies
+        self._done     = {} # piece: seconds the piece took
+        self._hedged   = set()
+        self._lock     = threading.Lock()
+
+    def is_done(self, piece):
+        return piece in self._done
+
+    def start(self, task):
+        '''
+        Record that a copy of a piece started
+
+        :returns: the CancelToken for the copy's requests
+        '''
+        token = CancelToken()
+        with self._lock:
+            self._running.setdefault(task.piece, []).append((time.time(), token, task))
+        return token
+
+    def finish(self, task, token, success):
+        '''
+        Record that a copy of a piece finished, cancelling the other copy if this one is first to succeed
+
+        :returns: True if this copy is the first to complete the piece
+        '''
+        with self._lock:
+            copies = self._running.get(task.piece, [])
+            started = [c[0] for c in copies if c[1] is token]
+            others = [c[1] for c in copies if c[1] is not token]
+            self._running[task.piece] = [c for c in copies if c[1] is not token]
+            if not self._running[task.piece]:
+                del self._running[task.piece]
+            if not success or task.piece in self._done:
+                return False
+            self._done[task.piece] = time.time() - started[0]
+            if task.piece in self._hedged and copies and copies[0][1] is not token:
+                self.hedge_wins += 1
+        for other in others:
+            other.cancel()
+        return True
+
+    def stragglers(self):
+        '''
+        Returns the tasks of pieces to hedge now, marking them as hedged
+        '''
+        now = time.time()
+        with self._lock:
+            if not self._done or len(self._done) < self.quantile * self.total_pieces:
+                return []
+            limit = max(self.multiplier * statistics.median(self._done.values()), self.min_seconds)
+            running_hedges = len([p for p in self._running if p in self._hedged and len(self._running[p]) > 1])
+            tasks = []
+            for piece, copies in sorted(self._running.items()):
+                if running_hedges + len(tasks) >= self.max_hedges:
+                    break
+                if piece not in self._hedged and len(copies) == 1 and now - copies[0][0] > limit:
+                    self._hedged.add(piece)
+                    tasks.append(copies[0][2])
+            self.hedges += len(tasks)
+            return tasks
+
+
+class RetryPolicy(object):
+    '''
+    Decides whether and when workers retry a failed task. Transient failures (connection errors, timeouts,
+    throttling and server errors) are retried with exponential backoff and full jitter, waiting at least as
+    long as a Retry-After header asks, until the task has been tried retries times or max_total seconds have
+    passed since its first attempt. Failures that retrying can't fix (eg. a missing file, refused credentials,
+    a full local disk) fail the task at once.
+
+    Subclass and override retryable() or backoff_wait() to change the policy. Retry counters are kept
+    in shared memory, so stats() covers the workers of all processes.
+    '''
+    # statuses of responses worth retrying: timeouts, throttling and server errors (5xx)
+    retry_statuses = set([408, 429])
+    # local errors that retrying won't fix
+    fatal_errnos = set([errno.ENOSPC, errno.EDQUOT, errno.EACCES, errno.EPERM, errno.EROFS,
+                        errno.EBADF, errno.ENOENT, errno.EISDIR, errno.ENOTDIR, errno.EFBIG])
+    # exceptions that retrying won't fix
+    fatal_exceptions = (TransferCancelledException, IllegalParameterException, MemoryError)
+
+    def __init__(self, retries=20, base_wait=0.5, max_wait=30, max_total=300, jitter=True):
+        '''
+        :param retries:   (optional) the most attempts of a task, default 20
+        :param base_wait: (optional) the wait in seconds before the first retry, doubled for each later retry, default 0.5
+        :param max_wait:  (optional) the longest wait in seconds between attempts (unless Retry-After asks for longer), default 30
+        :param max_total: (optional) the most seconds from a task's first attempt to its last retry, default 300
+        :param jitter:    (optional) wait a random time up to the backoff, so workers don't retry in step, default True
+        '''
+        self.retries   = retries
+        self.base_wait = base_wait
+        self.max_wait  = max_wait
+        self.max_total = max_total
+        self.jitter    = jitter
+        self._lock     = multiprocessing.Lock()
+        self._retries       = multiprocessing.RawValue('i', 0) # attempts that were retried
+        self._wait_seconds  = multiprocessing.RawValue('d', 0) # total time spent waiting to retry
+        self._retry_afters  = multiprocessing.RawValue('i', 0) # waits set by a Retry-After header
+        self._non_retryable = multiprocessing.RawValue('i', 0) # tasks failed on an error that isn't retried
+        self._exhausted     = multiprocessing.RawValue('i', 0) # tasks failed after all retries or max_total
+
+    def retryable(self, error):
+        '''
+        Returns whether a failure is worth retrying
+
+        :param error: the exception of the failure, or None if the task failed without one (eg. a missing ETag)
+        '''
+        if error is None:
+            return True
+        if isinstance(error, self.fatal_exceptions):
+            return False
+        status = getattr(error, 'status', None)
+        if status is not None:
+            return status in self.retry_statuses or status >= 500
+        if isinstance(error, (socket.timeout, ConnectionError, http.client.HTTPException)):
+            return True
+        if isinstance(error, OSError):
+            return error.errno not in self.fatal_errnos
+        return True
+
+    @staticmethod
+    def retry_after(error):
+        '''
+        Returns the seconds to wait that the Retry-After header of a failed response asks for, or None
+        '''
+        value = getattr(error, 'retryAfter', None)
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def backoff_wait(self, attempt):
+        '''
+        Returns the seconds to wait before retrying a task that failed its attempt'th attempt
+        '''
+        wait = min(self.base_wait * 2 ** (attempt - 1), self.max_wait)
+        if self.jitter:
+            wait = random.uniform(0, wait)
+        return wait
+
+    def next_wait(self, attempt, error, elapsed):
+        '''
+        Returns the seconds to wait before retrying a failed task, or None to fail it
+
+        :param attempt: the number of attempts made so far
+        :param error:   the exception of the last failure, or None
+        :param elapsed: the seconds since the task's first attempt
+        '''
+        if not self.retryable(error):
+            with self._lock:
+                self._non_retryable.value += 1
+            return None
+        wait = self.backoff_wait(attempt)
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            wait = max(wait, retry_after)
+        if attempt >= self.retries or elapsed + wait > self.max_total:
+            with self._lock:
+                self._exhausted.value += 1
+            return None
+        with self._lock:
+            self._retries.value += 1
+            self._wait_seconds.value += wait
+            if retry_after is not None:
+                self._retry_afters.value += 1
+        return wait
+
+    def stats(self):
+        '''
+        Returns a dictionary of retry counters: retries, wait_seconds, retry_afters, non_retryable and exhausted
+        '''
+        with self._lock:
+            return {'retries': self._retries.value, 'wait_seconds': self._wait_seconds.value,
+                    'retry_afters': self._retry_afters.value, 'non_retryable': self._non_retryable.value,
+                    'exhausted': self._exhausted.value}
+
+
+class ConcurrencyController(object):
+    '''
+    Adapts the number of workers that transfer parts at once, between min_workers and max_workers,
+    for transfers in auto mode. Workers acquire a slot before each part and release it afterwards with
+    the part's size and outcome. After each round of parts (as many as the current limit) the controller
+    compares the round's throughput with the previous round's: while throughput improves, the limit keeps
+    moving in the same direction, otherwise it turns around. A failed part halves the limit.
+
+    State is kept in shared memory, so the controller works for worker threads and worker processes alike.
+    '''
+    def __init__(self, min_workers, max_workers, initial=None):
+        '''
+        :param min_workers: the least number of workers to run at once
+        :param max_workers: the most number of workers to run at once
+        :param initial:     (optional) the number of workers to start with, default min(4, max_workers)
+        '''
+        self.min_workers = max(min_workers, 1)
+        self.max_workers = max(max_workers, self.min_workers)
+        if initial is None:
+            initial = min(4, self.max_workers)
+        self.cond = multiprocessing.Condition()
+        # guarded by cond
+        self._limit        = multiprocessing.RawValue('i', max(min(initial, self.max_workers), self.min_workers))
+        self._active       = multiprocessing.RawValue('i', 0)
+        self._direction    = multiprocessing.RawValue('i', 1)
+        self._round_parts  = multiprocessing.RawValue('i', 0)
+        self._round_bytes  = multiprocessing.RawValue('d', 0)
+        self._round_start  = multiprocessing.RawValue('d', 0)
+        self._last_rate    = multiprocessing.RawValue('d', -1)
+
+    @property
+    def limit(self):
+        '''
+        The current number of workers allowed to run at once
+        '''
+        return self._limit.value
+
+    def acquire(self, halt=None):
+        '''
+        Wait until another worker may run a part
+
+        :param halt: (optional) an event that stops waiting when set
+        :returns: True, or False if the halt event was set
+        '''
+        with self.cond:
+            while self._active.value >= self._limit.value:
+                if halt is not None and halt.is_set():
+                    return False
+                self.cond.wait(0.5)
+            self._active.value += 1
+            if not self._round_start.value:
+                self._round_start.value = time.time()
+            return True
+
+    def release(self, size, success, seconds=None, now=None):
+        '''
+        Record a finished part, and adjust the limit at the end of a round
+
+        :param size:    the size of the part in bytes
+        :param success: whether the part was transferred
+        :param seconds: (optional) how long the part took, for logging
+        :param now:     (optional) the current time, for testing
+        '''
+        if now is None:
+            now = time.time()
+        with self.cond:
+            self._active.value -= 1
+            if not success:
+                self._set_limit(max(self._limit.value // 2, self.min_workers))
+                self._direction.value = 1
+                self._last_rate.value = -1
+                self._new_round(now)
+            else:
+                self._round_parts.value += 1
+                self._round_bytes.value += size
+                if self._round_parts.value >= self._limit.value:
+                    rate = self._round_bytes.value / max(now - self._round_start.value, 1e-6)
+                    if self._last_rate.value >= 0 and rate < self._last_rate.value * 1.05:
+                        # no better than the last round - turn around
+                        self._direction.value = -self._direction.value
+                    self._last_rate.value = rate
+                    self._set_limit(min(max(self._limit.value + self._direction.value, self.min_workers), self.max_workers))
+                    self._new_round(now)
+            self.cond.notify_all()
+
+    def _set_limit(self, limit):
+        if limit != self._limit.value:
+            LOGGER.debug("Transferring %d parts at once (was %d)" % (limit, self._limit.value))
+        self._limit.value = limit
+
+    def _new_round(self, now):
+        self._round_parts.value = 0
+        self._round_bytes.value = 0
+        self._round_start.value = now
+
+
+class Worker(object):
+    '''
+    Executes tasks from task queue with retry, for Consumer (processes) and ThreadConsumer (threads)
     On failure after retries, alerts all workers to halt
     '''
     
-    def __init__(self, task_queue, result_queue, halt_event, lock):    
-        multiprocessing.Process.__init__(self)
+    def __init__(self, task_queue, result_queue, halt_event, lock, controller=None, retry_policy=None, api=None):    
         self.task_queue = task_queue
         self.result_queue = result_queue        
         self.halt = halt_event
         self.lock = lock         
+        self.controller = controller # optional: ConcurrencyController limiting how many workers run tasks at once
+        self.retry_policy = retry_policy or RetryPolicy() # decides whether and when failed tasks are retried
+        self.pooled = False # whether the worker belongs to a TransferPool (see run_pool_tasks)
+        self.api = api # the BaseSpace api object passed to tasks, handed to the worker once rather than with every task
         
         self.get_task_timeout = 5 # secs
-        self.retry_wait = 1 # sec
-        self.retries = 20
         
-    def run(self):
+    def run_tasks(self):
         '''
         Executes tasks from the task queue until poison pill is reached, halt 
         signal is found, or something went wrong such as a timeout when getting
@@ -160,13 +789,10 @@ class Consumer(multiprocessing.Process):
         For download tasks, use lock to ensure sole access (among worker
         processes) to downloaded file.
         
-        Retries failed tasks, and add task results to result_queue.
-        When a task fails for all retries, set halt signal to alert other workers
+        Retries failed tasks as the RetryPolicy allows, and add task results to result_queue.
+        When a task fails for all retries (or with an error that isn't retried), set halt signal to alert other workers
         and purge task queue or remaining tasks (to unblock join() in parent process)
-        
-        Turn off SIGINT (Ctrl C), handle in parent process
         '''
-        signal.signal(signal.SIGINT, signal.SIG_IGN)
         while True:                                
             try:
                 next_task = self.task_queue.get(True, self.get_task_timeout) # block until timeout
@@ -180,30 +806,86 @@ class Consumer(multiprocessing.Process):
             else:                                                       
                 # attempt to run tasks, with retry
                 LOGGER.debug('Worker %s processing task: %s' % (self.name, str(next_task)))
-                for i in range(1, self.retries + 1):                        
-                    if self.halt.is_set():
-                        LOGGER.debug('Worker %s exiting, found halt signal' % self.name)
-                        self.task_queue.task_done()
-                        self.purge_task_queue()
-                        return                                                            
-                    answer = next_task.execute(self.lock) # acquired lock will block other workers                                       
-                    if answer.success == True:
-                        self.task_queue.task_done()                   
-                        self.result_queue.put(True)
-                        break
-                    else:
-                        LOGGER.debug("Worker %s retrying task %s after failure, retry attempt %d, with error msg: %s" % (self.name, str(next_task), i, answer.err_msg))
-                        time.sleep(self.retry_wait)                    
-                if not answer.success == True:
-                    LOGGER.debug("Worker %s exiting, too many failures with retry for worker %s" % (self.name, str(self)))
-                    LOGGER.warning("Task failed after too many retries")        
+                answer = self.run_task(next_task)
+                if answer is None:
+                    LOGGER.debug('Worker %s exiting, found halt signal' % self.name)
+                    self.task_queue.task_done()
+                    self.purge_task_queue()
+                    return
+                if answer.success == True:
                     self.task_queue.task_done()                   
+                    self.result_queue.put(True)
+                else:
+                    LOGGER.debug("Worker %s exiting, task failed with retry for worker %s" % (self.name, str(self)))
                     self.result_queue.put(False)
-                    self.purge_task_queue() # purge task queue in case there's only one worker                    
+                    # set before the task queue can be joined, since a put to a process queue may arrive later
                     self.halt.set()
+                    self.task_queue.task_done()                   
+                    self.purge_task_queue() # purge task queue in case there's only one worker                    
                     break        
         return
+
+    def run_pool_tasks(self):
+        '''
+        Executes tasks of many transfers for a TransferPool, until poison pill is reached or halt signal is found.
+        A failed task doesn't halt the other workers; its result is reported to the pool, as a tuple of the
+        task's job, whether it succeeded, and its error message.
+        '''
+        while True:
+            next_task = self.task_queue.get()
+            if next_task is None:
+                LOGGER.debug('Worker %s exiting, found final task' % self.name)
+                self.task_queue.task_done()
+                break
+            LOGGER.debug('Worker %s processing task: %s' % (self.name, str(next_task)))
+            answer = self.run_task(next_task)
+            self.task_queue.task_done()
+            if answer is None:
+                LOGGER.debug('Worker %s exiting, found halt signal' % self.name)
+                break
+            self.result_queue.put((next_task.job, answer.success == True, answer.err_msg))
+
+    def run_task(self, task):
+        '''
+        Execute a task, retrying failures as the RetryPolicy allows
+
+        :returns: the executed task (see its success attribute), or None if the halt signal was set
+        '''
+        started = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.halt.is_set():
+                return None
+            answer = self.execute_task(task)
+            if answer is None or answer.success == True:
+                return answer
+            wait = self.retry_policy.next_wait(attempt, getattr(answer, 'error', None), time.time() - started)
+            if wait is None:
+                LOGGER.warning("Task failed after %d attempts: %s" % (attempt, answer.err_msg))
+                return answer
+            LOGGER.debug("Worker %s retrying task %s in %.1f s after failure, retry attempt %d, with error msg: %s" % (self.name, str(task), wait, attempt, answer.err_msg))
+            # wake early if another worker halts
+            self.halt.wait(wait)
     
+    def execute_task(self, task):
+        '''
+        Execute a task, once the concurrency controller (if any) allows another task to run
+
+        :returns: the executed task, or None if the halt signal was set while waiting
+        '''
+        if self.controller is None:
+            return task.execute(self.lock, self.api) # acquired lock will block other workers
+        if not self.controller.acquire(self.halt):
+            return None
+        start = time.time()
+        answer = None
+        try:
+            answer = task.execute(self.lock, self.api)
+        finally:
+            self.controller.release(getattr(task, 'size', 0), answer is not None and answer.success == True, time.time() - start)
+        return answer
+
     def purge_task_queue(self):
         '''
         Purge all remaining tasks from task queue. This will also remove poison pills
@@ -218,6 +900,48 @@ class Consumer(multiprocessing.Process):
                 break
             else:
                 self.task_queue.task_done()
+
+
+class Consumer(Worker, multiprocessing.Process):
+    '''
+    Multi-processing worker that executes tasks from task queue with retry
+    On failure after retries, alerts all workers to halt
+    '''
+    def __init__(self, task_queue, result_queue, halt_event, lock, controller=None, retry_policy=None, api=None):
+        multiprocessing.Process.__init__(self)
+        Worker.__init__(self, task_queue, result_queue, halt_event, lock, controller, retry_policy, api)
+
+    def run(self):
+        '''
+        Executes tasks (see Worker.run_tasks)
+        Turn off SIGINT (Ctrl C), handle in parent process
+        Builds the process's own api client first, so that connections inherited from the parent aren't shared
+        '''
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if self.api is not None:
+            # a pickled api drops its pooled connections and recreates its locks
+            self.api = pickle.loads(pickle.dumps(self.api))
+        if self.pooled:
+            self.run_pool_tasks()
+        else:
+            self.run_tasks()
+
+
+class ThreadConsumer(Worker, threading.Thread):
+    '''
+    Worker thread that executes tasks from task queue with retry
+    On failure after retries, alerts all workers to halt
+    '''
+    def __init__(self, task_queue, result_queue, halt_event, lock, controller=None, retry_policy=None, api=None):
+        threading.Thread.__init__(self, daemon=True)
+        Worker.__init__(self, task_queue, result_queue, halt_event, lock, controller, retry_policy, api)
+
+    def run(self):
+        if self.pooled:
+            self.run_pool_tasks()
+        else:
+            self.run_tasks()
+
                 
 class Executor(object):
     '''
@@ -228,11 +952,19 @@ class Executor(object):
     
     For downloads, lock is to ensure that only one worker writes to a local downloaded file at a time. 
     '''
-    def __init__(self):                                        
+    worker_class = Consumer
+
+    def __init__(self, retry_policy=None, api=None):                                        
+        '''
+        :param retry_policy: (optional) the RetryPolicy of the workers, default RetryPolicy()
+        :param api: (optional) the BaseSpace api object that the workers pass to tasks
+        '''
         self.tasks = multiprocessing.JoinableQueue()
         self.result_queue = multiprocessing.Queue()                        
         self.halt_event = multiprocessing.Event()
         self.lock = multiprocessing.Lock()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.api = api
     
     def add_task(self, task):
         '''
@@ -240,11 +972,13 @@ class Executor(object):
         '''
         self.tasks.put(task)        
     
-    def add_workers(self, num_workers):
+    def add_workers(self, num_workers, controller=None):
         '''
         Added workers to internal list of workers, adding a poison pill for each to the task queue
+
+        :param controller: (optional) a ConcurrencyController shared by the workers, to adapt how many run tasks at once
         '''
-        self.consumers = [ Consumer(self.tasks, self.result_queue, self.halt_event, self.lock) for i in range(num_workers) ]
+        self.consumers = [ self.worker_class(self.tasks, self.result_queue, self.halt_event, self.lock, controller, self.retry_policy, self.api) for i in range(num_workers) ]
         for c in self.consumers:
             self.tasks.put(None)
 
@@ -257,7 +991,7 @@ class Executor(object):
             w.start()        
         LOGGER.debug("Workers started")                
         try:
-            self.tasks.join()
+            self.wait_for_tasks()
         except (KeyboardInterrupt, SystemExit):
             LOGGER.debug("Halting all workers -- received exit signal")
             self.result_queue.put(False)
@@ -265,7 +999,11 @@ class Executor(object):
             self.tasks.join() # wait for workers to finish current work then exit from response to halt signal
         else:                        
             LOGGER.debug("Workers finished - task queue joined")                                   
-        finalize = True
+        stats = self.retry_policy.stats()
+        if stats['retries'] or stats['non_retryable'] or stats['exhausted']:
+            LOGGER.info("Retries %(retries)d (%(wait_seconds).1f s waiting, %(retry_afters)d by Retry-After), "
+                        "non-retryable failures %(non_retryable)d, failures after all retries %(exhausted)d" % stats)
+        finalize = not self.halt_event.is_set()
         while 1:
             try:
                 success = self.result_queue.get(False) # non-blocking                    
@@ -280,27 +1018,293 @@ class Executor(object):
         else:            
             raise MultiProcessingTaskFailedException("Multiprocessing task did not complete successfully")                                                 
 
+    def wait_for_tasks(self):
+        '''
+        Wait until all tasks are done
+        '''
+        self.tasks.join()
+
+
+class ThreadExecutor(Executor):
+    '''
+    Task manager like Executor, with workers that are threads of the current process,
+    so tasks (and the api objects they hold) are shared rather than pickled.
+    '''
+    worker_class = ThreadConsumer
+
+    def __init__(self, retry_policy=None, api=None, hedge=None):
+        '''
+        :param retry_policy: (optional) the RetryPolicy of the workers, default RetryPolicy()
+        :param api: (optional) the BaseSpace api object that the workers pass to tasks
+        :param hedge: (optional) a HedgeMonitor, to run duplicate copies of straggling download tasks
+        '''
+        self.tasks = queue.Queue()
+        self.result_queue = queue.Queue()
+        self.halt_event = threading.Event()
+        self.lock = threading.Lock()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.api = api
+        self.hedge = hedge
+
+    def wait_for_tasks(self):
+        '''
+        Wait until all tasks are done, meanwhile running a hedged copy of each straggling task in a new thread
+        '''
+        if self.hedge is None:
+            return self.tasks.join()
+        joiner = threading.Thread(target=self.tasks.join, daemon=True)
+        joiner.start()
+        hedges = []
+        while joiner.is_alive():
+            joiner.join(self.hedge.interval)
+            if self.halt_event.is_set():
+                continue
+            for task in self.hedge.stragglers():
+                LOGGER.debug("Hedging slow task %s" % str(task))
+                hedge = threading.Thread(target=copy.copy(task).execute, args=(self.lock, self.api), daemon=True)
+                hedge.start()
+                hedges.append(hedge)
+        # hedged copies are cancelled by the copies that finished first, so these end promptly
+        for hedge in hedges:
+            hedge.join()
+
+
+class TransferJob(object):
+    '''
+    The tasks of one file transferred by a TransferPool, and the Future of its result
+    '''
+    def __init__(self, job_id, tasks, finalize, cleanup=None):
+        self.id       = job_id
+        self.pending  = collections.deque(tasks) # tasks not yet handed to the workers
+        self.running  = 0                        # tasks handed to the workers, without a result yet
+        self.err_msg  = None                     # the error message of the first failed task
+        self.finalize = finalize                 # called once all tasks succeeded, returns the result
+        self.cleanup  = cleanup                  # optional: called when the job ends, before finalize
+        self.future   = concurrent.futures.Future()
+
+    def is_over(self):
+        return not self.pending and not self.running
+
+
+class TransferPool(object):
+    '''
+    Long-lived pool of transfer workers (processes or threads) shared by the multipart downloads and uploads
+    of many files, so that starting workers is paid for once rather than for every file.
+
+    Tasks of the submitted files are handed to the workers in submission order, with no more than twice the
+    number of workers queued at once, so the workers bound the concurrency over all files. Each file's
+    completion is reported through a Future; a failed part fails its file but not the other files.
+
+    Pass a pool to BaseSpaceAPI's fileDownload(), multipartFileDownload() and uploads, or call download() and
+    upload() to start transfers without waiting for them. Shut the pool down when done, eg. with a with block.
+
+    Workers are given the pool's api object once, when they start. Tasks of transfers with another api
+    object carry it with them, which for the process engine means pickling it with every task.
+    '''
+    engines = {'process': Executor, 'thread': ThreadExecutor}
+
+    def __init__(self, process_count=10, engine='thread', retry_policy=None, api=None):
+        '''
+        :param process_count: (optional) the number of workers, ie. the most parts transferred at once, default 10
+        :param engine:        (optional) 'process' or 'thread', the kind of workers, default 'thread'
+        :param retry_policy:  (optional) the RetryPolicy for failed parts, default RetryPolicy()
+        :param api:           (optional) the BaseSpace api object of the workers, eg. the one the transfers use
+        '''
+        if engine not in self.engines:
+            raise IllegalParameterException('engine', sorted(self.engines))
+        self.process_count = process_count
+        self.engine        = engine
+        self.exe           = self.engines[engine](retry_policy, api)
+        self.retry_policy  = self.exe.retry_policy
+        self.api           = api
+        self.max_queued    = 2 * process_count
+        self.closed        = False
+        self._jobs    = collections.OrderedDict() # job id: TransferJob, of jobs that aren't over
+        self._next_id = 0
+        self._queued  = 0
+        self._lock    = threading.Lock()
+        self.workers = [self.exe.worker_class(self.exe.tasks, self.exe.result_queue, self.exe.halt_event,
+                                              self.exe.lock, None, self.retry_policy, api) for i in range(process_count)]
+        for w in self.workers:
+            w.pooled = True
+            w.start()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, tasks, finalize, cleanup=None, api=None):
+        '''
+        Transfer the tasks of a file
+
+        :param tasks:    the tasks, eg. DownloadTasks, which are given a job attribute
+        :param finalize: called (in the pool's collector thread) once all tasks succeeded; its return value is the Future's result
+        :param cleanup:  (optional) called when the file's tasks are over, whether they succeeded or not
+        :param api:      (optional) the api object of the tasks, if it isn't the pool's
+        :raises MultiProcessingTaskFailedException: if the pool is shut down
+        :returns: a concurrent.futures.Future of the result of finalize
+        '''
+        with self._lock:
+            if self.closed:
+                raise MultiProcessingTaskFailedException("Transfer pool is shut down")
+            self._next_id += 1
+            job = TransferJob(self._next_id, tasks, finalize, cleanup)
+            for task in tasks:
+                task.job = job.id
+                if api is not None and api is not self.api:
+                    task.api = api
+            self._jobs[job.id] = job
+            self._dispatch()
+            # once dispatched, the job's tasks may be collected and the job ended by the collector thread
+            over = job.is_over()
+        if over:
+            self._end(job)
+        return job.future
+
+    def download(self, api, Id, localDir, partSize=25, createBsDir=False, tempDir="", resume=False, verify=False, localName=None):
+        '''
+        Start a multipart download on the pool (see BaseSpaceAPI.multipartFileDownload)
+
+        :param localName: (optional) the name to save the file under in localDir, default its BaseSpace name
+        :returns: a concurrent.futures.Future of the downloaded File
+        '''
+        return MultipartDownload(api, Id, localDir, self.process_count, partSize, createBsDir, tempDir,
+                                 self.engine, resume, pool=self, verify=verify, local_name=localName).start()
+
+    def upload(self, api, resourceType, resourceId, localPath, fileName, directory, contentType, partSize=25):
+        '''
+        Start a multipart upload on the pool (see BaseSpaceAPI.multipartFileUpload)
+
+        :returns: a concurrent.futures.Future of the uploaded File
+        '''
+        bsFile = api.__initiateMultipartFileUpload__(resourceType, resourceId, fileName, directory, contentType)
+        return MultipartUpload(api, localPath, bsFile, self.process_count, partSize, pool=self).start()
+
+    def _dispatch(self):
+        '''
+        Hand pending tasks to the workers, oldest job first, up to max_queued tasks (call with the lock held)
+        '''
+        for job in self._jobs.values():
+            while job.pending and self._queued < self.max_queued:
+                job.running += 1
+                self._queued += 1
+                self.exe.tasks.put(job.pending.popleft())
+            if self._queued >= self.max_queued:
+                break
+
+    def _collect(self):
+        '''
+        Record the results of tasks from the workers, ending jobs whose tasks are over
+        '''
+        while True:
+            result = self.exe.result_queue.get()
+            if result is None:
+                break
+            job_id, success, err_msg = result
+            with self._lock:
+                self._queued -= 1
+                job = self._jobs[job_id]
+                job.running -= 1
+                if not success and job.err_msg is None:
+                    job.err_msg = err_msg
+                    job.pending.clear()
+                over = job.is_over()
+                self._dispatch()
+            if over:
+                self._end(job)
+
+    def _end(self, job):
+        '''
+        Clean up after a job and resolve its Future, unless the job was already ended
+        '''
+        with self._lock:
+            if self._jobs.pop(job.id, None) is None:
+                return
+        try:
+            if job.cleanup is not None:
+                job.cleanup()
+            if job.err_msg is not None:
+                raise MultiProcessingTaskFailedException("Transfer task did not complete successfully: " + str(job.err_msg))
+            result = job.finalize()
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the workers, by default once all submitted files are transferred
+
+        :param wait: (optional) when False, stop the workers after their current tasks and fail unfinished files, default True
+        '''
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            futures = [job.future for job in self._jobs.values()]
+        if wait:
+            concurrent.futures.wait(futures)
+        else:
+            self.exe.halt_event.set()
+        for w in self.workers:
+            self.exe.tasks.put(None)
+        for w in self.workers:
+            w.join()
+        self.exe.result_queue.put(None)
+        self._collector.join()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.err_msg = job.err_msg or "transfer pool was shut down"
+            job.pending.clear()
+            self._end(job)
+
+
 class MultipartUpload(object):
     '''
-    Uploads a (large) file by uploading file parts in separate processes.    
+    Uploads a (large) file by uploading file parts in separate processes.
+    Each part is read from its offset in the local file, so no temporary copies of the parts are made.
+    The MD5s of all parts are computed up front, in parallel (see Utils.file_md5s), and handed to the
+    tasks for their Content-MD5 headers; they also give the ETag the uploaded file will have (etag).
+
+    When session is set, parts that the server accepts are recorded in the UploadSession, whose PartSize
+    must be the resolved part size in MB (not 'auto'). A session
+    loaded from an interrupted upload into the same BaseSpace File lists the parts already uploaded;
+    those whose MD5 and ETag still match the local file are skipped, and the rest are sent again.
+
+    With pool, parts are uploaded by the workers of a TransferPool instead of new ones.
     '''
-    def __init__(self, api, local_path, bs_file, process_count, part_size, temp_dir):
+    def __init__(self, api, local_path, bs_file, process_count, part_size, temp_dir=None, session=None, max_workers=AUTO_MAX_WORKERS, retry_policy=None, pool=None):
         '''
         Create a multipart upload object
         
         :param api:           the BaseSpace API object        
         :param local_path:    the path of the local file, including file name
         :param bs_file:       the File object of the newly created BaseSpace File to upload 
-        :param process_count: the number of process to use for uploading
-        :param part_size:     in MB, the size of each uploaded part        
-        :param temp_dir:      temp directory to store file pieces for upload 
+        :param process_count: the number of process to use for uploading, or 'auto' to adapt it to the measured throughput
+        :param part_size:     in MB, the size of each uploaded part, or 'auto' to choose it from the file size
+        :param temp_dir:      (no longer used, parts are read from the local file)
+        :param session:       (optional) the UploadSession in which to record uploaded parts
+        :param max_workers:   (optional) the most processes to use in auto mode, default 16
+        :param retry_policy:  (optional) the RetryPolicy for failed parts, default RetryPolicy()
+        :param pool:          (optional) a TransferPool whose workers upload the parts
         '''
+        if pool is not None:
+            max_workers = pool.process_count
         self.api            = api    
         self.local_path     = local_path    
         self.remote_file    = bs_file
         self.process_count  = process_count
         self.part_size      = part_size
+        self.max_workers    = max_workers
         self.temp_dir       = temp_dir               
+        self.session        = session
+        self.retry_policy   = retry_policy or RetryPolicy()
+        self.pool           = pool
                                            
         self.start_chunk    = 0
     
@@ -309,44 +1313,92 @@ class MultipartUpload(object):
         Start the upload, then when complete retrieve and return the file object from
         BaseSpace that has updated (completed) attributes.
         '''
+        if self.pool is not None:
+            return self.start().result()
         self._setup()
         self._start_workers()        
         return self.api.getFileById(self.remote_file.Id)                        
+
+    def start(self):
+        '''
+        Start the upload on the TransferPool, without waiting for it
+
+        :returns: a concurrent.futures.Future of the uploaded File, with updated (completed) attributes
+        '''
+        self._setup()
+        return self.pool.submit(self.tasks, self._finalize, api=self.api)
+
+    def _finalize(self):
+        self._finalize_upload()
+        return self.api.getFileById(self.remote_file.Id)
     
     def _setup(self):        
         '''
         Determine number of file pieces to upload, add upload tasks to work queue         
         '''                
-        logfile = os.path.join(self.temp_dir, "main.log")
         total_size = os.path.getsize(self.local_path)        
+        if self.part_size == AUTO:
+            self.part_size = Utils.auto_part_size(total_size, self.max_workers, *AUTO_UPLOAD_PART_SIZES)
+        if self.session is not None and self.session.header.get('PartSize') != self.part_size:
+            # parts of another size have other boundaries, and their numbers may run past the last part
+            raise UploadPartSizeException("upload session records %s MB parts, not %s MB" % (self.session.header.get('PartSize'), self.part_size))
         fileCount = int(total_size/(self.part_size*1024*1024)) + 1
 
-        chunk_size = (total_size / fileCount) + 1
+        chunk_size = (total_size // fileCount) + 1
         assert chunk_size * fileCount > total_size
 
-        fname = os.path.basename(self.local_path)
-        prefix = os.path.join(self.temp_dir, fname)
-        # -a 4  always use 4 digit sufixes, to make sure we can predict the filenames
-        # -d    use digits as suffixes, not letters
-        # -b    chunk size (in bytes)
-        cmd = ['split', '-a', '4', '-d', '-b', str(chunk_size), self.local_path, prefix]
-        rc = call(cmd)
-        if rc != 0:
-            err_msg = "Splitting local file failed: %s" % str.local_path
-            raise MultiProcessingTaskFailedException(err_msg)
-
-        self.exe = Executor()                    
+        # hash all parts at once, in parallel, for their Content-MD5 headers, the file's ETag and checking resumed parts
+        md5s = Utils.file_md5s(self.local_path, chunk_size, length=total_size)
+        self.etag = Utils.etag([md5.hexdigest() for md5 in md5s], fileCount)
+
+        completed = {}
+        if self.session is not None:
+            completed = self._completed_parts(md5s)
+            # rewritten even when resuming, to drop any incomplete last line
+            self.session.start(self.remote_file.Id, completed)
+
+        self.tasks = []
         for i in range(self.start_chunk, fileCount):
-            t = UploadTask(self.api, self.remote_file.Id, i, fileCount, self.local_path, total_size, self.temp_dir)            
-            self.exe.add_task(t)            
-        self.exe.add_workers(self.process_count)
-        self.task_total = fileCount - self.start_chunk + 1                                                
+            if i+1 in completed:
+                continue
+            md5 = base64.b64encode(md5s[i].digest()).decode('ascii') if i < len(md5s) else None
+            self.tasks.append(UploadTask(self.remote_file.Id, i, fileCount, self.local_path, total_size, chunk_size, self.session, md5))
+        self.task_total = len(self.tasks)
 
         LOGGER.info("Total File Size %s" % Utils.readable_bytes(total_size))
+        LOGGER.info("File ETag %s" % self.etag)
         LOGGER.info("Using File Part Size %d MB" % self.part_size)
-        LOGGER.info("Processes %d" % self.process_count)
+        if self.pool is None:
+            self.exe = Executor(self.retry_policy, self.api)                    
+            for t in self.tasks:
+                self.exe.add_task(t)            
+            workers, controller = Utils.workers(self.process_count, self.task_total, self.max_workers)
+            self.exe.add_workers(workers, controller)
+            LOGGER.info("Processes %d%s" % (workers, " (auto)" if controller else ""))
         LOGGER.info("File Chunk Count %d" % self.task_total)
         LOGGER.info("Start Chunk %d" % self.start_chunk)    
+        LOGGER.info("Chunks Already Uploaded %d" % len(completed))
+
+    def _completed_parts(self, md5s):
+        '''
+        Returns the parts recorded in the session of an interrupted upload into the same BaseSpace File,
+        whose MD5 and ETag match the local file's data
+
+        :param md5s: the MD5s (hashlib objects) of the parts of the local file
+        '''
+        session = self.session.load()
+        if not session or session[0] != self.remote_file.Id:
+            return {}
+        completed = {}
+        for part, record in session[1].items():
+            if not 1 <= part <= len(md5s):
+                continue
+            digest = md5s[part - 1]
+            # the ETag of a part is the hex encoded MD5 of the data the server received
+            if (record.get('md5') == base64.b64encode(digest.digest()).decode('ascii') and
+                    str(record.get('etag')).strip('"') == digest.hexdigest()):
+                completed[part] = record
+        return completed
 
     def _start_workers(self):
         '''
@@ -361,25 +1413,183 @@ class MultipartUpload(object):
         '''
         LOGGER.debug("Marking uploaded file status as complete")                                                   
         self.api.__finalizeMultipartFileUpload__(self.remote_file.Id)
+        if self.session is not None:
+            self.session.remove()
+
+class MultipartStreamUpload(object):
+    '''
+    Uploads data of unknown length, from a binary file-like object or an iterator of bytes, as the parts
+    of a multipart upload. Parts are buffered one at a time as the producer writes them and uploaded by a
+    pool of threads while the next part is read, so at most thread_count + 1 parts are held in memory.
+    '''
+    def __init__(self, api, stream, bs_file, thread_count, part_size, retry_policy=None):
+        '''
+        Create a multipart stream upload object
+
+        :param api:          the BaseSpace API object
+        :param stream:       a binary file-like object (read to its end), or an iterable of bytes
+        :param bs_file:      the File object of the newly created BaseSpace File to upload
+        :param thread_count: the number of threads to use for uploading
+        :param part_size:    in MB, the size of each uploaded part
+        :param retry_policy: (optional) the RetryPolicy for failed parts, default RetryPolicy(retries=5)
+        '''
+        self.api          = api
+        self.stream       = stream
+        self.remote_file  = bs_file
+        self.thread_count = thread_count
+        self.part_size    = part_size
+        self.retry_policy = retry_policy or RetryPolicy(retries=5)
+
+        self.total_size = 0
+
+    def upload(self):
+        '''
+        Upload the stream, then when complete retrieve and return the file object from
+        BaseSpace that has updated (completed) attributes.
+        '''
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.thread_count)
+        pending = set()
+        try:
+            for number, data in enumerate(self._parts(), 1):
+                # wait for an upload thread to be free before reading the next part, to bound memory use
+                while len(pending) >= self.thread_count:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(self._upload_part, number, data))
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        LOGGER.info("Uploaded %s in %d parts" % (Utils.readable_bytes(self.total_size), number))
+        LOGGER.debug("Marking uploaded file status as complete")
+        self.api.__finalizeMultipartFileUpload__(self.remote_file.Id)
+        return self.api.getFileById(self.remote_file.Id)
+
+    def _parts(self):
+        '''
+        Yields the parts of the stream, as bytes-like objects of part_size bytes (except the last part);
+        an empty stream yields one empty part
+        '''
+        part_bytes = self.part_size * 1024 * 1024
+        count = 0
+        if hasattr(self.stream, 'readinto'):
+            while True:
+                buf = bytearray(part_bytes)
+                view = memoryview(buf)
+                n = 0
+                while n < part_bytes:
+                    read = self.stream.readinto(view[n:])
+                    if not read:
+                        break
+                    n += read
+                if n or not count:
+                    count += 1
+                    self.total_size += n
+                    yield view[:n]
+                if n < part_bytes:
+                    return
+        if hasattr(self.stream, 'read'):
+            chunks = iter(lambda: self.stream.read(part_bytes), b'')
+        else:
+            chunks = iter(self.stream)
+        buf = bytearray()
+        for chunk in chunks:
+            buf += chunk
+            while len(buf) >= part_bytes:
+                count += 1
+                self.total_size += part_bytes
+                yield bytes(buf[:part_bytes])
+                del buf[:part_bytes]
+        if buf or not count:
+            self.total_size += len(buf)
+            yield bytes(buf)
+
+    def _upload_part(self, number, data):
+        '''
+        Upload one part, with retry
+
+        :raises MultiProcessingTaskFailedException: if the part could not be uploaded
+        '''
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+        started = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            error = None
+            try:
+                res = self.api.__uploadMultipartUnit__(self.remote_file.Id, number, md5, data)
+            except Exception as e:
+                err_msg = str(e)
+                error = e
+            else:
+                # ETag contains hex encoded MD5 of part data on success
+                if res and 'ETag' in (res.get('Response') or {}):
+                    return
+                err_msg = "Error - empty response from uploading file piece or missing ETag in response"
+            wait = self.retry_policy.next_wait(attempt, error, time.time() - started)
+            if wait is None:
+                break
+            LOGGER.debug("Retrying upload of part %d in %.1f s after failure, retry attempt %d, with error msg: %s" % (number, wait, attempt, err_msg))
+            time.sleep(wait)
+        raise MultiProcessingTaskFailedException("Uploading part %d failed after %d attempts: %s" % (number, attempt, err_msg))
+
 
 class MultipartDownload(object):
     '''
-    Downloads a (large) file by downloading file parts in separate processes.
+    Downloads a (large) file by downloading file parts in separate processes, or threads.
     When temp_dir is set (debug mode), downloads chunks to individual temp files, then cats them together.
     Returns File object when complete.
+
+    The local file is preallocated at its full size, so it doesn't grow piecemeal (and fragment) under
+    concurrent writers, and each worker writes its parts to their own offsets with positional writes,
+    so no write lock is needed. Threads share one open file; worker processes open it themselves.
+    In debug mode, the part files are assembled into the preallocated file at their offsets by the kernel.
+
+    Completed parts are recorded in a PartManifest beside the partial file (or the part files, in debug mode).
+    With resume, a download that was interrupted fetches only the parts that the manifest doesn't list.
+
+    With hedge (thread engine only), a part that is still downloading long after most parts have
+    finished is requested again on another connection, and the slower of the two copies is cancelled.
+
+    With pool, parts are downloaded by the workers of a TransferPool (with its engine) instead of new ones.
+
+    With verify, the download is checked against the file's S3 ETag before it is completed. The ETag is the
+    MD5 of the file, or for a file uploaded in parts, the MD5 of the MD5s of its parts (with the number of parts).
+    Download parts are sized to cover whole upload parts, and each worker hashes the upload parts in its download
+    part as it writes them (see ETagHasher), so the file isn't read back. The upload part size is verify
+    in MB, or if verify is True, the most likely size for the number of parts and the file size; the file is
+    read back to try the other possible sizes only if it doesn't match (see Utils.etag_part_sizes).
+    A file with the ETag of a single upload part is downloaded in one part.
     '''
-    def __init__(self, api, file_id, local_dir, process_count, part_size, create_bs_dir, temp_dir=""):
+    engines = {'process': Executor, 'thread': ThreadExecutor}
+
+    def __init__(self, api, file_id, local_dir, process_count, part_size, create_bs_dir, temp_dir="", engine='process', resume=False, max_workers=AUTO_MAX_WORKERS, hedge=False, retry_policy=None, pool=None, verify=False, local_name=None):
         '''
         Create a multipart download object
         
         :param api:           the BaseSpace API object
         :param file_id:       the BaseSpace File Id of the file to download
         :param local_dir:     the local directory in which to store the downloaded file
-        :param process_count: the number of process to use for downloading
-        :param part_size:     in MB, the size of each file part to download        
+        :param process_count: the number of process to use for downloading, or 'auto' to adapt it to the measured throughput
+        :param part_size:     in MB, the size of each file part to download, or 'auto' to choose it from the file size
         :param create_bs_dir: when True, create BaseSpace File's directory in local_dir; when False, ignore Bs directory
         :param temp_dir:      (optional) temp directory for debug mode        
+        :param engine:        (optional) 'process' or 'thread', the kind of workers that download parts, default 'process'
+        :param resume:        (optional) continue an interrupted download of the same file, part size and local path, default False
+        :param max_workers:   (optional) the most workers to use in auto mode, default 16
+        :param hedge:         (optional) duplicate the requests for straggling parts, with the thread engine, default False
+        :param retry_policy:  (optional) the RetryPolicy for failed parts, default RetryPolicy()
+        :param pool:          (optional) a TransferPool whose workers download the parts
+        :param verify:        (optional) check the download against the file's ETag: True, or the part size in MB the file was uploaded in, default False
+        :param local_name:    (optional) the name of the local file (and of its partial file and manifest) in local_dir, default the BaseSpace File's name
         '''
+        if pool is not None:
+            engine, max_workers = pool.engine, pool.process_count
+        if engine not in self.engines:
+            raise IllegalParameterException('engine', sorted(self.engines))
+        if local_name is not None and (local_name in ('', '.', '..') or os.path.basename(local_name) != local_name):
+            raise IllegalParameterException('local_name', 'a single path component')
         self.api            = api            
         self.file_id        = file_id         
         self.local_dir      = local_dir               
@@ -387,17 +1597,62 @@ class MultipartDownload(object):
         self.part_size      = part_size              
         self.temp_dir       = temp_dir
         self.create_bs_dir  = create_bs_dir        
+        self.engine         = engine
+        self.resume         = resume
+        self.max_workers    = max_workers
+        self.hedge          = hedge
+        self.retry_policy   = retry_policy or RetryPolicy()
+        self.pool           = pool
+        self.verify         = verify
+        self.local_name     = local_name
+        self.fd             = None
+        self.etag           = None
+        self.etag_part_size = None
+        self.etag_part_sizes = []
 
         self.start_chunk      = 1        
         self.partial_file_ext = ".partial"
+        self.manifest_ext     = ".parts"
     
     def download(self):
         '''
         Start the download
         '''
+        if self.pool is not None:
+            return self.start().result()
         self._setup()
-        self._start_workers()
+        try:
+            self._start_workers()
+        finally:
+            self._close()
         return self.bs_file                
+
+    def start(self):
+        '''
+        Start the download on the TransferPool, without waiting for it
+
+        :returns: a concurrent.futures.Future of the File
+        '''
+        self._setup()
+        try:
+            return self.pool.submit(self.tasks, self._finalize, self._close, self.api)
+        except Exception:
+            self._close()
+            raise
+
+    def _finalize(self):
+        if self.etag is not None:
+            self._verify()
+        if self.temp_dir:
+            self._combine_file_chunks()
+        else:
+            self._rename_final_file()
+        return self.bs_file
+
+    def _close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
         
     def _setup(self):
         '''
@@ -407,10 +1662,20 @@ class MultipartDownload(object):
         While download is in progress, name the file with a 'partial' extension 
         '''
         self.bs_file = self.api.getFileById(self.file_id)
-        self.file_name = self.bs_file.Name
+        # resolve the signed content url once, for all parts (which carry it to the workers)
+        url = self.api.__contentUrl__(self.file_id)[0]
+        self.file_name = self.local_name or self.bs_file.Name
         total_bytes = self.bs_file.Size
+        if self.part_size == AUTO:
+            self.part_size = Utils.auto_part_size(total_bytes, self.max_workers, *AUTO_DOWNLOAD_PART_SIZES)
         part_size_bytes = self.part_size * (1024**2)
+        if self.verify:
+            self._setup_verify(total_bytes)
+            if self.etag_part_size:
+                # download parts cover whole ETag parts, so they can be hashed as they are written
+                part_size_bytes = max(int(round(part_size_bytes / float(self.etag_part_size))), 1) * self.etag_part_size
         self.file_count = int(math.ceil(total_bytes/part_size_bytes))
+        self.part_size_bytes = part_size_bytes
         
         file_name = self.file_name
         if not self.temp_dir:
@@ -427,29 +1692,150 @@ class MultipartDownload(object):
                 if not os.path.exists(self.full_temp_dir):
                     os.makedirs(self.full_temp_dir)
         
-        self.exe = Executor()                    
+        manifest_dir = self.full_temp_dir if self.temp_dir else self.full_local_dir
+        header = {'Id': self.file_id, 'Size': total_bytes, 'PartSize': part_size_bytes}
+        if self.etag is not None:
+            header['ETagPartSize'] = self.etag_part_size
+        self.manifest = PartManifest(os.path.join(manifest_dir, file_name + self.manifest_ext), header)
+        completed, md5s = {}, {}
+        if self.resume:
+            completed = self._completed_parts(file_name, part_size_bytes, total_bytes)
+            md5s = self.manifest.md5s()
+        # rewritten even when resuming, to drop any incomplete last line
+        self.manifest.start(completed, md5s)
+
+        if not self.temp_dir:
+            self.fd = self._preallocate(os.path.join(self.full_local_dir, file_name), total_bytes)
+            if self.engine != 'thread':
+                # worker processes open the file themselves
+                self._close()
+
+        hedge = None
+        if self.hedge:
+            if self.fd is None or self.pool is not None:
+                LOGGER.warning("Hedged downloads need the thread engine without temp_dir or pool; not hedging")
+            else:
+                # the number of tasks is known once they are created
+                hedge = HedgeMonitor(0)
+        self.tasks = []
         for i in range(self.start_chunk, self.file_count+1):         
-            t = DownloadTask(self.api, self.file_id, file_name, self.full_local_dir, 
-                             i, self.file_count, part_size_bytes, total_bytes, self.full_temp_dir)
-            self.exe.add_task(t)            
-        self.exe.add_workers(self.process_count)        
-        self.task_total = self.file_count - self.start_chunk + 1                                                
-                                 
+            if i in completed:
+                continue
+            self.tasks.append(DownloadTask(self.file_id, file_name, self.full_local_dir, 
+                              i, self.file_count, part_size_bytes, total_bytes, self.full_temp_dir, self.fd, self.manifest, hedge, url,
+                              self.etag_part_size if self.etag is not None else None))
+        self.task_total = len(self.tasks)
+        if hedge is not None:
+            hedge.total_pieces = self.task_total
+
         LOGGER.info("Total File Size %s" % Utils.readable_bytes(total_bytes))
-        LOGGER.info("Using File Part Size %s MB" % str(self.part_size))
-        LOGGER.info("Processes %d" % self.process_count)
+        LOGGER.info("Using File Part Size %s" % Utils.readable_bytes(part_size_bytes))
+        if self.pool is None:
+            self.exe = self.engines[self.engine](self.retry_policy, self.api)
+            if hedge is not None:
+                self.exe.hedge = hedge
+            for t in self.tasks:
+                self.exe.add_task(t)
+            workers, controller = Utils.workers(self.process_count, self.task_total, self.max_workers)
+            self.exe.add_workers(workers, controller)
+            LOGGER.info("Processes %d (%s engine%s)" % (workers, self.engine, ", auto" if controller else ""))
         LOGGER.info("File Chunk Count %d" % self.file_count)
         LOGGER.info("Start Chunk %d" % self.start_chunk)
+        LOGGER.info("Chunks Already Downloaded %d" % len(completed))
+
+    def _setup_verify(self, total_bytes):
+        '''
+        Get the file's ETag, and the size of the parts it was computed from, or warn that the download can't be verified
+        '''
+        etag = self.api.fileS3metadata(self.file_id)['etag'].lower()
+        parts = Utils.etag_parts(etag)
+        part_size = self.verify if self.verify is not True else None
+        sizes = Utils.etag_part_sizes(parts, total_bytes, part_size) if parts is not None else []
+        if not sizes:
+            LOGGER.warning("Not verifying the download of file %s: its ETag '%s' isn't computed from MD5s of a known part size" % (self.file_id, etag))
+            return
+        # parts are hashed as they are written in the most likely size, the others are only tried if that doesn't match
+        self.etag, self.etag_part_size, self.etag_part_sizes = etag, sizes[0], sizes
+
+    def _verify(self):
+        '''
+        Compare the ETag computed from the MD5s recorded for the downloaded parts with the file's ETag,
+        hashing any part that wasn't recorded with its MD5s. If they differ and the ETag's parts may have other
+        sizes, the downloaded file is hashed in each of those too (not in debug mode, where parts are separate files).
+
+        :raises DownloadFailedException: if the ETags differ, for the only size the ETag's parts may have
+        :raises IntegrityCheckException: if the ETags differ for each of several sizes the ETag's parts may have
+        '''
+        total_bytes = self.bs_file.Size
+        recorded = self.manifest.md5s()
+        md5s = []
+        for i in range(self.start_chunk, self.file_count+1):
+            if i not in recorded:
+                startbyte, endbyte = Utils.part_range(i, self.part_size_bytes, total_bytes)
+                if self.temp_dir:
+                    path, offset = os.path.join(self.full_temp_dir, self.file_name + '.' + str(i)), 0
+                else:
+                    path, offset = os.path.join(self.full_local_dir, self.file_name + self.partial_file_ext), startbyte
+                recorded[i] = [md5.hexdigest() for md5 in Utils.file_md5s(path, self.etag_part_size, offset, endbyte - startbyte + 1)]
+            md5s.extend(recorded[i])
+        parts = Utils.etag_parts(self.etag)
+        etag = Utils.etag(md5s, parts)
+        if etag != self.etag and len(self.etag_part_sizes) > 1:
+            if not self.temp_dir:
+                path = os.path.join(self.full_local_dir, self.file_name + self.partial_file_ext)
+                for size in self.etag_part_sizes[1:]:
+                    if Utils.etag([md5.hexdigest() for md5 in Utils.file_md5s(path, size, length=total_bytes)], parts) == self.etag:
+                        LOGGER.info("Verified download against ETag %s (with parts of %s)" % (self.etag, Utils.readable_bytes(size)))
+                        return
+            # the download may well be intact, in parts of another size, so it is kept for resuming
+            raise IntegrityCheckException("cannot verify the download of file %s, its ETag %s matches none of the part sizes %s" %
+                                          (self.file_id, self.etag, ', '.join(Utils.readable_bytes(size) for size in self.etag_part_sizes)))
+        if etag != self.etag:
+            # the parts can't be trusted for resuming
+            self.manifest.remove()
+            raise DownloadFailedException("ETag of downloaded file %s doesn't match the ETag in BaseSpace %s (with parts of %s)" %
+                                          (etag, self.etag, Utils.readable_bytes(self.etag_part_size)))
+        LOGGER.info("Verified download against ETag %s" % etag)
+
+    def _completed_parts(self, file_name, part_size_bytes, total_bytes):
+        '''
+        Returns the parts recorded in the manifest of an interrupted download, whose downloaded data is still present
+        '''
+        completed = self.manifest.completed() or {}
+        if not self.temp_dir and not os.path.exists(os.path.join(self.full_local_dir, file_name)):
+            return {}
+        for i, size in list(completed.items()):
+            start, end = Utils.part_range(i, part_size_bytes, total_bytes)
+            if size != end - start + 1 or (self.temp_dir and
+                    not os.path.exists(os.path.join(self.full_temp_dir, self.file_name + '.' + str(i)))):
+                del completed[i]
+        return completed
                             
+    @staticmethod
+    def _preallocate(path, size):
+        '''
+        Open (creating) a local file for positional writes, allocated at its full size
+
+        :returns: the file descriptor
+        '''
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            os.ftruncate(fd, size)
+            if size and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    pass # not supported by the filesystem - the file is sparse instead
+        except Exception:
+            os.close(fd)
+            raise
+        return fd
+
     def _start_workers(self):
         '''
         Start download workers, register finalize callback method
         '''        
-        if self.temp_dir:
-            finalize_callback = self._combine_file_chunks
-        else:
-            finalize_callback = self._rename_final_file # lambda: None            
-        self.exe.start_workers(finalize_callback)                        
+        self.exe.start_workers(self._finalize)                        
     
     def _rename_final_file(self):
         '''
@@ -458,29 +1844,183 @@ class MultipartDownload(object):
         final_file = os.path.join(self.full_local_dir, self.file_name)
         partial_file = final_file + self.partial_file_ext
         os.rename(partial_file, final_file) 
+        self.manifest.remove()
     
     def _combine_file_chunks(self):
         '''
-        Assembles download files chunks into single large file, then cleanup by deleting file chunks
+        Assembles download files chunks into single large file, then cleanup by deleting file chunks.
+        Each chunk is copied to its offset in the preallocated file by the kernel (see Utils.copy_range),
+        without passing through user space.
         '''        
         LOGGER.debug("Assembling downloaded file parts into single file")                                                   
+        total_bytes = self.bs_file.Size
         part_files = [os.path.join(self.full_temp_dir, self.file_name + '.' + str(i)) for i in range(self.start_chunk, self.file_count+1)]                    
-        with open(os.path.join(self.full_local_dir, self.file_name), 'w+b') as whole_file:
-            for part_file in part_files:                
-                shutil.copyfileobj(open(part_file, 'r+b'), whole_file)                         
+        fd = self._preallocate(os.path.join(self.full_local_dir, self.file_name), total_bytes)
+        try:
+            for i, part_file in enumerate(part_files, self.start_chunk):
+                startbyte, endbyte = Utils.part_range(i, self.part_size_bytes, total_bytes)
+                Utils.copy_range(part_file, fd, startbyte, endbyte - startbyte + 1)
+        finally:
+            os.close(fd)
         for part_file in part_files:
             os.remove(part_file)                        
+        self.manifest.remove()
 
 class Utils(object):
     '''
     Utility methods for multipartDownload classes
     '''
+    @staticmethod
+    def part_range(piece, part_size, total_size):
+        '''
+        Returns the first and last byte of a download piece (numbered from 1), for parts of part_size bytes
+        '''
+        startbyte = (piece - 1) * part_size
+        endbyte = min(piece * part_size, total_size) - 1
+        return startbyte, endbyte
+
+    @staticmethod
+    def auto_part_size(total_size, max_workers, min_size, max_size, parts_per_worker=4):
+        '''
+        Returns a part size in MB for a transfer in auto mode: large enough to keep requests few, and small enough
+        that each of max_workers workers gets parts_per_worker parts, within min_size and max_size MB
+        '''
+        size = int(math.ceil(total_size / float(max_workers * parts_per_worker * 1024**2)))
+        return min(max(size, min_size), max_size)
+
+    @staticmethod
+    def workers(process_count, part_count, max_workers):
+        '''
+        Returns the number of workers to start for a transfer, and the ConcurrencyController to share between
+        them in auto mode (process_count 'auto'), when no more workers are started than there are parts, or None
+        '''
+        if process_count != AUTO:
+            return process_count, None
+        workers = max(min(part_count, max_workers), 1)
+        return workers, ConcurrencyController(1, workers)
+
+    @staticmethod
+    def etag_parts(etag):
+        '''
+        Returns the number of parts of an S3 ETag (0 for the MD5 of a file uploaded in a single part),
+        or None if the ETag isn't computed from MD5s (eg. for an encrypted object)
+        '''
+        m = re.match(r'^"?[0-9a-fA-F]{32}(?:-(\d+))?"?$', etag or '')
+        if m is None:
+            return None
+        return int(m.group(1)) if m.group(1) else 0
+
+    @staticmethod
+    def etag_part_sizes(parts, total_size, part_size=None):
+        '''
+        Returns the sizes in bytes that the parts of a file with an ETag of parts parts may have, most likely first:
+        the file size for a single part, else part_size MB if the file has that many parts of it, or without part_size,
+        the size of the parts that MultipartUpload splits a file into evenly and those of ETAG_PART_SIZES that give
+        the file that many parts
+        '''
+        if parts == 0:
+            return [total_size]
+        if part_size:
+            sizes = [part_size * 1024**2]
+        else:
+            sizes = [total_size // parts + 1] + [size * 1024**2 for size in ETAG_PART_SIZES]
+        found = []
+        for size in sizes:
+            if size not in found and int(math.ceil(total_size / float(size))) == parts:
+                found.append(size)
+        return found
+
+    @staticmethod
+    def etag(md5s, parts):
+        '''
+        Returns the S3 ETag of a file from the hex MD5s of the parts it was uploaded in: the MD5 itself for
+        a single part upload (parts 0), else the MD5 of the part MD5s, with the number of parts
+        '''
+        if parts == 0:
+            return md5s[0] if md5s else hashlib.md5().hexdigest()
+        return '%s-%d' % (hashlib.md5(b''.join(bytes.fromhex(md5) for md5 in md5s)).hexdigest(), len(md5s))
+
+    @staticmethod
+    def file_md5s(path, part_size, offset=0, length=None, threads=HASH_THREADS):
+        '''
+        Returns the MD5s (hashlib objects) of the consecutive parts of part_size bytes of a local file, or of length bytes
+        of it from offset. The parts are hashed in parallel by a pool of threads, straight from the file mapped into
+        memory (hashlib releases the GIL while hashing, and mapped slices aren't copied)
+
+        :raises IOError: if the file is shorter than offset + length
+        '''
+        with open(path, 'rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if length is None:
+                length = size - offset
+            if offset + length > size:
+                raise IOError("Local file is shorter than expected, ending at %d of %d bytes" % (size, offset + length))
+            starts = list(range(offset, offset + length, part_size)) if part_size else []
+            if not starts:
+                return []
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            def md5(start):
+                return hashlib.md5(view[start:min(start + part_size, offset + length)])
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(threads, len(starts))) as pool:
+                return list(pool.map(md5, starts))
+        finally:
+            view.release()
+            mapped.close()
+
+    @staticmethod
+    def copy_range(path, fd, offset, length, block_size=1024*1024):
+        '''
+        Copies a file of length bytes to an offset of an open file, with copy_file_range where the
+        platform has it (in the kernel, or by sharing blocks on filesystems with reflinks),
+        and with positional reads and writes otherwise
+
+        :raises DownloadFailedException: if the file is shorter than length
+        '''
+        copied = 0
+        with open(path, 'rb') as src:
+            if hasattr(os, 'copy_file_range'):
+                try:
+                    while copied < length:
+                        n = os.copy_file_range(src.fileno(), fd, length - copied, copied, offset + copied)
+                        if not n:
+                            break
+                        copied += n
+                except OSError as e:
+                    # not supported between these files, eg. across filesystems on older kernels
+                    if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                        raise
+            while copied < length:
+                data = os.pread(src.fileno(), min(block_size, length - copied), copied)
+                if not data:
+                    break
+                view = memoryview(data)
+                while len(view):
+                    n = os.pwrite(fd, view, offset + copied)
+                    view = view[n:]
+                    copied += n
+        if copied != length:
+            raise DownloadFailedException("Part file size is not as expected: %d vs %d" % (copied, length))
+
     @staticmethod
     def md5_for_file(f, block_size=1024*1024):
         '''
-        Returns the md5 for the provided file (must have been opened in binary mode)
+        Returns the md5 for the provided file (must have been opened in binary mode), from its current position.
+        A regular file is hashed straight from the file mapped into memory; for the MD5s of the parts of a file,
+        hashed in parallel, see file_md5s
         '''
         md5 = hashlib.md5()
+        try:
+            fd, start = f.fileno(), f.tell()
+            size = os.fstat(fd).st_size
+        except (AttributeError, io.UnsupportedOperation, OSError):
+            size = start = 0
+        if size > start:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    md5.update(view[start:])
+            f.seek(size)
         while True:
             data = f.read(block_size)
             if not data:
@@ -3,7 +3,7 @@ class ResourceList(object):
 
     def __init__(self):
         self.swaggerTypes = {
-            'Items': 'list<Str>',
+            'Items': 'list<dict>',
             'DisplayedCount': 'int',
             'SortDir': 'str',
             'TotalCount': 'int',
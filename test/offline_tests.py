@@ -0,0 +1,1655 @@
+from unittest import TestCase, TestSuite, TestLoader, TextTestRunner
+import os
+import io
+import sys
+import base64
+import hashlib
+import pickle
+import shutil
+import datetime
+import time
+import multiprocessing
+import threading
+import gzip
+import http.client
+import errno
+import socket
+import email.utils
+from tempfile import mkdtemp
+
+from BaseSpacePy.api.APIClient import APIClient, DeserializationPlan
+from BaseSpacePy.api.ConnectionPool import ConnectionPool, CancelToken
+from BaseSpacePy.api.ResponseCache import ResponseCache, DiskResponseCache
+from BaseSpacePy.api.RemoteFile import RemoteFile, RemoteFileStream
+from BaseSpacePy.api.ContentUrlCache import ContentUrlCache
+from BaseSpacePy.api.BaseSpaceException import *
+from BaseSpacePy.model import *
+from BaseSpacePy.model.QueryParameters import QueryParameters as qp
+from BaseSpacePy.model.MultipartFileTransfer import PartManifest, UploadSession, DownloadTask, FilePart, MultipartStreamUpload
+from BaseSpacePy.model.MultipartFileTransfer import MultipartDownload, ConcurrencyController, HedgeMonitor, RetryPolicy, TransferPool, Utils
+from BaseSpacePy.model.MultipartFileTransfer import MultipartUpload
+from BaseSpacePy.api.ProjectSync import ProjectSync, STATE_DB
+from stub_server import StubBaseSpace, sampleJson, appResultJson, propertyListJson
+
+# Tests that run against a local stand-in for BaseSpace (see stub_server.py),
+# so unlike unit_tests.py they need no credentials or network access.
+
+
+class StubTestCase(TestCase):
+    '''
+    Starts a stub server with a small file and a multipart-sized file
+    '''
+    def setUp(self):
+        self.stub = StubBaseSpace()
+        self.small = b'0123456789' * 10
+        self.large = os.urandom(6 * 1024 * 1024 + 123)
+        self.stub.addFile('1', 'small.txt', self.small)
+        self.stub.addFile('2', 'large.bin', self.large, path='dir/large.bin')
+        self.stub.start()
+        self.api = self.stub.api()
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        self.stub.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def readLocal(self, name):
+        with open(os.path.join(self.temp_dir, name), 'rb') as fp:
+            return fp.read()
+
+
+class TestConnectionPool(StubTestCase):
+    '''
+    Tests ConnectionPool and its use by APIClient
+    '''
+    def testConnectionReuse(self):
+        pool = self.api.apiClient.pool
+        for i in range(5):
+            self.api.getFileById('1')
+        key = ('http', '127.0.0.1', self.stub.server.server_port)
+        self.assertEqual(len(pool._idle[key]), 1)
+
+    def testConcurrentCheckout(self):
+        pool = ConnectionPool(maxSize=2)
+        url = self.stub.apiServer + 's3/1'
+        responses = [pool.urlopen('GET', url) for i in range(4)]
+        for r in responses:
+            self.assertEqual(r.read(), self.small)
+        self.assertEqual(len(list(pool._idle.values())[0]), 2)
+
+    def testEarlyCloseDiscardsConnection(self):
+        pool = ConnectionPool()
+        with pool.urlopen('GET', self.stub.apiServer + 's3/2') as r:
+            r.read(10)
+        self.assertEqual(pool._idle, {})
+
+    def testStaleConnectionIsRetried(self):
+        self.api.getFileById('1')
+        for conn in list(self.api.apiClient.pool._idle.values())[0]:
+            conn.sock.close()
+            conn.sock = None
+        # a closed connection reconnects, a dropped one is retried on a fresh connection
+        self.assertEqual(self.api.getFileById('1').Size, len(self.small))
+
+    def testPickleDropsConnections(self):
+        self.api.getFileById('1')
+        api = pickle.loads(pickle.dumps(self.api))
+        self.assertEqual(api.apiClient.pool._idle, {})
+        self.assertEqual(api.getFileById('1').Size, len(self.small))
+
+    def testDownloadUsesPool(self):
+        self.api.fileDownload('1', self.temp_dir)
+        self.assertEqual(self.readLocal('small.txt'), self.small)
+
+    def testDownloadHttpErrorRaises(self):
+        with self.assertRaises(DownloadFailedException):
+            self.api.__downloadFile__('1', self.temp_dir, 'small.txt', byteRange=[len(self.small) + 10, len(self.small) + 20])
+
+    def testCancelInFlightRequest(self):
+        pool = ConnectionPool()
+        cancel = CancelToken()
+        self.stub.contentDelays[0] = 5
+        threading.Timer(0.2, cancel.cancel).start()
+        began = time.time()
+        with self.assertRaises((OSError, http.client.HTTPException)):
+            pool.urlopen('GET', self.stub.apiServer + 's3/2', headers={'Range': 'bytes=0-99'}, cancel=cancel).read()
+        self.assertTrue(time.time() - began < 2)
+        with self.assertRaises(TransferCancelledException):
+            pool.urlopen('GET', self.stub.apiServer + 's3/1', cancel=cancel)
+
+    def testConnectionErrorRaisesServerResponseException(self):
+        self.stub.stop()
+        self.stub.start()  # so tearDown can stop it again
+        api = self.stub.api()
+        api.apiClient.apiServerAndVersion = 'http://127.0.0.1:1/v1pre3'
+        with self.assertRaises(ServerResponseException):
+            api.getFileById('1')
+
+
+class TestPutCall(StubTestCase):
+    '''
+    Tests in-process PUT calls for multipart upload parts
+    '''
+    def setUp(self):
+        super(TestPutCall, self).setUp()
+        self.bsFile = self.api.__initiateMultipartFileUpload__('appresults', '10', 'up.bin', 'dir', 'application/octet-stream')
+        self.part = os.urandom(100000)
+        self.md5 = base64.b64encode(hashlib.md5(self.part).digest()).decode('ascii')
+
+    def testPutFromFileName(self):
+        path = os.path.join(self.temp_dir, 'part')
+        with open(path, 'wb') as fp:
+            fp.write(self.part)
+        res = self.api.__uploadMultipartUnit__(self.bsFile.Id, 1, self.md5, path)
+        self.assertEqual(res['Response']['ETag'], hashlib.md5(self.part).hexdigest())
+
+    def testPutFromBytes(self):
+        res = self.api.__uploadMultipartUnit__(self.bsFile.Id, 1, self.md5, self.part)
+        self.assertEqual(res['Response']['ETag'], hashlib.md5(self.part).hexdigest())
+
+    def testPutFromFileObjectWithLength(self):
+        fp = io.BytesIO(b'xx' + self.part + b'yy')
+        fp.seek(2)
+        url = self.api.apiClient.apiServerAndVersion + '/files/%s/parts/1' % self.bsFile.Id
+        res = self.api.apiClient.__putCall__(url, {'Content-MD5': self.md5, 'Content-Length': len(self.part)}, fp)
+        self.assertEqual(res['Response']['ETag'], hashlib.md5(self.part).hexdigest())
+
+    def testPutReturnsErrorResponse(self):
+        res = self.api.__uploadMultipartUnit__(self.bsFile.Id, 1, 'bad md5', self.part)
+        self.assertEqual(res['ResponseStatus']['ErrorCode'], 'BadDigest')
+
+    def testMultipartFileUpload(self):
+        path = os.path.join(self.temp_dir, 'big.bin')
+        with open(path, 'wb') as fp:
+            fp.write(self.large)
+        bsFile = self.api.multipartFileUpload('appresults', '10', path, 'big.bin', 'dir', 'application/octet-stream', processCount=2, partSize=6)
+        self.assertEqual(bsFile.Size, len(self.large))
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.large)
+        self.assertEqual(len(self.stub.parts[bsFile.Id]), 2)
+        # parts are read from the local file, without temp copies
+        self.assertEqual(os.listdir(self.temp_dir), ['big.bin'])
+
+    def testPutFromFilePart(self):
+        path = os.path.join(self.temp_dir, 'big.bin')
+        with open(path, 'wb') as fp:
+            fp.write(b'xx' + self.part + b'yy')
+        with FilePart(path, 2, len(self.part)) as part:
+            self.assertEqual(part.md5().hexdigest(), hashlib.md5(self.part).hexdigest())
+            self.assertEqual(part.tell(), 0)
+            res = self.api.__uploadMultipartUnit__(self.bsFile.Id, 1, self.md5, part)
+            self.assertEqual(res['Response']['ETag'], hashlib.md5(self.part).hexdigest())
+            part.seek(-2, io.SEEK_END)
+            self.assertEqual(part.read(), self.part[-2:])
+        # the connection is reused for the next part, so nothing beyond the part was sent
+        res = self.api.__uploadMultipartUnit__(self.bsFile.Id, 2, self.md5, self.part)
+        self.assertEqual(self.stub.parts[self.bsFile.Id][1], self.part)
+
+
+class TestFileMd5s(StubTestCase):
+    '''
+    Tests parallel hashing of the parts of local files, and its use for uploads
+    '''
+    def setUp(self):
+        super(TestFileMd5s, self).setUp()
+        self.path = os.path.join(self.temp_dir, 'big.bin')
+        with open(self.path, 'wb') as fp:
+            fp.write(self.large)
+
+    def testPartMd5s(self):
+        part = 1000000
+        md5s = Utils.file_md5s(self.path, part, threads=3)
+        self.assertEqual([m.hexdigest() for m in md5s],
+                         [hashlib.md5(self.large[i:i + part]).hexdigest() for i in range(0, len(self.large), part)])
+        md5s = Utils.file_md5s(self.path, part, offset=10, length=part + 5)
+        self.assertEqual([m.digest() for m in md5s], [hashlib.md5(self.large[10:10 + part]).digest(),
+                                                      hashlib.md5(self.large[10 + part:15 + part]).digest()])
+        with self.assertRaises(IOError):
+            Utils.file_md5s(self.path, part, offset=10, length=len(self.large))
+        open(self.path, 'wb').close()
+        self.assertEqual(Utils.file_md5s(self.path, part), [])
+
+    def testMd5ForFile(self):
+        with open(self.path, 'rb') as fp:
+            fp.seek(100)
+            self.assertEqual(Utils.md5_for_file(fp), hashlib.md5(self.large[100:]).hexdigest())
+            self.assertEqual(fp.read(), b'')
+        self.assertEqual(Utils.md5_for_file(io.BytesIO(self.small)), hashlib.md5(self.small).hexdigest())
+
+    def testUploadUsesPartMd5s(self):
+        data = os.urandom(13 * 1024 * 1024 + 5)
+        with open(self.path, 'wb') as fp:
+            fp.write(data)
+        bsFile = self.api.__initiateMultipartFileUpload__('appresults', '10', 'big.bin', 'dir', 'application/octet-stream')
+        upload = MultipartUpload(self.api, self.path, bsFile, 2, 6)
+        upload._setup()
+        self.assertEqual(len(upload.tasks), 3)
+        self.assertTrue(all(task.md5 for task in upload.tasks))
+        upload._start_workers()
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], data)
+        self.assertEqual(self.stub.files[bsFile.Id]['etag'], upload.etag)
+
+
+class TestStreamUpload(StubTestCase):
+    '''
+    Tests multipart uploads from file-like objects and iterators of unknown length
+    '''
+    def upload(self, stream, **kwargs):
+        return self.api.multipartStreamUpload('appresults', '10', stream, 'stream.bin', 'dir', 'application/octet-stream', partSize=6, **kwargs)
+
+    def testFileObject(self):
+        bsFile = self.upload(io.BytesIO(self.large), threadCount=2)
+        self.assertEqual(bsFile.Size, len(self.large))
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.large)
+        self.assertEqual(sorted(self.stub.parts[bsFile.Id]), [1, 2])
+
+    def testGenerator(self):
+        chunks = (self.large[i:i + 100000] for i in range(0, len(self.large), 100000))
+        bsFile = self.upload(chunks)
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.large)
+        self.assertEqual(len(self.stub.parts[bsFile.Id][1]), 6 * 1024 * 1024)
+
+    def testPipe(self):
+        r, w = os.pipe()
+        def produce():
+            with open(w, 'wb') as fp:
+                for i in range(0, len(self.large), 65536):
+                    fp.write(self.large[i:i + 65536])
+        producer = threading.Thread(target=produce)
+        producer.start()
+        with open(r, 'rb') as fp:
+            bsFile = self.upload(fp)
+        producer.join()
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.large)
+
+    def testEmptyStream(self):
+        bsFile = self.upload(iter([]))
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], b'')
+        self.assertEqual(list(self.stub.parts[bsFile.Id]), [1])
+
+    def testFailedPartRaises(self):
+        bsFile = self.api.__initiateMultipartFileUpload__('appresults', '10', 'stream.bin', 'dir', 'application/octet-stream')
+        del self.stub.parts[bsFile.Id]
+        upload = MultipartStreamUpload(self.api, io.BytesIO(self.small), bsFile, 2, 6, RetryPolicy(base_wait=0))
+        with self.assertRaises(MultiProcessingTaskFailedException):
+            upload.upload()
+        self.assertEqual(self.stub.files[bsFile.Id]['UploadStatus'], 'pending')
+
+    def testAppResultFileUploadOfStream(self):
+        bsFile = self.api.appResultFileUpload('10', io.BytesIO(self.small), 'small.bin', 'dir', 'application/octet-stream')
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.small)
+
+    def testStreamWithPoolRaises(self):
+        for upload in (self.api.appResultFileUpload, self.api.sampleFileUpload):
+            with self.assertRaises(IllegalParameterException):
+                upload('10', io.BytesIO(self.small), 'small.bin', 'dir', 'application/octet-stream', pool=object())
+        self.assertEqual(self.stub.requests, [])
+
+    def testSinglepartUploadIsBinary(self):
+        path = os.path.join(self.temp_dir, 'small.bin')
+        data = bytes(range(256))
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        bsFile = self.api.appResultFileUpload('10', path, 'small.bin', 'dir', 'application/octet-stream')
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], data)
+
+class TestResumeUpload(StubTestCase):
+    '''
+    Tests resuming multipart uploads from the upload session
+    '''
+    def setUp(self):
+        super(TestResumeUpload, self).setUp()
+        self.path = os.path.join(self.temp_dir, 'big.bin')
+        with open(self.path, 'wb') as fp:
+            fp.write(self.large)
+        self.session = UploadSession(self.path + '.upload', {'ResourceType': 'appresults', 'ResourceId': '10', 'Name': 'big.bin',
+                                                             'Directory': 'dir', 'Size': len(self.large), 'PartSize': 6})
+        self.chunk = len(self.large) // 2 + 1
+
+    def interrupted(self, etag=None):
+        # an upload into a new BaseSpace File, interrupted after the first of two parts
+        bsFile = self.api.__initiateMultipartFileUpload__('appresults', '10', 'big.bin', 'dir', 'application/octet-stream')
+        part = self.large[:self.chunk]
+        md5 = base64.b64encode(hashlib.md5(part).digest()).decode('ascii')
+        res = self.api.__uploadMultipartUnit__(bsFile.Id, 1, md5, part)
+        self.session.start(bsFile.Id)
+        self.session.add(1, len(part), md5, etag or res['Response']['ETag'])
+        del self.stub.requests[:]
+        return bsFile
+
+    def upload(self, **kwargs):
+        return self.api.multipartFileUpload('appresults', '10', self.path, 'big.bin', 'dir', 'application/octet-stream',
+                                            tempDir=self.temp_dir, processCount=2, partSize=6, **kwargs)
+
+    def requests(self, method):
+        return [r for r in self.stub.requests if r[0] == method]
+
+    def testResumeSkipsAcceptedParts(self):
+        bsFile = self.interrupted()
+        uploaded = self.upload(resume=True)
+        self.assertEqual(uploaded.Id, bsFile.Id)
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.large)
+        self.assertEqual(self.requests('PUT'), [('PUT', '/v1pre3/files/%s/parts/2' % bsFile.Id)])
+        self.assertFalse(os.path.exists(self.session.path))
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['big.bin'])
+
+    def testMismatchedPartIsResent(self):
+        bsFile = self.interrupted(etag='0' * 32)
+        self.upload(resume=True)
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.large)
+        self.assertEqual(len(self.requests('PUT')), 2)
+
+    def testChangedLocalFileIsResent(self):
+        bsFile = self.interrupted()
+        data = b'x' + self.large[1:]
+        with open(self.path, 'wb') as fp:
+            fp.write(data)
+        self.upload(resume=True)
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], data)
+        self.assertEqual(len(self.requests('PUT')), 2)
+
+    def testCompletedFileStartsOver(self):
+        self.session.start('2', {1: {'size': self.chunk, 'md5': 'x', 'etag': 'y'}})
+        uploaded = self.upload(resume=True)
+        self.assertNotEqual(uploaded.Id, '2')
+        self.assertEqual(len(self.requests('PUT')), 2)
+
+    def testWithoutResumeStartsOver(self):
+        bsFile = self.interrupted()
+        uploaded = self.upload()
+        self.assertNotEqual(uploaded.Id, bsFile.Id)
+        self.assertEqual(self.stub.files[uploaded.Id]['data'], self.large)
+        self.assertEqual(len(self.requests('PUT')), 2)
+
+    def testWithoutResumeWritesNoSession(self):
+        # an upload that fails before it completes leaves nothing beside the local file
+        self.stub.partErrors[2] = (503, None)
+        with self.assertRaises(MultiProcessingTaskFailedException):
+            self.upload(retryPolicy=RetryPolicy(retries=1, base_wait=0))
+        self.assertEqual(os.listdir(self.temp_dir), ['big.bin'])
+
+    def testAutoPartSizeResumes(self):
+        bsFile = self.interrupted()
+        uploaded = self.api.multipartFileUpload('appresults', '10', self.path, 'big.bin', 'dir', 'application/octet-stream',
+                                                processCount=2, partSize='auto', resume=True)
+        self.assertEqual(uploaded.Id, bsFile.Id)
+        self.assertEqual(self.requests('PUT'), [('PUT', '/v1pre3/files/%s/parts/2' % bsFile.Id)])
+
+    def testOtherPartSizeIsNotResumed(self):
+        bsFile = self.interrupted()
+        self.session.header['PartSize'] = 'auto'
+        self.session.start(bsFile.Id, self.session.completed())
+        uploaded = self.upload(resume=True)
+        self.assertNotEqual(uploaded.Id, bsFile.Id)
+        self.assertEqual(len(self.requests('PUT')), 2)
+
+    def testSessionPartSizeMustMatch(self):
+        bsFile = self.interrupted()
+        upload = MultipartUpload(self.api, self.path, bsFile, 2, 7, session=self.session)
+        with self.assertRaises(UploadPartSizeException):
+            upload.upload()
+
+    def testOtherDestinationIsNotResumed(self):
+        self.interrupted()
+        other = UploadSession(self.session.path, dict(self.session.header, Directory='other'))
+        self.assertIsNone(other.load())
+        self.assertEqual(list(self.session.completed()), [1])
+
+class TestDeserialize(TestCase):
+    '''
+    Tests APIClient.deserialize and its cached deserialization plans
+    '''
+    def setUp(self):
+        self.apiClient = APIClient('token', 'http://127.0.0.1/v1pre3')
+
+    def testNativeTypes(self):
+        self.assertEqual(self.apiClient.deserialize('5', 'int'), 5)
+        self.assertEqual(self.apiClient.deserialize(5, 'Str'), '5')
+        self.assertEqual(self.apiClient.deserialize(1, bool), True)
+
+    def testUnknownTypeName(self):
+        with self.assertRaises(NameError):
+            self.apiClient.deserialize({}, 'NoSuchModel')
+
+    def testSample(self):
+        sample = self.apiClient.deserialize(sampleJson(3), 'Sample')
+        self.assertTrue(isinstance(sample, Sample.Sample))
+        self.assertEqual(sample.Id, '3')
+        self.assertEqual(sample.IsPairedEnd, 1)
+        self.assertEqual(sample.DateCreated, datetime.datetime(2014, 6, 4, 22, 2, 51, tzinfo=datetime.timezone.utc))
+        self.assertEqual(sample.References, [{'Rel': 'Using'}])
+        self.assertEqual(sample.UserOwnedBy.Name, 'User 1')
+        self.assertEqual(sample.Projects[0].UserOwnedBy.Id, '1')
+        self.assertFalse(hasattr(sample, 'AppSession'))
+        self.assertEqual(sorted(sample.swaggerTypes), sorted(Sample.Sample().swaggerTypes))
+
+    def testPropertyListDynamicTypes(self):
+        props = self.apiClient.deserialize(propertyListJson(), PropertyList.PropertyList)
+        # the property of unrecognized type is left out
+        self.assertEqual([type(p).__name__ for p in props.Items],
+                         ['PropertyString', 'PropertyStrings', 'PropertyProject', 'PropertyMaps'])
+        self.assertEqual(props.Items[1].Items, ['a', 'b'])
+        self.assertEqual(props.Items[2].Content.DateCreated.year, 2014)
+        self.assertEqual(props.Items[3].Items[1][0].Values, ['v2', 'v3'])
+
+    def testPlanIsCached(self):
+        plan = DeserializationPlan.forClass(File.File)
+        self.assertTrue(DeserializationPlan.forClass(File.File) is plan)
+        self.assertTrue(self.apiClient.deserialize({'Id': '1'}, 'File').swaggerTypes is plan.swaggerTypes)
+
+    def testDatetimeFallback(self):
+        f = self.apiClient.deserialize({'DateCreated': 'June 4 2014 10:02PM'}, 'File')
+        self.assertEqual(f.DateCreated, datetime.datetime(2014, 6, 4, 22, 2))
+
+
+class TestListRequest(StubTestCase):
+    '''
+    Tests decoding of list responses
+    '''
+    def testListItemsAreModels(self):
+        self.stub.addList('projects/7/samples', [sampleJson(n) for n in range(1, 6)])
+        samples = self.api.getSamplesByProject('7', qp({'Limit': 3, 'Offset': 1}))
+        self.assertEqual([s.Id for s in samples], ['2', '3', '4'])
+        self.assertEqual(samples[0].UserOwnedBy.Name, 'User 1')
+        self.assertEqual(samples[0].Properties.Items[0].Content, 'value')
+
+    def testResourceListKeepsDicts(self):
+        self.stub.addList('projects/7/samples', [sampleJson(1)])
+        response = self.api.apiClient.callAPI('/projects/7/samples', 'GET', {}, None)
+        lr = self.api.apiClient.deserialize(response, ListResponse.ListResponse)
+        self.assertEqual(lr.Response.Items, [sampleJson(1)])
+        self.assertEqual(lr._convertToObjectList(), [sampleJson(1)])
+        self.assertEqual(lr.Response.TotalCount, 1)
+
+
+class TestListIterator(StubTestCase):
+    '''
+    Tests lazily paginated list iterators
+    '''
+    def setUp(self):
+        super(TestListIterator, self).setUp()
+        self.stub.addList('projects/7/samples', [sampleJson(n) for n in range(25)])
+
+    def listRequests(self):
+        return [r for r in self.stub.requests if '/samples' in r[1]]
+
+    def testAllPages(self):
+        samples = list(self.api.iterSamplesByProject('7', qp({'Limit': 10})))
+        self.assertEqual([s.Id for s in samples], [str(n) for n in range(25)])
+        self.assertEqual(len(self.listRequests()), 3)
+
+    def testWithoutPrefetch(self):
+        samples = list(self.api.iterSamplesByProject('7', qp({'Limit': 10}), prefetch=False))
+        self.assertEqual(len(samples), 25)
+        self.assertEqual(len(self.listRequests()), 3)
+
+    def testDefaultPageSize(self):
+        self.assertEqual(len(list(self.api.iterSamplesByProject('7'))), 25)
+        self.assertEqual(self.listRequests(), [('GET', '/v1pre3/projects/7/samples?Offset=0&Limit=1024')])
+
+    def testOffset(self):
+        samples = list(self.api.iterSamplesByProject('7', qp({'Limit': 10, 'Offset': 20})))
+        self.assertEqual([s.Id for s in samples], [str(n) for n in range(20, 25)])
+
+    def testEmptyList(self):
+        self.stub.addList('projects/8/samples', [])
+        self.assertEqual(list(self.api.iterSamplesByProject('8')), [])
+
+    def testLazy(self):
+        samples = self.api.iterSamplesByProject('7', qp({'Limit': 5}), prefetch=False)
+        self.assertEqual(self.listRequests(), [])
+        next(samples)
+        self.assertEqual(len(self.listRequests()), 1)
+        samples.close()
+
+    def testPrefetchStaysOnePageAhead(self):
+        samples = self.api.iterSamplesByProject('7', qp({'Limit': 5}))
+        next(samples)
+        time.sleep(0.5)
+        # the second page is fetched in the background, but no further
+        self.assertEqual(len(self.listRequests()), 2)
+        samples.close()
+
+    def testErrorRaises(self):
+        with self.assertRaises(ServerResponseException):
+            list(self.api.iterSamplesByProject('9'))
+
+    def testParallelPagesInOrder(self):
+        self.stub.listLatency = 0.05
+        samples = list(self.api.iterSamplesByProject('7', qp({'Limit': 3}), workers=4))
+        self.assertEqual([s.Id for s in samples], [str(n) for n in range(25)])
+        self.assertEqual(len(self.listRequests()), 9)
+
+    def testParallelPagesWithOffset(self):
+        samples = list(self.api.iterSamplesByProject('7', qp({'Limit': 4, 'Offset': 6}), workers=3))
+        self.assertEqual([s.Id for s in samples], [str(n) for n in range(6, 25)])
+
+    def testParallelPagesWithCappedLimit(self):
+        self.stub.listLimitCap = 4
+        samples = list(self.api.iterSamplesByProject('7', qp({'Limit': 10}), workers=3))
+        self.assertEqual([s.Id for s in samples], [str(n) for n in range(25)])
+        self.assertEqual(len(self.listRequests()), 7)
+
+    def testShortPageFallsBackToSequential(self):
+        self.stub.listLatency = 0.3
+        samples = self.api.iterSamplesByProject('7', qp({'Limit': 10}), workers=3)
+        first = next(samples)
+        # the pages requested concurrently come back shorter than the first
+        self.stub.listLimitCap = 3
+        self.assertEqual([first.Id] + [s.Id for s in samples], [str(n) for n in range(25)])
+
+    def testFailedPageIsRetried(self):
+        samples = self.api.iterSamplesByProject('7', qp({'Limit': 5}), workers=3)
+        first = next(samples)
+        self.stub.listFailures = 2
+        self.assertEqual([first.Id] + [s.Id for s in samples], [str(n) for n in range(25)])
+        self.assertEqual(self.stub.listFailures, 0)
+
+
+class TestResponseCache(StubTestCase):
+    '''
+    Tests the response cache for GET calls
+    '''
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        self.cache = ResponseCache()
+        self.api = self.stub.api(cache=self.cache)
+
+    def fileRequests(self, Id):
+        return [r for r in self.stub.requests if r == ('GET', '/v1pre3/files/' + Id)]
+
+    def testRepeatedGetIsCached(self):
+        for i in range(3):
+            self.assertEqual(self.api.getFileById('1').Size, len(self.small))
+        self.assertEqual(len(self.fileRequests('1')), 1)
+        self.assertEqual(self.cache.stats()['hits'], 2)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def testQueryParamsAreInKey(self):
+        self.stub.addList('projects/7/samples', [sampleJson(n) for n in range(5)])
+        self.assertEqual(len(self.api.getSamplesByProject('7', qp({'Limit': 2}))), 2)
+        self.assertEqual(len(self.api.getSamplesByProject('7', qp({'Limit': 3}))), 3)
+        self.assertEqual(len(self.api.getSamplesByProject('7', qp({'Limit': 2}))), 2)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def testErrorsAreNotCached(self):
+        for i in range(2):
+            with self.assertRaises(ServerResponseException):
+                self.api.getFileById('nosuchfile')
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def testContentUrlsAreNotCached(self):
+        self.api.fileUrl('1')
+        self.api.fileUrl('1')
+        self.assertEqual(self.cache.stats()['hits'], 0)
+
+    def testTtlExpiry(self):
+        self.cache.ttls['files'] = 0.2
+        self.api.getFileById('1')
+        time.sleep(0.3)
+        self.api.getFileById('1')
+        self.assertEqual(len(self.fileRequests('1')), 2)
+
+    def testPostInvalidatesResource(self):
+        self.api.getFileById('1')
+        self.api.getFileById('2')
+        self.stub.parts['1'] = {}
+        self.api.__finalizeMultipartFileUpload__('1')
+        self.api.getFileById('1')
+        self.api.getFileById('2')
+        self.assertEqual(len(self.fileRequests('1')), 2)
+        self.assertEqual(len(self.fileRequests('2')), 1)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def testLruEvictionByCount(self):
+        cache = ResponseCache(maxEntries=2)
+        for n in range(3):
+            cache.put(cache.key('/files/%d' % n, {}), b'{}')
+        cache.get(cache.key('/files/1', {}))
+        cache.put(cache.key('/files/3', {}), b'{}')
+        self.assertEqual([k[0] for k in cache._entries], ['/files/1', '/files/3'])
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def testLruEvictionByBytes(self):
+        cache = ResponseCache(maxBytes=100)
+        cache.put(cache.key('/files/1', {}), b'x' * 60)
+        cache.put(cache.key('/files/2', {}), b'x' * 30)
+        cache.put(cache.key('/files/3', {}), b'x' * 30)
+        self.assertEqual([k[0] for k in cache._entries], ['/files/2', '/files/3'])
+        self.assertEqual(cache.stats()['bytes'], 60)
+        cache.put(cache.key('/files/4', {}), b'x' * 101)
+        self.assertEqual(len(cache), 2)
+
+    def testPickleDropsEntries(self):
+        self.api.getFileById('1')
+        api = pickle.loads(pickle.dumps(self.api))
+        self.assertEqual(len(api.apiClient.cache), 0)
+        self.assertEqual(api.getFileById('1').Size, len(self.small))
+
+
+def fillDiskCache(stub, cachePath):
+    # in another process
+    stub.api(cache=DiskResponseCache(cachePath)).getFileById('1')
+
+
+class TestDiskResponseCache(StubTestCase):
+    '''
+    Tests the on-disk response cache
+    '''
+    def setUp(self):
+        super(TestDiskResponseCache, self).setUp()
+        self.cachePath = os.path.join(self.temp_dir, 'cache')
+
+    def fileRequests(self):
+        return [r for r in self.stub.requests if r == ('GET', '/v1pre3/files/1')]
+
+    def testSharedBetweenInstances(self):
+        self.stub.api(cache=DiskResponseCache(self.cachePath)).getFileById('1')
+        cache = DiskResponseCache(self.cachePath)
+        self.assertEqual(self.stub.api(cache=cache).getFileById('1').Size, len(self.small))
+        self.assertEqual(len(self.fileRequests()), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def testSharedBetweenProcesses(self):
+        cache = DiskResponseCache(self.cachePath)
+        self.assertEqual(len(cache), 0)
+        p = multiprocessing.Process(target=fillDiskCache, args=(self.stub, self.cachePath))
+        p.start()
+        p.join()
+        self.assertEqual(len(cache), 1)
+        self.stub.api(cache=cache).getFileById('1')
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def testOtherUserMisses(self):
+        self.stub.api(cache=DiskResponseCache(self.cachePath)).getFileById('1')
+        api = self.stub.api(cache=DiskResponseCache(self.cachePath))
+        api.apiClient.apiKey = 'other token'
+        api.getFileById('1')
+        self.assertEqual(len(self.fileRequests()), 2)
+
+    def testOffline(self):
+        self.stub.api(cache=DiskResponseCache(self.cachePath)).getFileById('1')
+        self.stub.stop()
+        api = self.stub.api(cache=DiskResponseCache(self.cachePath, offline=True))
+        self.assertEqual(api.getFileById('1').Size, len(self.small))
+        with self.assertRaises(CacheMissException):
+            api.getFileById('2')
+        with self.assertRaises(CacheMissException):
+            api.__finalizeMultipartFileUpload__('1')
+        self.stub.start()
+
+    def testInvalidateAndExpiry(self):
+        cache = DiskResponseCache(self.cachePath, ttls={'samples': 0.2})
+        api = self.stub.api(cache=cache)
+        api.getFileById('1')
+        self.stub.parts['1'] = {}
+        api.__finalizeMultipartFileUpload__('1')
+        self.assertEqual(cache.stats()['invalidations'], 1)
+        cache.put(cache.key('/samples/1', {}), b'{}')
+        time.sleep(0.3)
+        self.assertEqual(cache.get(cache.key('/samples/1', {})), None)
+
+    def testSizeCappedEviction(self):
+        cache = DiskResponseCache(self.cachePath, maxBytes=1000)
+        for n in range(5):
+            cache.put(cache.key('/files/%d' % n, {}), b'x' * 300)
+        self.assertTrue(cache.stats()['bytes'] <= 900)
+        self.assertEqual(cache.get(cache.key('/files/4', {})), b'x' * 300)
+        self.assertEqual(cache.get(cache.key('/files/0', {})), None)
+        self.assertTrue(cache.stats()['evictions'] >= 2)
+
+    def testPickle(self):
+        cache = pickle.loads(pickle.dumps(DiskResponseCache(self.cachePath)))
+        cache.put(cache.key('/files/1', {}), b'{}')
+        self.assertEqual(cache.get(cache.key('/files/1', {})), b'{}')
+
+
+class TestMultipartDownload(StubTestCase):
+    '''
+    Tests the process and thread engines of multipart download
+    '''
+    def testProcessEngine(self):
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=3, partSize=1)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+
+    def testThreadEngine(self):
+        bsFile = self.api.multipartFileDownload('2', self.temp_dir, processCount=3, partSize=1, engine='thread')
+        self.assertEqual(bsFile.Id, '2')
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(os.listdir(self.temp_dir), ['large.bin'])
+
+    def testThreadEngineOverwritesLargerFile(self):
+        with open(os.path.join(self.temp_dir, 'large.bin.partial'), 'wb') as fp:
+            fp.write(b'x' * (len(self.large) + 1000))
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=2, engine='thread')
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+
+    def testThreadEngineDebugMode(self):
+        tempDir = os.path.join(self.temp_dir, 'parts')
+        os.mkdir(tempDir)
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=2, createBsDir=True, tempDir=tempDir, engine='thread')
+        self.assertEqual(self.readLocal(os.path.join('dir', 'large.bin')), self.large)
+
+    def testProcessEngineOverwritesLargerFile(self):
+        with open(os.path.join(self.temp_dir, 'large.bin.partial'), 'wb') as fp:
+            fp.write(b'x' * (len(self.large) + 1000))
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=2)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+
+    def testProcessEngineDebugMode(self):
+        tempDir = os.path.join(self.temp_dir, 'parts')
+        os.mkdir(tempDir)
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=2, tempDir=tempDir)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(os.listdir(tempDir), [])
+
+    def testCopyRangeWithoutCopyFileRange(self):
+        part = os.path.join(self.temp_dir, 'part')
+        with open(part, 'wb') as fp:
+            fp.write(self.small)
+        fd = os.open(os.path.join(self.temp_dir, 'whole'), os.O_RDWR | os.O_CREAT)
+        def unsupported(*args):
+            raise OSError(errno.EXDEV, 'cross-device copy')
+        copy_file_range = getattr(os, 'copy_file_range', None)
+        os.copy_file_range = unsupported
+        try:
+            Utils.copy_range(part, fd, 50, len(self.small), block_size=30)
+            with self.assertRaises(DownloadFailedException):
+                Utils.copy_range(part, fd, 0, len(self.small) + 1)
+        finally:
+            if copy_file_range is None:
+                del os.copy_file_range
+            else:
+                os.copy_file_range = copy_file_range
+            os.close(fd)
+        self.assertEqual(self.readLocal('whole')[50:], self.small)
+
+    def testUnknownEngine(self):
+        with self.assertRaises(IllegalParameterException):
+            self.api.multipartFileDownload('2', self.temp_dir, engine='fibers')
+
+
+class TestAutoTransfer(StubTestCase):
+    '''
+    Tests part sizes and concurrency chosen in auto mode
+    '''
+    MB = 1024 * 1024
+
+    def testAutoPartSize(self):
+        self.assertEqual(Utils.auto_part_size(10 * self.MB, 16, 4, 100), 4)
+        self.assertEqual(Utils.auto_part_size(6400 * self.MB, 16, 4, 100), 100)
+        self.assertEqual(Utils.auto_part_size(640 * self.MB, 16, 4, 100), 10)
+        self.assertEqual(Utils.auto_part_size(1000 * 1024 * self.MB, 16, 6, 25), 25)
+
+    def testWorkersForSmallFile(self):
+        mpd = MultipartDownload(self.api, '2', self.temp_dir, 'auto', 'auto', False, engine='thread')
+        mpd._setup()
+        self.assertEqual(mpd.part_size, 4)
+        self.assertEqual(len(mpd.exe.consumers), 2)
+        self.assertEqual(mpd.exe.consumers[0].controller.max_workers, 2)
+        mpd.exe.start_workers(mpd._rename_final_file)
+        os.close(mpd.fd)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+
+    def testFixedCountHasNoController(self):
+        mpd = MultipartDownload(self.api, '2', self.temp_dir, 3, 1, False, engine='thread')
+        mpd._setup()
+        self.assertEqual(len(mpd.exe.consumers), 3)
+        self.assertIsNone(mpd.exe.consumers[0].controller)
+        mpd.exe.start_workers(mpd._rename_final_file)
+        os.close(mpd.fd)
+
+    def testAutoDownload(self):
+        for engine in ('thread', 'process'):
+            self.api.multipartFileDownload('2', self.temp_dir, processCount='auto', partSize=1, engine=engine, maxProcessCount=4)
+            self.assertEqual(self.readLocal('large.bin'), self.large)
+            os.remove(os.path.join(self.temp_dir, 'large.bin'))
+
+    def testAutoUpload(self):
+        path = os.path.join(self.temp_dir, 'big.bin')
+        with open(path, 'wb') as fp:
+            fp.write(self.large)
+        bsFile = self.api.multipartFileUpload('appresults', '10', path, 'big.bin', 'dir', 'application/octet-stream', processCount='auto', partSize='auto')
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.large)
+        self.assertEqual(len(self.stub.parts[bsFile.Id]), 2)
+
+    def transfer(self, controller, now, rate, success=True):
+        # one round of parts at the given rate in MB/s, finishing at now
+        parts = controller.limit
+        for i in range(parts):
+            self.assertTrue(controller.acquire())
+        controller._round_start.value = now - parts / float(rate)
+        for i in range(parts):
+            controller.release(self.MB, success, now=now)
+
+    def testControllerRampsUpWhileThroughputImproves(self):
+        controller = ConcurrencyController(1, 8, initial=2)
+        for now, rate in ((10, 10), (20, 20), (30, 30)):
+            self.transfer(controller, now, rate)
+        self.assertEqual(controller.limit, 5)
+        # throughput stopped improving - turn around
+        self.transfer(controller, 40, 30)
+        self.assertEqual(controller.limit, 4)
+
+    def testControllerStaysWithinBounds(self):
+        controller = ConcurrencyController(2, 3, initial=3)
+        for now in range(10):
+            self.transfer(controller, now, 10 * (now + 1))
+            self.assertIn(controller.limit, (2, 3))
+
+    def testControllerBacksOffOnFailure(self):
+        controller = ConcurrencyController(1, 16, initial=8)
+        controller.acquire()
+        controller.release(self.MB, False)
+        self.assertEqual(controller.limit, 4)
+        controller.acquire()
+        controller.release(self.MB, False)
+        self.assertEqual(controller.limit, 2)
+
+    def testAcquireWaitsForSlot(self):
+        controller = ConcurrencyController(1, 1)
+        halt = threading.Event()
+        self.assertTrue(controller.acquire(halt))
+        halt.set()
+        self.assertFalse(controller.acquire(halt))
+        controller.release(self.MB, True)
+        self.assertTrue(controller.acquire(halt))
+
+class TestHedgedDownload(StubTestCase):
+    '''
+    Tests duplicating the requests for straggling parts of thread engine downloads
+    '''
+    MB = 1024 * 1024
+
+    class Task(object):
+        def __init__(self, piece):
+            self.piece = piece
+
+    def testHedgedDownload(self):
+        self.stub.contentDelays[5 * self.MB] = 10
+        began = time.time()
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=3, partSize=1, engine='thread', hedge=True)
+        self.assertTrue(time.time() - began < 5)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(len([r for r in self.stub.ranges if r[0] == 5 * self.MB]), 2)
+        self.assertEqual(os.listdir(self.temp_dir), ['large.bin'])
+
+    def testHedgeNeedsThreadEngine(self):
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=3, partSize=1, hedge=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+
+    def testStragglers(self):
+        hedge = HedgeMonitor(4, min_seconds=0)
+        tasks = [self.Task(i) for i in range(1, 5)]
+        tokens = [hedge.start(t) for t in tasks]
+        for t, token in zip(tasks[:2], tokens):
+            self.assertTrue(hedge.finish(t, token, True))
+        # too few pieces done yet
+        self.assertEqual(hedge.stragglers(), [])
+        time.sleep(0.05)
+        self.assertTrue(hedge.finish(tasks[2], tokens[2], True))
+        self.assertEqual(hedge.stragglers(), [tasks[3]])
+        # hedged only once
+        self.assertEqual(hedge.stragglers(), [])
+        copy = hedge.start(tasks[3])
+        self.assertTrue(hedge.finish(tasks[3], copy, True))
+        self.assertTrue(tokens[3].is_set())
+        self.assertFalse(hedge.finish(tasks[3], tokens[3], False))
+        self.assertEqual((hedge.hedges, hedge.hedge_wins), (1, 1))
+
+    def testSlowPieceThreshold(self):
+        hedge = HedgeMonitor(2, quantile=0.5, min_seconds=60)
+        tasks = [self.Task(1), self.Task(2)]
+        tokens = [hedge.start(t) for t in tasks]
+        hedge.finish(tasks[0], tokens[0], True)
+        self.assertEqual(hedge.stragglers(), [])
+
+
+class TestRetryPolicy(StubTestCase):
+    '''
+    Tests the classification of failures and the backoff between retries of transfer parts
+    '''
+    MB = 1024 * 1024
+
+    def testRetryable(self):
+        policy = RetryPolicy()
+        for error in (None, DownloadFailedException('', 503), DownloadFailedException('', 429), ServerResponseException('', 500),
+                      DownloadFailedException('size mismatch'), ConnectionResetError(), socket.timeout(), http.client.IncompleteRead(b'')):
+            self.assertTrue(policy.retryable(error), error)
+        for error in (DownloadFailedException('', 404), DownloadFailedException('', 403), OSError(errno.ENOSPC, 'No space left on device'),
+                      PermissionError(errno.EACCES, 'Permission denied'), TransferCancelledException('')):
+            self.assertFalse(policy.retryable(error), error)
+
+    def testRetryAfter(self):
+        self.assertEqual(RetryPolicy.retry_after(DownloadFailedException('', 503, '3')), 3)
+        date = email.utils.formatdate(time.time() + 60, usegmt=True)
+        self.assertTrue(55 < RetryPolicy.retry_after(DownloadFailedException('', 503, date)) <= 60)
+        self.assertIsNone(RetryPolicy.retry_after(DownloadFailedException('', 503, 'soon')))
+        self.assertIsNone(RetryPolicy.retry_after(ConnectionResetError()))
+
+    def testExponentialBackoff(self):
+        policy = RetryPolicy(base_wait=1, max_wait=5, jitter=False)
+        self.assertEqual([policy.backoff_wait(n) for n in range(1, 6)], [1, 2, 4, 5, 5])
+        policy = RetryPolicy(base_wait=1, max_wait=5)
+        for n in range(1, 6):
+            self.assertTrue(0 <= policy.backoff_wait(n) <= min(2 ** (n - 1), 5))
+
+    def testLimits(self):
+        policy = RetryPolicy(retries=3, base_wait=1, max_total=10, jitter=False)
+        self.assertEqual(policy.next_wait(1, None, 0), 1)
+        self.assertIsNone(policy.next_wait(3, None, 0))
+        self.assertIsNone(policy.next_wait(1, None, 9.5))
+        self.assertEqual(policy.next_wait(1, DownloadFailedException('', 503, '5'), 0), 5)
+        self.assertIsNone(policy.next_wait(1, DownloadFailedException('', 404), 0))
+        self.assertEqual(policy.stats(), {'retries': 2, 'wait_seconds': 6, 'retry_afters': 1, 'non_retryable': 1, 'exhausted': 2})
+
+    def testDownloadHonorsRetryAfter(self):
+        self.stub.contentErrors[2 * self.MB] = (503, 1)
+        policy = RetryPolicy(base_wait=0)
+        began = time.time()
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', retryPolicy=policy)
+        self.assertTrue(time.time() - began >= 1)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(policy.stats()['retry_afters'], 1)
+
+    def testNonRetryableFailsAtOnce(self):
+        policy = RetryPolicy(base_wait=1)
+        for engine in ('thread', 'process'):
+            self.stub.contentErrors[2 * self.MB] = (404,)
+            with self.assertRaises(MultiProcessingTaskFailedException):
+                self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine=engine, retryPolicy=policy)
+        # counted in the worker processes too
+        self.assertEqual(policy.stats()['non_retryable'], 2)
+        self.assertEqual(policy.stats()['retries'], 0)
+
+    def testUploadRetriesServerError(self):
+        self.stub.partErrors[1] = (503, 0)
+        policy = RetryPolicy(base_wait=0)
+        bsFile = self.api.multipartStreamUpload('appresults', '10', io.BytesIO(self.small), 'up.bin', 'dir', 'application/octet-stream', retryPolicy=policy)
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.small)
+        self.assertEqual((policy.stats()['retries'], policy.stats()['retry_afters']), (1, 1))
+
+
+class TestTransferPool(StubTestCase):
+    '''
+    Tests transferring many files with the long-lived workers of a TransferPool
+    '''
+    MB = 1024 * 1024
+
+    def setUp(self):
+        super(TestTransferPool, self).setUp()
+        self.data = {}
+        for n in range(3, 9):
+            self.data[str(n)] = os.urandom(n * self.MB // 2 + n)
+            self.stub.addFile(str(n), 'f%d.bin' % n, self.data[str(n)])
+
+    def testConcurrentDownloads(self):
+        with TransferPool(4) as pool:
+            futures = dict((Id, pool.download(self.api, Id, self.temp_dir, partSize=1)) for Id in self.data)
+            for Id, future in futures.items():
+                self.assertEqual(future.result().Id, Id)
+                self.assertEqual(self.readLocal('f%s.bin' % Id), self.data[Id])
+            self.assertTrue(all(w.is_alive() for w in pool.workers))
+        self.assertFalse(any(w.is_alive() for w in pool.workers))
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), sorted('f%s.bin' % Id for Id in self.data))
+
+    def testProcessEngine(self):
+        path = os.path.join(self.temp_dir, 'up.bin')
+        with open(path, 'wb') as fp:
+            fp.write(self.large)
+        with TransferPool(3, engine='process') as pool:
+            self.api.multipartFileDownload('3', self.temp_dir, partSize=1, pool=pool)
+            self.api.fileDownload('1', self.temp_dir, pool=pool)
+            bsFile = self.api.multipartFileUpload('appresults', '10', path, 'up.bin', 'dir', 'application/octet-stream', partSize=6, pool=pool)
+        self.assertEqual(self.readLocal('f3.bin'), self.data['3'])
+        self.assertEqual(self.readLocal('small.txt'), self.small)
+        self.assertEqual(self.stub.files[bsFile.Id]['data'], self.large)
+
+    def testFailedFileDoesNotFailOthers(self):
+        self.stub.contentErrors[self.MB] = (404,)
+        with TransferPool(2) as pool:
+            failed = pool.download(self.api, '4', self.temp_dir, partSize=1)
+            others = [pool.download(self.api, Id, self.temp_dir, partSize=1) for Id in ('5', '6')]
+            with self.assertRaises(MultiProcessingTaskFailedException):
+                failed.result()
+            for future in others:
+                future.result()
+        self.assertEqual(self.readLocal('f5.bin'), self.data['5'])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'f4.bin')))
+
+    def testEmptyFile(self):
+        self.stub.addFile('9', 'empty.bin', b'')
+        with TransferPool(2) as pool:
+            self.api.fileDownload('9', self.temp_dir, pool=pool)
+        self.assertEqual(self.readLocal('empty.bin'), b'')
+
+    def testPoolApi(self):
+        with TransferPool(2, engine='process', api=self.api) as pool:
+            future = pool.download(self.api, '3', self.temp_dir, partSize=1)
+            other = pool.download(self.stub.api(), '4', self.temp_dir, partSize=1)
+            future.result()
+            other.result()
+        self.assertEqual(self.readLocal('f3.bin'), self.data['3'])
+        self.assertEqual(self.readLocal('f4.bin'), self.data['4'])
+
+    def testTasksDontCarryApi(self):
+        mpd = MultipartDownload(self.api, '3', self.temp_dir, 2, 1, False, engine='thread')
+        mpd._setup()
+        os.close(mpd.fd)
+        size = len(pickle.dumps(mpd.tasks[0]))
+        # however much state the api holds, it doesn't add to the tasks
+        for n in range(1000):
+            self.api.contentUrls.put(str(n), 'http://127.0.0.1/s3/%d?%s' % (n, 'x' * 1000), n)
+        self.assertTrue(len(pickle.dumps(self.api)) > 10**6)
+        self.assertIsNone(mpd.tasks[0].api)
+        self.assertEqual(len(pickle.dumps(mpd.tasks[0])), size)
+        self.assertTrue(size < 2000)
+
+    def testSingleTaskJobFinalizedOnce(self):
+        finalized = []
+        done = threading.Event()
+        submitter = threading.current_thread()
+        class Lock(object):
+            # once submit() releases the lock, hold it up until the collector thread has ended the job
+            def __init__(self):
+                self.lock = threading.Lock()
+            def __enter__(self):
+                self.lock.acquire()
+            def __exit__(self, *args):
+                self.lock.release()
+                if threading.current_thread() is submitter:
+                    done.wait(5)
+        def finalize():
+            finalized.append(True)
+            done.set()
+        with TransferPool(2) as pool:
+            pool._lock = Lock()
+            mpd = MultipartDownload(self.api, '1', self.temp_dir, 2, 1, False, pool=pool)
+            mpd._setup()
+            self.assertEqual(len(mpd.tasks), 1)
+            future = pool.submit(mpd.tasks, finalize, mpd._close, self.api)
+            self.assertIsNone(future.result())
+        self.assertEqual(finalized, [True])
+
+    def testShutdown(self):
+        pool = TransferPool(2)
+        pool.shutdown()
+        with self.assertRaises(MultiProcessingTaskFailedException):
+            pool.download(self.api, '3', self.temp_dir)
+
+
+class TestResumeDownload(StubTestCase):
+    '''
+    Tests resuming multipart downloads from the part manifest
+    '''
+    MB = 1024 * 1024
+
+    def setUp(self):
+        super(TestResumeDownload, self).setUp()
+        self.partial = os.path.join(self.temp_dir, 'large.bin.partial')
+        self.manifest = PartManifest(self.partial + '.parts', {'Id': '2', 'Size': len(self.large), 'PartSize': self.MB})
+
+    def interrupted(self, parts):
+        # a partial download with the given parts (of 1MB) complete, and garbage elsewhere
+        data = bytearray(b'x' * len(self.large))
+        self.manifest.start()
+        for i in parts:
+            data[(i-1) * self.MB:i * self.MB] = self.large[(i-1) * self.MB:i * self.MB]
+            self.manifest.add(i, len(self.large[(i-1) * self.MB:i * self.MB]))
+        with open(self.partial, 'wb') as fp:
+            fp.write(data)
+
+    def contentRequests(self):
+        return [r for r in self.stub.requests if r[1].startswith('/s3/')]
+
+    def testResumeFetchesMissingParts(self):
+        self.interrupted([1, 2, 4, 6])
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', resume=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(len(self.contentRequests()), 3)
+        self.assertEqual(os.listdir(self.temp_dir), ['large.bin'])
+
+    def testResumeWithProcessEngine(self):
+        self.interrupted([1, 2, 3, 4, 5, 6])
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, resume=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(len(self.contentRequests()), 1)
+
+    def testResumeCompleteDownload(self):
+        self.interrupted(range(1, 8))
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', resume=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(self.contentRequests(), [])
+
+    def testOtherPartSizeStartsOver(self):
+        self.interrupted([1, 2])
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=2, engine='thread', resume=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(len(self.contentRequests()), 4)
+
+    def testWithoutResumeStartsOver(self):
+        self.interrupted([1, 2])
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread')
+        self.assertEqual(len(self.contentRequests()), 7)
+
+    def testMissingPartialFileStartsOver(self):
+        self.interrupted([1, 2])
+        os.remove(self.partial)
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', resume=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(len(self.contentRequests()), 7)
+
+    def testIncompleteManifestLine(self):
+        self.interrupted([1, 2])
+        with open(self.manifest.path, 'a') as fp:
+            fp.write('{"part": 3, "si') # a worker was killed while recording a part
+        self.assertEqual(self.manifest.completed(), {1: self.MB, 2: self.MB})
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', resume=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(len(self.contentRequests()), 5)
+
+    def testTaskRecordsPart(self):
+        self.manifest.start({1: self.MB})
+        open(self.partial, 'wb').close()
+        task = DownloadTask('2', 'large.bin.partial', self.temp_dir, 7, 7, self.MB, len(self.large), manifest=self.manifest)
+        self.assertTrue(task.execute(None, self.api).success)
+        self.assertEqual(self.manifest.completed(), {1: self.MB, 7: len(self.large) - 6 * self.MB})
+
+
+def multipartEtag(data, partSize):
+    # S3 ETag of data uploaded in parts of partSize bytes
+    md5s = [hashlib.md5(data[i:i + partSize]).digest() for i in range(0, len(data), partSize)]
+    return '%s-%d' % (hashlib.md5(b''.join(md5s)).hexdigest(), len(md5s))
+
+
+class TestVerifyDownload(StubTestCase):
+    '''
+    Tests verifying downloads and local files against S3 ETags
+    '''
+    MB = 1024 * 1024
+
+    def setUp(self):
+        super(TestVerifyDownload, self).setUp()
+        # uploaded in 2 even parts, as by multipartFileUpload
+        self.half = len(self.large) // 2 + 1
+        self.stub.files['2']['etag'] = multipartEtag(self.large, self.half)
+
+    def testEtagUtils(self):
+        self.assertEqual(Utils.etag_parts('"%s-12"' % ('a' * 32)), 12)
+        self.assertEqual(Utils.etag_parts('A' * 32), 0)
+        self.assertEqual(Utils.etag_parts('not an md5'), None)
+        self.assertEqual(Utils.etag_part_sizes(0, 123), [123])
+        self.assertEqual(Utils.etag_part_sizes(3, 20 * self.MB, 8), [8 * self.MB])
+        self.assertEqual(Utils.etag_part_sizes(3, 20 * self.MB, 5), [])
+        self.assertEqual(Utils.etag_part_sizes(1000, 10), [])
+        self.assertEqual(Utils.etag_part_sizes(2, 30 * self.MB), [15 * self.MB + 1, 16 * self.MB, 25 * self.MB])
+        self.assertEqual(Utils.etag([hashlib.md5(self.small).hexdigest()], 0), hashlib.md5(self.small).hexdigest())
+        self.assertEqual(Utils.etag([hashlib.md5(self.large[i:i + self.MB]).hexdigest() for i in range(0, len(self.large), self.MB)], 7),
+                         multipartEtag(self.large, self.MB))
+
+    def testVerifiedDownload(self):
+        for engine in ('thread', 'process'):
+            self.stub.ranges = []
+            self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine=engine, verify=True)
+            self.assertEqual(self.readLocal('large.bin'), self.large)
+            # parts cover whole upload parts; the first range is fileS3metadata's
+            self.assertEqual(sorted(self.stub.ranges)[1:], [(0, self.half - 1), (self.half, len(self.large) - 1)])
+
+    def testVerifiedDebugMode(self):
+        tempDir = os.path.join(self.temp_dir, 'parts')
+        os.mkdir(tempDir)
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, tempDir=tempDir, engine='thread', verify=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+
+    def testSinglePartEtag(self):
+        self.stub.files['2']['etag'] = hashlib.md5(self.large).hexdigest()
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', verify=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(len(self.stub.ranges), 2)
+
+    def testMismatchRaises(self):
+        self.stub.files['2']['etag'] = multipartEtag(self.large[:-1] + b'!', 2 * self.MB)
+        with self.assertRaises(DownloadFailedException):
+            self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', verify=2)
+        self.assertEqual(os.listdir(self.temp_dir), ['large.bin.partial'])
+
+    def testFixedPartSizeUpload(self):
+        # uploaded by another client in parts of 5MB, which give the file as many parts as multipartFileUpload would
+        self.stub.files['2']['etag'] = multipartEtag(self.large, 5 * self.MB)
+        for engine in ('thread', 'process'):
+            self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine=engine, verify=True)
+            self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertTrue(self.api.verifyFile('2', os.path.join(self.temp_dir, 'large.bin')))
+
+    def testAmbiguousMismatchCannotVerify(self):
+        self.stub.files['2']['etag'] = multipartEtag(self.large[:-1] + b'!', self.half)
+        with self.assertRaises(IntegrityCheckException):
+            self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', verify=True)
+        # the parts are kept for resuming
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['large.bin.partial', 'large.bin.partial.parts'])
+        path = os.path.join(self.temp_dir, 'large.bin.partial')
+        with self.assertRaises(IntegrityCheckException):
+            self.api.verifyFile('2', path)
+
+    def testUnverifiableEtagIsSkipped(self):
+        self.stub.files['2']['etag'] = 'kms-encrypted'
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=1, engine='thread', verify=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+
+    def testStreamUploadedPartSize(self):
+        self.stub.files['2']['etag'] = multipartEtag(self.large, 2 * self.MB)
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=5, engine='thread', verify=2)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertEqual(len(self.stub.ranges), 3)
+
+    def testResumeKeepsPartMd5s(self):
+        self.stub.contentErrors[self.half] = (404,)
+        with self.assertRaises(MultiProcessingTaskFailedException):
+            self.api.multipartFileDownload('2', self.temp_dir, processCount=1, partSize=1, engine='thread', verify=True)
+        self.stub.ranges = []
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=1, partSize=1, engine='thread', verify=True, resume=True)
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        # the first part's MD5 came from the manifest, not from reading it back
+        self.assertEqual(self.stub.ranges[1:], [(self.half, len(self.large) - 1)])
+
+    def testVerifyFile(self):
+        path = os.path.join(self.temp_dir, 'large.bin')
+        with open(path, 'wb') as fp:
+            fp.write(self.large)
+        self.assertTrue(self.api.verifyFile('2', path))
+        with open(path, 'r+b') as fp:
+            fp.seek(len(self.large) - 1)
+            fp.write(b'!')
+        # parts of 5MB would be 2 parts too, so it can't be told whether the file is corrupt
+        with self.assertRaises(IntegrityCheckException):
+            self.api.verifyFile('2', path)
+        with open(path, 'ab') as fp:
+            fp.write(b'!')
+        self.assertFalse(self.api.verifyFile('2', path))
+        self.stub.files['2']['etag'] = 'kms-encrypted'
+        with self.assertRaises(IntegrityCheckException):
+            self.api.verifyFile('2', path)
+
+    def testVerifyUploadedFile(self):
+        data = os.urandom(13 * self.MB + 5)
+        path = os.path.join(self.temp_dir, 'big.bin')
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        bsFile = self.api.multipartFileUpload('appresults', '10', path, 'big.bin', 'dir', 'application/octet-stream', processCount=2, partSize=6)
+        self.assertTrue(self.stub.files[bsFile.Id]['etag'].endswith('-3'))
+        self.assertTrue(self.api.verifyFile(bsFile.Id, path))
+        # parts of 6MB would be 3 parts too, but not the ones uploaded
+        self.assertFalse(self.api.verifyFile(bsFile.Id, path, partSize=6))
+
+    def testVerifyStreamUploadedFile(self):
+        data = os.urandom(13 * self.MB + 5)
+        bsFile = self.api.multipartStreamUpload('appresults', '10', io.BytesIO(data), 'up.bin', 'dir', 'application/octet-stream', partSize=6)
+        path = os.path.join(self.temp_dir, 'up.bin')
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        self.assertTrue(self.api.verifyFile(bsFile.Id, path, partSize=6))
+
+
+class TestProjectSync(StubTestCase):
+    '''
+    Tests mirroring a Project's Samples and AppResults, downloading only new and changed files
+    '''
+    def setUp(self):
+        super(TestProjectSync, self).setUp()
+        self.stub.addFile('11', 'reads.fastq', b'ACGT' * 100)
+        self.stub.addFile('12', 'large.bin', self.large, path='dir/large.bin')
+        self.stub.addFile('21', 'r2.fastq', b'TTTT' * 50)
+        self.stub.addFile('31', 'calls.vcf', b'#vcf\n', path='out/calls.vcf')
+        self.stub.addList('projects/7/samples', [sampleJson(1), sampleJson(2)])
+        self.stub.addList('projects/7/appresults', [appResultJson(3)])
+        self.publish({'samples/1/files': ['11', '12'], 'samples/2/files': ['21'], 'appresults/3/files': ['31']})
+        self.paths = {'11': 'samples/Sample_1_1/reads.fastq', '12': 'samples/Sample_1_1/dir/large.bin',
+                      '21': 'samples/Sample_2_2/r2.fastq', '31': 'appresults/AppResult_3_3/out/calls.vcf'}
+
+    def publish(self, lists):
+        for path, Ids in lists.items():
+            self.stub.addList(path, [self.stub.fileJson(self.stub.files[Id]) for Id in Ids])
+
+    def contentRequests(self):
+        return [r for r in self.stub.requests if r[1].startswith('/s3/')]
+
+    def testFirstSyncDownloadsAll(self):
+        plan = self.api.sync('7', self.temp_dir, partSize=1)
+        self.assertEqual(sorted(a.path for a in plan.new()), sorted(self.paths.values()))
+        self.assertTrue(plan.executed)
+        for Id, path in self.paths.items():
+            self.assertEqual(self.readLocal(path), self.stub.files[Id]['data'])
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, STATE_DB)))
+
+    def testSecondSyncFetchesNothing(self):
+        self.api.sync('7', self.temp_dir, partSize=1)
+        del self.stub.requests[:]
+        plan = self.api.sync('7', self.temp_dir, partSize=1)
+        self.assertEqual(len(plan.unchanged()), 4)
+        self.assertEqual(plan.transfers(), [])
+        self.assertEqual(self.contentRequests(), [])
+
+    def testChangedFilesAreFetched(self):
+        self.api.sync('7', self.temp_dir)
+        # a new size, the same size with other content, and the same content as a new file Id
+        self.stub.addFile('21', 'r2.fastq', b'GGGG' * 60)
+        self.stub.addFile('32', 'calls.vcf', b'#VCF\n', path='out/calls.vcf')
+        self.stub.addFile('13', 'reads.fastq', b'ACGT' * 100)
+        self.publish({'samples/1/files': ['13', '12'], 'samples/2/files': ['21'], 'appresults/3/files': ['32']})
+        plan = self.api.sync('7', self.temp_dir)
+        self.assertEqual([(a.path, a.reason) for a in plan.changed()],
+                         [(self.paths['31'], 'ETag changed'), (self.paths['21'], 'size changed')])
+        self.assertEqual(sorted(a.bsFile.Id for a in plan.unchanged()), ['12', '13'])
+        self.assertEqual(self.readLocal(self.paths['21']), b'GGGG' * 60)
+        self.assertEqual(self.readLocal(self.paths['31']), b'#VCF\n')
+
+    def testLocalChanges(self):
+        self.api.sync('7', self.temp_dir)
+        os.remove(os.path.join(self.temp_dir, self.paths['11']))
+        with open(os.path.join(self.temp_dir, self.paths['21']), 'ab') as fp:
+            fp.write(b'extra')
+        plan = self.api.sync('7', self.temp_dir, dryRun=True)
+        self.assertEqual([(a.action, a.reason) for a in plan.transfers()], [('new', 'missing locally'), ('changed', 'modified locally')])
+
+    def testPlanIsReportedBeforeExecuting(self):
+        plans = []
+        def confirm(plan):
+            plans.append(plan)
+            self.assertFalse(os.path.exists(os.path.join(self.temp_dir, self.paths['11'])))
+            return False
+        plan = self.api.sync('7', self.temp_dir, confirm=confirm)
+        self.assertEqual(plans, [plan])
+        self.assertFalse(plan.executed)
+        self.assertEqual(plan.transferBytes(), sum(len(self.stub.files[Id]['data']) for Id in self.paths))
+        report = plan.report().splitlines()
+        self.assertTrue(report[0].startswith('Sync of project 7 to %s: 4 new' % self.temp_dir))
+        self.assertEqual(len(report), 5)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'samples')))
+        # only the ETags were requested
+        self.assertEqual(self.stub.ranges, [(0, 1)] * 4)
+
+    def testFailedFileIsRetriedNextSync(self):
+        syncer = ProjectSync(self.api, '7', self.temp_dir)
+        plan = syncer.plan()
+        data = self.stub.files.pop('21')
+        with self.assertRaises(DownloadFailedException):
+            syncer.execute(plan)
+        self.assertEqual([a.path for a in plan.failed()], [self.paths['21']])
+        self.stub.files['21'] = data
+        plan = syncer.sync()
+        syncer.close()
+        self.assertEqual([a.path for a in plan.transfers()], [self.paths['21']])
+        self.assertEqual(self.readLocal(self.paths['21']), data['data'])
+
+    def testRemovedAndUnsafePaths(self):
+        self.api.sync('7', self.temp_dir)
+        self.stub.addFile('22', 'evil.txt', b'x', path='../../evil.txt')
+        self.publish({'samples/1/files': ['11'], 'samples/2/files': ['21', '22']})
+        plan = self.api.sync('7', self.temp_dir)
+        self.assertEqual(plan.removed, [self.paths['12']])
+        self.assertEqual([a.path for a in plan.new()], ['samples/Sample_2_2/evil.txt'])
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, self.paths['12'])))
+
+    def testTraversalNameStaysInLocalDir(self):
+        mirror = os.path.join(self.temp_dir, 'a', 'b', 'mirror')
+        self.stub.addFile('22', '../../../escaped.txt', b'x' * 100, path='../../../escaped.txt')
+        self.publish({'samples/1/files': [], 'samples/2/files': ['22'], 'appresults/3/files': []})
+        # the partial file can't be written where the BaseSpace name points
+        os.makedirs(os.path.join(self.temp_dir, 'a', 'b', 'escaped.txt.partial'))
+        plan = self.api.sync('7', mirror, partSize=1)
+        self.assertEqual([a.path for a in plan.new()], ['samples/Sample_2_2/escaped.txt'])
+        with open(os.path.join(mirror, 'samples', 'Sample_2_2', 'escaped.txt'), 'rb') as fp:
+            self.assertEqual(fp.read(), b'x' * 100)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.temp_dir, 'a', 'b'))), ['escaped.txt.partial', 'mirror'])
+        self.assertEqual(os.listdir(os.path.join(mirror, 'samples', 'Sample_2_2')), ['escaped.txt'])
+
+    def testPlanDoesNotChangeState(self):
+        self.api.sync('7', self.temp_dir)
+        self.stub.addFile('13', 'reads.fastq', b'ACGT' * 100)
+        self.publish({'samples/1/files': ['13', '12']})
+        syncer = ProjectSync(self.api, '7', self.temp_dir)
+        plan = syncer.plan()
+        self.assertEqual(syncer.state.get(self.paths['11'])[0], '11')
+        self.assertEqual(plan.transfers(), [])
+        syncer.execute(plan)
+        self.assertEqual(syncer.state.get(self.paths['11'])[0], '13')
+        syncer.close()
+
+    def testLocalNameMustBeOneComponent(self):
+        with self.assertRaises(IllegalParameterException):
+            MultipartDownload(self.api, '1', self.temp_dir, 1, 1, False, local_name='../escaped.txt')
+
+
+class TestContentUrlCache(StubTestCase):
+    '''
+    Tests that signed content urls are resolved once per file, and refreshed when they expire
+    '''
+    def apiRequests(self, path):
+        return [r for r in self.stub.requests if r[1].split('?')[0] == '/v1pre3' + path]
+
+    def testExpiryFromUrl(self):
+        cache = ContentUrlCache()
+        self.assertEqual(cache.expires('https://s3/f?AWSAccessKeyId=a&Expires=1400000000&Signature=s'), 1400000000)
+        self.assertEqual(cache.expires('https://s3/f?X-Amz-Date=20140604T220251Z&X-Amz-Expires=3600&X-Amz-Signature=s'),
+                         1401919371 + 3600)
+        self.assertIsNone(cache.expires('https://s3/f'))
+        self.assertIsNone(cache.expires('https://s3/f?Expires=soon'))
+
+    def testEntryExpiresBeforeUrl(self):
+        cache = ContentUrlCache(margin=60)
+        cache.put('1', 'https://s3/f?Expires=%d' % (time.time() + 30), 10)
+        self.assertIsNone(cache.get('1'))
+        cache.put('1', 'https://s3/f?Expires=%d' % (time.time() + 120), 10)
+        self.assertEqual(cache.get('1')[1], 10)
+        cache.put('2', 'https://s3/g', 20)
+        self.assertEqual(cache.get('2'), ('https://s3/g', 20))
+        cache.invalidate('2')
+        self.assertIsNone(cache.get('2'))
+
+    def testPickleKeepsEntries(self):
+        self.api.__contentUrl__('2')
+        api = pickle.loads(pickle.dumps(self.api))
+        self.assertEqual(api.contentUrls.get('2'), self.api.contentUrls.get('2'))
+
+    def testMultipartDownloadResolvesUrlOnce(self):
+        for engine in ('thread', 'process'):
+            del self.stub.requests[:]
+            self.api.contentUrls.clear()
+            self.api.multipartFileDownload('2', self.temp_dir, processCount=3, partSize=1, engine=engine)
+            self.assertEqual(self.readLocal('large.bin'), self.large)
+            self.assertEqual(len(self.apiRequests('/files/2/content')), 1)
+            self.assertEqual(len(self.apiRequests('/files/2')), 2)
+            os.remove(os.path.join(self.temp_dir, 'large.bin'))
+
+    def testExpiredUrlIsRefreshed(self):
+        self.stub.urlTtl = 3600
+        expired = self.stub.apiServer + 's3/2?Expires=%d' % (time.time() - 10)
+        # an expired url, cached as if still current
+        self.api.contentUrls._entries['2'] = (expired, len(self.large), time.time() + 3600)
+        self.api.multipartFileDownload('2', self.temp_dir, processCount=2, partSize=2, engine='thread')
+        self.assertEqual(self.readLocal('large.bin'), self.large)
+        self.assertNotEqual(self.api.contentUrls.get('2')[0], expired)
+        # refreshed by each thread that was refused
+        self.assertIn(len(self.apiRequests('/files/2/content')), (1, 2))
+
+    def testRemoteFileRefreshesUrl(self):
+        self.stub.urlTtl = 3600
+        with self.api.openRemoteFile('2', blockSize=1024 * 1024, readAhead=0) as fp:
+            self.assertEqual(fp.read(10), self.large[:10])
+            self.api.contentUrls._entries['2'] = (self.stub.apiServer + 's3/2?Expires=0', len(self.large), time.time() + 3600)
+            fp.seek(3 * 1024 * 1024)
+            self.assertEqual(fp.read(10), self.large[3 * 1024 * 1024:3 * 1024 * 1024 + 10])
+        self.assertEqual(len(self.apiRequests('/files/2/content')), 2)
+
+class TestRemoteFileStream(StubTestCase):
+    '''
+    Tests streaming file content with openFile() and streamFile()
+    '''
+    MB = 1024 * 1024
+
+    def contentRequests(self):
+        return [r for r in self.stub.requests if r[1].startswith('/s3/')]
+
+    def testRead(self):
+        with self.api.openFile('2', blockSize=self.MB) as fp:
+            self.assertEqual(fp.read(10), self.large[:10])
+            self.assertEqual(fp.read(), self.large[10:])
+            self.assertEqual(fp.read(), b'')
+        self.assertEqual(len(self.contentRequests()), 7)
+
+    def testReadline(self):
+        self.stub.addFile('3', 'reads.fastq', b'@r1\nACGT\n+\nIIII\n' * 1000)
+        with self.api.openFile('3', blockSize=1000) as fp:
+            lines = fp.readlines()
+        self.assertEqual(len(lines), 4000)
+        self.assertEqual(lines[-2:], [b'+\n', b'IIII\n'])
+
+    def testDecompressOnTheFly(self):
+        self.stub.addFile('3', 'large.bin.gz', gzip.compress(self.large))
+        with gzip.GzipFile(fileobj=self.api.openFile('3', blockSize=self.MB)) as fp:
+            self.assertEqual(fp.read(), self.large)
+
+    def testStreamFile(self):
+        blocks = list(self.api.streamFile('2', blockSize=self.MB, readAhead=3))
+        self.assertEqual([len(b) for b in blocks], [self.MB] * 6 + [123])
+        self.assertEqual(b''.join(blocks), self.large)
+
+    def testReadAheadIsBounded(self):
+        stream = RemoteFileStream(self.api, '2', blockSize=self.MB, readAhead=2)
+        self.assertEqual(stream.read(10), self.large[:10])
+        self.assertEqual(len(stream._pending), 2)
+        self.assertEqual(stream.tell(), 10)
+        stream.close()
+        self.assertTrue(stream.closed)
+
+    def testEmptyFile(self):
+        self.stub.addFile('3', 'empty.txt', b'')
+        with self.api.openFile('3') as fp:
+            self.assertEqual(fp.read(), b'')
+        self.assertEqual(self.contentRequests(), [])
+
+    def testFailedBlockRaises(self):
+        stream = RemoteFileStream(self.api, '2', blockSize=self.MB, retries=2)
+        self.api.contentUrls.put('2', self.stub.apiServer + 's3/missing', len(self.large))
+        with self.assertRaises(DownloadFailedException):
+            stream.read()
+        stream.close()
+
+class TestRemoteFile(StubTestCase):
+    '''
+    Tests random access to file content with RemoteFile
+    '''
+    KB = 1024
+
+    def contentRequests(self):
+        return [r for r in self.stub.requests if r[1].startswith('/s3/')]
+
+    def testSeekAndRead(self):
+        with self.api.openRemoteFile('2', blockSize=64 * self.KB) as fp:
+            self.assertTrue(fp.seekable())
+            fp.seek(1000000)
+            self.assertEqual(fp.read(100000), self.large[1000000:1100000])
+            self.assertEqual(fp.tell(), 1100000)
+            fp.seek(-10, io.SEEK_END)
+            self.assertEqual(fp.read(), self.large[-10:])
+            self.assertEqual(fp.read(), b'')
+            fp.seek(5, io.SEEK_SET)
+            fp.seek(5, io.SEEK_CUR)
+            self.assertEqual(fp.read(3), self.large[10:13])
+
+    def testReadIntoSpansBlocks(self):
+        with RemoteFile(self.api, '2', blockSize=1000, readAhead=0) as fp:
+            buf = bytearray(2500)
+            fp.seek(999)
+            self.assertEqual(fp.readinto(buf), 2500)
+            self.assertEqual(bytes(buf), self.large[999:3499])
+
+    def testRepeatedReadsAreCached(self):
+        with RemoteFile(self.api, '2', blockSize=64 * self.KB, readAhead=0) as fp:
+            for i in range(3):
+                fp.seek(100)
+                fp.read(1000)
+            self.assertEqual(len(self.contentRequests()), 1)
+            self.assertEqual(fp.stats()['hits'], 2)
+
+    def testLruEviction(self):
+        with RemoteFile(self.api, '2', blockSize=64 * self.KB, cacheSize=128 * self.KB, readAhead=0) as fp:
+            for block in (0, 10, 0, 20, 0, 10):
+                fp.seek(block * 64 * self.KB)
+                fp.read(1)
+            # block 10 was evicted by block 20, block 0 stayed as it was used more recently
+            self.assertEqual(len(self.contentRequests()), 4)
+            self.assertEqual(fp.stats()['blocks'], 2)
+
+    def testSequentialReadAhead(self):
+        with RemoteFile(self.api, '2', blockSize=64 * self.KB, readAhead=3) as fp:
+            self.assertEqual(fp.read(64 * self.KB + 1), self.large[:64 * self.KB + 1])
+            self.assertEqual(fp.stats()['prefetches'], 3)
+            self.assertEqual(fp.read(), self.large[64 * self.KB + 1:])
+            stats = fp.stats()
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(len(self.contentRequests()), len(self.large) // (64 * self.KB) + 1)
+
+    def testRandomReadsDontReadAhead(self):
+        with RemoteFile(self.api, '2', blockSize=64 * self.KB, readAhead=3) as fp:
+            for block in (5, 1, 30, 12):
+                fp.seek(block * 64 * self.KB)
+                fp.read(10)
+            self.assertEqual(fp.stats()['prefetches'], 0)
+
+    def testGzipFileObject(self):
+        self.stub.addFile('3', 'large.bin.gz', gzip.compress(self.large))
+        with gzip.GzipFile(fileobj=self.api.openRemoteFile('3')) as fp:
+            fp.seek(len(self.large) - 100)
+            self.assertEqual(fp.read(), self.large[-100:])
+
+deserialize = TestSuite([
+    TestLoader().loadTestsFromTestCase(TestDeserialize),
+    TestLoader().loadTestsFromTestCase(TestListRequest), ])
+
+list_iterator = TestSuite([
+    TestLoader().loadTestsFromTestCase(TestListIterator), ])
+
+response_cache = TestSuite([
+    TestLoader().loadTestsFromTestCase(TestResponseCache),
+    TestLoader().loadTestsFromTestCase(TestDiskResponseCache), ])
+
+multipart_download = TestSuite([
+    TestLoader().loadTestsFromTestCase(TestMultipartDownload),
+    TestLoader().loadTestsFromTestCase(TestAutoTransfer),
+    TestLoader().loadTestsFromTestCase(TestHedgedDownload),
+    TestLoader().loadTestsFromTestCase(TestRetryPolicy),
+    TestLoader().loadTestsFromTestCase(TestTransferPool),
+    TestLoader().loadTestsFromTestCase(TestContentUrlCache),
+    TestLoader().loadTestsFromTestCase(TestRemoteFileStream),
+    TestLoader().loadTestsFromTestCase(TestRemoteFile),
+    TestLoader().loadTestsFromTestCase(TestResumeDownload),
+    TestLoader().loadTestsFromTestCase(TestVerifyDownload),
+    TestLoader().loadTestsFromTestCase(TestProjectSync), ])
+
+connection_pool = TestSuite([
+    TestLoader().loadTestsFromTestCase(TestConnectionPool),
+    TestLoader().loadTestsFromTestCase(TestPutCall), ])
+
+multipart_upload = TestSuite([
+    TestLoader().loadTestsFromTestCase(TestFileMd5s),
+    TestLoader().loadTestsFromTestCase(TestResumeUpload),
+    TestLoader().loadTestsFromTestCase(TestStreamUpload), ])
+
+
+if __name__ == "__main__":
+    tests = []
+    if(len(sys.argv) == 1):
+        tests.extend([
+              connection_pool,
+              deserialize,
+              list_iterator,
+              response_cache,
+              multipart_download,
+              multipart_upload,
+        ])
+    else:
+        # to test individual test cases:
+        for t in sys.argv[1:]:
+            tests.append( TestLoader().loadTestsFromTestCase( eval(t) ) )
+    TextTestRunner(verbosity=2).run( TestSuite(tests) )
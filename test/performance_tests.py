@@ -0,0 +1,322 @@
+from unittest import TestCase, TestSuite, TestLoader, TextTestRunner
+import sys
+import time
+import json
+import urllib.request
+import os
+import shutil
+from tempfile import mkdtemp
+
+from BaseSpacePy.api.APIClient import APIClient
+from BaseSpacePy.model.QueryParameters import QueryParameters as qp
+from BaseSpacePy.model.MultipartFileTransfer import TransferPool, Utils
+from stub_server import StubBaseSpace, sampleJson, propertyListJson
+
+# Benchmarks against a local stand-in server (see stub_server.py), so they need no BaseSpace credentials.
+# Rates are printed rather than asserted, since they depend on the host.
+
+
+def report(label, count, seconds, unit='requests'):
+    print("\n    %-45s %12.2f %s/sec" % (label, count / seconds, unit))
+
+
+class BenchmarkConnectionPool(TestCase):
+    '''
+    Compares requests/second for pooled keep-alive connections against a new connection per request
+    '''
+    requests = 500
+
+    def setUp(self):
+        self.stub = StubBaseSpace()
+        self.stub.addFile('1', 'small.txt', b'0123456789')
+        self.stub.start()
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def testRequestsPerSecond(self):
+        url = self.api.apiClient.apiServerAndVersion + '/files/1'
+        headers = {'Authorization': 'Bearer token', 'Content-Type': 'application/json'}
+        start = time.time()
+        for i in range(self.requests):
+            json.loads(urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=10).read())
+        unpooled = time.time() - start
+
+        start = time.time()
+        for i in range(self.requests):
+            self.api.apiClient.callAPI('/files/1', 'GET', {}, None)
+        pooled = time.time() - start
+
+        report("urlopen, new connection per request", self.requests, unpooled)
+        report("APIClient.callAPI, pooled connections", self.requests, pooled)
+        self.assertEqual(self.api.getFileById('1').Size, 10)
+
+
+class BenchmarkDeserialize(TestCase):
+    '''
+    Measures objects/second decoded by APIClient.deserialize for File, Sample and PropertyList payloads
+    '''
+    objects = 2000
+
+    def setUp(self):
+        self.apiClient = APIClient('token', 'http://127.0.0.1/v1pre3')
+        stub = StubBaseSpace()
+        stub.addFile('1', 'reads.fastq', b'')
+        self.file = stub.fileJson(stub.files['1'])
+        self.file['DateCreated'] = '2014-06-04T22:02:51.0000000Z'
+
+    def _run(self, label, payload, objClass):
+        self.apiClient.deserialize(payload, objClass)
+        start = time.time()
+        for i in range(self.objects):
+            self.apiClient.deserialize(payload, objClass)
+        report(label, self.objects, time.time() - start, 'objects')
+
+    def testFile(self):
+        self._run("deserialize File", self.file, 'File')
+
+    def testSample(self):
+        self._run("deserialize Sample (with nested models)", sampleJson(), 'Sample')
+
+    def testPropertyList(self):
+        self._run("deserialize PropertyList (dynamic types)", propertyListJson(), 'PropertyList')
+
+
+class BenchmarkListResponse(TestCase):
+    '''
+    Measures items/second for list requests returning 10k-item pages
+    '''
+    items = 10000
+    pages = 5
+
+    def setUp(self):
+        self.stub = StubBaseSpace()
+        files = []
+        for i in range(self.items):
+            self.stub.addFile(str(i), 'file%d.fastq' % i, b'')
+            files.append(self.stub.fileJson(self.stub.files[str(i)]))
+        self.stub.addList('appresults/1/files', files)
+        self.stub.start()
+        self.api = self.stub.api()
+        self.queryPars = qp({'Limit': self.items})
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def testListRequest(self):
+        self.api.getAppResultFilesById('1', self.queryPars)
+        start = time.time()
+        for i in range(self.pages):
+            files = self.api.getAppResultFilesById('1', self.queryPars)
+        report("list request, 10k-item pages", self.items * self.pages, time.time() - start, 'items')
+        self.assertEqual(len(files), self.items)
+
+
+class BenchmarkListFanOut(TestCase):
+    '''
+    Compares walking 50 pages one after another with fetching them concurrently, with 20ms latency per request
+    '''
+    pages = 50
+    limit = 100
+
+    def setUp(self):
+        self.stub = StubBaseSpace()
+        files = []
+        for i in range(self.pages * self.limit):
+            self.stub.addFile(str(i), 'file%d.fastq' % i, b'')
+            files.append(self.stub.fileJson(self.stub.files[str(i)]))
+        self.stub.addList('appresults/1/files', files)
+        self.stub.listLatency = 0.02
+        self.stub.start()
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def _run(self, label, **kwargs):
+        start = time.time()
+        files = list(self.api.iterAppResultFilesById('1', qp({'Limit': self.limit}), **kwargs))
+        report(label, len(files), time.time() - start, 'items')
+        self.assertEqual(len(files), self.pages * self.limit)
+
+    def testSerial(self):
+        self._run("iterate pages, one after another", prefetch=False)
+
+    def testPrefetch(self):
+        self._run("iterate pages, prefetching the next")
+
+    def testFanOut(self):
+        self._run("iterate pages, 8 workers", workers=8)
+
+
+class BenchmarkMultipartDownload(TestCase):
+    '''
+    Compares GB/second downloaded by the process and thread engines of multipartFileDownload, from a local range-serving stub
+    '''
+    size = 256 * 1024 * 1024
+    workers = 8
+    partSize = 8
+
+    def setUp(self):
+        self.stub = StubBaseSpace()
+        self.data = os.urandom(1024 * 1024) * (self.size // (1024 * 1024))
+        self.stub.addFile('1', 'large.bin', self.data)
+        self.stub.start()
+        self.api = self.stub.api()
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        self.stub.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self, label, engine):
+        start = time.time()
+        self.api.multipartFileDownload('1', self.temp_dir, processCount=self.workers, partSize=self.partSize, engine=engine)
+        report(label, self.size / 1024.0**3, time.time() - start, 'GB')
+        self.assertEqual(os.path.getsize(os.path.join(self.temp_dir, 'large.bin')), self.size)
+
+    def testProcessEngine(self):
+        self._run("multipart download, process engine", 'process')
+
+    def testThreadEngine(self):
+        self._run("multipart download, thread engine", 'thread')
+
+
+class BenchmarkTransferPool(TestCase):
+    '''
+    Compares files/second downloaded from a local stub by separate multipart downloads, which start workers for each file,
+    and by one TransferPool shared by all files
+    '''
+    files = 100
+    size = 2 * 1024 * 1024
+    workers = 8
+
+    def setUp(self):
+        self.stub = StubBaseSpace()
+        for n in range(self.files):
+            self.stub.addFile(str(n), 'f%d.bin' % n, os.urandom(self.size))
+        self.stub.start()
+        self.api = self.stub.api()
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        self.stub.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def testPerFileProcesses(self):
+        start = time.time()
+        for n in range(self.files):
+            self.api.multipartFileDownload(str(n), self.temp_dir, processCount=self.workers, partSize=1)
+        report("downloads with per-file processes", self.files, time.time() - start, 'files')
+
+    def testProcessPool(self):
+        start = time.time()
+        with TransferPool(self.workers, engine='process') as pool:
+            futures = [pool.download(self.api, str(n), self.temp_dir, partSize=1) for n in range(self.files)]
+            for future in futures:
+                future.result()
+        report("downloads with a process TransferPool", self.files, time.time() - start, 'files')
+
+    def testThreadPool(self):
+        start = time.time()
+        with TransferPool(self.workers) as pool:
+            futures = [pool.download(self.api, str(n), self.temp_dir, partSize=1) for n in range(self.files)]
+            for future in futures:
+                future.result()
+        report("downloads with a thread TransferPool", self.files, time.time() - start, 'files')
+
+
+class BenchmarkMultipartUpload(TestCase):
+    '''
+    Measures GB/second uploaded by multipartFileUpload to a local stub, with parts read from offsets of the local file
+    '''
+    size = 128 * 1024 * 1024
+    workers = 8
+    partSize = 8
+
+    def setUp(self):
+        self.stub = StubBaseSpace()
+        self.stub.start()
+        self.api = self.stub.api()
+        self.temp_dir = mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'large.bin')
+        with open(self.path, 'wb') as fp:
+            fp.write(os.urandom(1024 * 1024) * (self.size // (1024 * 1024)))
+
+    def tearDown(self):
+        self.stub.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def testUpload(self):
+        start = time.time()
+        bsFile = self.api.multipartFileUpload('appresults', '1', self.path, 'large.bin', '', 'application/octet-stream',
+                                              processCount=self.workers, partSize=self.partSize)
+        report("multipart upload", self.size / 1024.0**3, time.time() - start, 'GB')
+        self.assertEqual(bsFile.Size, self.size)
+
+
+class BenchmarkFileMd5s(TestCase):
+    '''
+    Compares GB/second hashed by Utils.md5_for_file (one MD5 of the file) and by Utils.file_md5s (MD5s of its parts, in parallel)
+    '''
+    size = 512 * 1024 * 1024
+    partSize = 25 * 1024 * 1024
+
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'large.bin')
+        with open(self.path, 'wb') as fp:
+            fp.write(os.urandom(1024 * 1024) * (self.size // (1024 * 1024)))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testMd5ForFile(self):
+        start = time.time()
+        with open(self.path, 'rb') as fp:
+            Utils.md5_for_file(fp)
+        report("md5_for_file", self.size / 1024.0**3, time.time() - start, 'GB')
+
+    def testFileMd5s(self):
+        for threads in (1, 4, 8):
+            start = time.time()
+            md5s = Utils.file_md5s(self.path, self.partSize, threads=threads)
+            report("file_md5s, %d threads" % threads, self.size / 1024.0**3, time.time() - start, 'GB')
+        self.assertEqual(len(md5s), self.size // self.partSize + 1)
+
+
+deserialize = TestSuite([
+    TestLoader().loadTestsFromTestCase(BenchmarkDeserialize),
+    TestLoader().loadTestsFromTestCase(BenchmarkListResponse), ])
+
+list_iterator = TestSuite([
+    TestLoader().loadTestsFromTestCase(BenchmarkListFanOut), ])
+
+multipart_download = TestSuite([
+    TestLoader().loadTestsFromTestCase(BenchmarkMultipartDownload),
+    TestLoader().loadTestsFromTestCase(BenchmarkTransferPool), ])
+
+multipart_upload = TestSuite([
+    TestLoader().loadTestsFromTestCase(BenchmarkFileMd5s),
+    TestLoader().loadTestsFromTestCase(BenchmarkMultipartUpload), ])
+
+connection_pool = TestSuite([
+    TestLoader().loadTestsFromTestCase(BenchmarkConnectionPool), ])
+
+
+if __name__ == "__main__":
+    tests = []
+    if(len(sys.argv) == 1):
+        tests.extend([
+              connection_pool,
+              deserialize,
+              list_iterator,
+              multipart_download,
+              multipart_upload,
+        ])
+    else:
+        # to run individual benchmarks:
+        for t in sys.argv[1:]:
+            tests.append( TestLoader().loadTestsFromTestCase( eval(t) ) )
+    TextTestRunner(verbosity=2).run( TestSuite(tests) )
@@ -0,0 +1,290 @@
+"""
+A local stand-in for the BaseSpace api server and S3, for tests and benchmarks that
+shouldn't depend on a live BaseSpace account.
+
+Serves canned File metadata, content urls that point back to this server (optionally
+signed with an expiry time), ranged content requests, paged lists, and single-part and multipart file uploads:
+
+    stub = StubBaseSpace()
+    stub.addFile('123', 'reads.fastq', data)
+    stub.start()
+    api = stub.api()
+    ...
+    stub.stop()
+"""
+import base64
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from BaseSpacePy.api.BaseSpaceAPI import BaseSpaceAPI
+
+VERSION = 'v1pre3'
+
+
+def userJson(n=1):
+    return {'Id': str(n), 'Href': '%s/users/%d' % (VERSION, n), 'Name': 'User %d' % n}
+
+
+def propertyListJson():
+    '''
+    A canned PropertyList with one property of each kind, including one of an unrecognized type
+    '''
+    return {'Href': VERSION + '/samples/1/properties', 'DisplayedCount': 5, 'TotalCount': 5,
+            'Offset': 0, 'Limit': 10, 'SortDir': 'Asc', 'SortBy': 'Name', 'Items': [
+        {'Type': 'string', 'Href': 'h', 'Name': 'Input.Name', 'Description': 'd', 'Content': 'value'},
+        {'Type': 'string[]', 'Href': 'h', 'Name': 'Input.Names', 'Description': 'd', 'Items': ['a', 'b'],
+         'ItemsDisplayedCount': 2, 'ItemsTotalCount': 2},
+        {'Type': 'project', 'Href': 'h', 'Name': 'Input.Project', 'Description': 'd',
+         'Content': {'Id': '7', 'Href': VERSION + '/projects/7', 'Name': 'Project', 'UserOwnedBy': userJson(),
+                     'DateCreated': '2014-06-04T22:02:51.0000000Z'}},
+        {'Type': 'map[]', 'Href': 'h', 'Name': 'Input.Map', 'Description': 'd',
+         'Items': [[{'Key': 'k1', 'Values': ['v1']}], [{'Key': 'k2', 'Values': ['v2', 'v3']}]], 'ItemsDisplayedCount': 2, 'ItemsTotalCount': 2},
+        {'Type': 'unknown', 'Href': 'h', 'Name': 'Input.Other', 'Description': 'd', 'Content': 'x'}, ]}
+
+
+def sampleJson(n=1):
+    '''
+    A canned Sample, with nested user, projects and properties
+    '''
+    return {'Id': str(n), 'Href': '%s/samples/%d' % (VERSION, n), 'Name': 'Sample %d' % n, 'SampleId': 'S%d' % n,
+            'SampleNumber': n, 'ExperimentName': 'Experiment', 'HrefFiles': '%s/samples/%d/files' % (VERSION, n),
+            'IsPairedEnd': True, 'Read1': 151, 'Read2': 151, 'NumReadsRaw': 1000000, 'NumReadsPF': 900000,
+            'Status': 'Complete', 'StatusSummary': '', 'DateCreated': '2014-06-04T22:02:51.0000000Z',
+            'TotalSize': 123456, 'UserOwnedBy': userJson(), 'References': [{'Rel': 'Using'}],
+            'Projects': [{'Id': '7', 'Href': VERSION + '/projects/7', 'Name': 'Project', 'UserOwnedBy': userJson()}],
+            'Properties': propertyListJson()}
+
+
+def appResultJson(n=1):
+    '''
+    A canned AppResult
+    '''
+    return {'Id': str(n), 'Href': '%s/appresults/%d' % (VERSION, n), 'Name': 'AppResult %d' % n, 'Status': 'Complete',
+            'StatusSummary': '', 'HrefFiles': '%s/appresults/%d/files' % (VERSION, n), 'DateCreated': '2014-06-04T22:02:51.0000000Z',
+            'TotalSize': 123456, 'UserOwnedBy': userJson()}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sendError(self, status, retryAfter=None):
+        headers = {'Retry-After': str(retryAfter)} if retryAfter is not None else {}
+        self._send(status, b'<Error><Code>%d</Code></Error>' % status, headers)
+
+    def _notFound(self):
+        self._send(404, {'ResponseStatus': {'ErrorCode': 'NotFound', 'Message': 'Unrecognized path ' + self.path}})
+
+    def do_GET(self):
+        stub = self.server.stub
+        with stub.lock:
+            stub.requests.append(('GET', self.path))
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        m = re.match(r'^/s3/(\w+)$', url.path)
+        if m:
+            if 'Expires' in query and float(query['Expires']) < time.time():
+                return self._send(403, b'<Error><Code>AccessDenied</Code><Message>Request has expired</Message></Error>')
+            return self._sendContent(m.group(1))
+        m = re.match(r'^/%s/files/(\w+)(/content)?$' % VERSION, url.path)
+        if m and m.group(1) in stub.files:
+            f = stub.files[m.group(1)]
+            if m.group(2):
+                href = 'http://127.0.0.1:%d/s3/%s' % (self.server.server_port, f['Id'])
+                if stub.urlTtl is not None:
+                    href += '?Expires=%d' % (time.time() + stub.urlTtl)
+                return self._send(200, {'Response': {'HrefContent': href}, 'ResponseStatus': {}})
+            return self._send(200, {'Response': stub.fileJson(f), 'ResponseStatus': {}})
+        m = re.match(r'^/%s/(\w+/\w+/\w+)$' % VERSION, url.path)
+        if m and m.group(1) in stub.lists:
+            time.sleep(stub.listLatency)
+            with stub.lock:
+                fail, stub.listFailures = stub.listFailures > 0, max(stub.listFailures - 1, 0)
+            if fail:
+                # drop the connection without a response
+                self.close_connection = True
+                return
+            return self._sendList(stub.lists[m.group(1)], query)
+        self._notFound()
+
+    def _sendList(self, items, query):
+        offset, limit = int(query.get('Offset', 0)), int(query.get('Limit', 10))
+        if self.server.stub.listLimitCap is not None:
+            limit = min(limit, self.server.stub.listLimitCap)
+        page = items[offset:offset + limit]
+        if query.get('SortDir') == 'Desc':
+            page = items[::-1][offset:offset + limit]
+        self._send(200, {'Response': {'Items': page, 'DisplayedCount': len(page), 'TotalCount': len(items),
+                                      'Offset': offset, 'Limit': limit, 'SortDir': query.get('SortDir', 'Asc'),
+                                      'SortBy': query.get('SortBy', 'Id')}, 'ResponseStatus': {}})
+
+    def _readBody(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self._readBody()
+        with stub.lock:
+            stub.requests.append(('POST', self.path))
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        m = re.match(r'^/%s/(\w+)/(\w+)/files$' % VERSION, url.path)
+        if m:
+            # new file, either multipart (parts follow) or single part (content is the body)
+            Id = stub.newFileId()
+            name, directory = query.get('name', ''), query.get('directory', '')
+            path = directory + '/' + name if directory else name
+            stub.addFile(Id, name, b'' if query.get('multipart') else body, path=path)
+            stub.files[Id]['UploadStatus'] = 'pending' if query.get('multipart') else 'complete'
+            stub.parts[Id] = {}
+            return self._send(201, {'Response': stub.fileJson(stub.files[Id]), 'ResponseStatus': {}})
+        m = re.match(r'^/%s/files/(\w+)$' % VERSION, url.path)
+        if m and m.group(1) in stub.files and query.get('uploadstatus') == 'complete':
+            Id = m.group(1)
+            parts = stub.parts[Id]
+            # S3 style ETag of a multipart upload: the MD5 of the part MD5s, with the number of parts
+            etag = '%s-%d' % (hashlib.md5(b''.join(hashlib.md5(parts[n]).digest() for n in sorted(parts))).hexdigest(), len(parts))
+            stub.addFile(Id, stub.files[Id]['Name'], b''.join(parts[n] for n in sorted(parts)), path=stub.files[Id]['Path'], etag=etag)
+            return self._send(200, {'Response': stub.fileJson(stub.files[Id]), 'ResponseStatus': {}})
+        self._notFound()
+
+    def do_PUT(self):
+        stub = self.server.stub
+        body = self._readBody()
+        with stub.lock:
+            stub.requests.append(('PUT', self.path))
+        m = re.match(r'^/%s/files/(\w+)/parts/(\d+)$' % VERSION, self.path)
+        if not m or m.group(1) not in stub.parts:
+            return self._notFound()
+        with stub.lock:
+            error = stub.partErrors.pop(int(m.group(2)), None)
+        if error:
+            return self._sendError(*error)
+        md5 = hashlib.md5(body)
+        if self.headers.get('Content-MD5') != base64.b64encode(md5.digest()).decode('ascii'):
+            return self._send(400, {'ResponseStatus': {'ErrorCode': 'BadDigest', 'Message': 'Content-MD5 mismatch'}})
+        stub.parts[m.group(1)][int(m.group(2))] = body
+        self._send(200, {'Response': {'ETag': md5.hexdigest()}, 'ResponseStatus': {}})
+
+    def _sendContent(self, Id):
+        stub = self.server.stub
+        if Id not in stub.files:
+            return self._send(404, b'')
+        data = stub.files[Id]['data']
+        headers = {'ETag': '"%s"' % stub.files[Id]['etag']}
+        m = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if m:
+            start, end = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+            if start > end:
+                return self._send(416, b'')
+            with stub.lock:
+                stub.ranges.append((start, end))
+                delay = stub.contentDelays.pop(start, 0)
+                error = stub.contentErrors.pop(start, None)
+            time.sleep(delay)
+            if error:
+                return self._sendError(*error)
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, len(data))
+            return self._sendBody(206, data, start, end + 1, headers)
+        self._sendBody(200, data, 0, len(data), headers)
+
+    def _sendBody(self, status, data, start, end, headers):
+        # write large bodies from a memoryview, without copying the range
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        self.wfile.write(memoryview(data)[start:end])
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients that stop reading a body early (eg. cancelled downloads) aren't errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class StubBaseSpace(object):
+    '''
+    Serves a small subset of the BaseSpace REST api from a thread in the current process
+    '''
+    def __init__(self):
+        self.files    = {}
+        self.parts    = {}
+        self.lists    = {}
+        self.listLatency  = 0     # seconds to wait before answering a list request
+        self.listFailures = 0     # the number of list requests to drop
+        self.listLimitCap = None  # the largest page size served, whatever Limit is requested
+        self.urlTtl       = None  # seconds that content urls are signed for, or None for urls that don't expire
+        self.contentDelays = {}   # first byte of a ranged content request: seconds to wait before answering it, once
+        self.contentErrors = {}   # first byte of a ranged content request: (status, Retry-After) to answer it with, once
+        self.partErrors    = {}   # upload part number: (status, Retry-After) to answer its PUT with, once
+        self.ranges   = []
+        self.requests = []
+        self.lock     = threading.Lock()
+        self.server   = None
+
+    def addFile(self, Id, name, data, path=None, etag=None):
+        '''
+        Add a file that can be retrieved with getFileById() and downloaded, with the ETag of a single part upload by default
+        '''
+        self.files[Id] = {'Id': Id, 'Name': name, 'Path': path or name, 'data': data,
+                          'etag': etag or hashlib.md5(data).hexdigest()}
+
+    def addList(self, path, items):
+        '''
+        Serve a list of items (json dicts) at a path such as 'projects/1/samples'
+        '''
+        self.lists[path] = items
+
+    def newFileId(self):
+        with self.lock:
+            return 'u%d' % (len(self.parts) + 1)
+
+    def fileJson(self, f):
+        return {'Id': f['Id'], 'Name': f['Name'], 'Path': f['Path'], 'Size': len(f['data']),
+                'Href': '%s/files/%s' % (VERSION, f['Id']), 'UploadStatus': f.get('UploadStatus', 'complete'),
+                'ContentType': 'application/octet-stream'}
+
+    def start(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.stub = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def apiServer(self):
+        return 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def api(self, **kwargs):
+        '''
+        Returns a BaseSpaceAPI instance that talks to this server
+        '''
+        return BaseSpaceAPI(clientKey='key', clientSecret='secret', apiServer=self.apiServer,
+                            version=VERSION, AccessToken='token', **kwargs)
@@ -1841,8 +1841,8 @@ class TestListResponseMethods(TestCase):
     def testConvertToObjectList(self):
         lr = ListResponse.ListResponse()
         lr.Response = ResourceList.ResourceList()
-        lr.Response.Items = ['{ "Id": "123", "Href": "asdf", "UserOwnedBy": { "Id":"321" }, "TotalSize": 555 }',
-                             '{ "Id": "456", "Href": "asdf", "UserOwnedBy": { "Id":"321" }, "TotalSize": 666 }',]
+        lr.Response.Items = [{ "Id": "123", "Href": "asdf", "UserOwnedBy": { "Id":"321" }, "TotalSize": 555 },
+                             { "Id": "456", "Href": "asdf", "UserOwnedBy": { "Id":"321" }, "TotalSize": 666 },]
         objs = lr._convertToObjectList()
         self.assertEqual(objs[0]['Id'], "123")
         self.assertEqual(objs[1]['TotalSize'], 666)
@@ -2158,10 +2158,7 @@ class TestAPIClientMethods(TestCase):
         resourcePath                 = resourcePath.replace('{partNumber}', str(1))        
         headerParams                 = {'Content-MD5': md5}
         transFile                    = tconst['file_small_upload']
-        putResp = self.apiClient.__putCall__(resourcePath=self.apiClient.apiServerAndVersion + resourcePath, headers=headerParams, transFile=transFile)
-        #print "RESPONSE is: " + putResp        
-        jsonResp =  putResp.split()[-1] # normally done in callAPI()
-        dictResp = json.loads(jsonResp)
+        dictResp = self.apiClient.__putCall__(resourcePath=self.apiClient.apiServerAndVersion + resourcePath, headers=headerParams, transFile=transFile)
         self.assertTrue('Response' in dictResp, 'Successful force post should return json with Response attribute: ' + str(dictResp))       
         self.assertTrue('ETag' in dictResp['Response'], 'Successful force post should return json with Response with Id attribute: ' + str(dictResp))                                                                    
 